@@ -0,0 +1,239 @@
+"""
+One-time codes mailed to customers. A consultation code opens the
+customer's data to a huissier for ``DATA_TIMEOUT`` seconds; a loan code
+lets a huissier register one loan against the customer within
+``LOAN_REGISTER_TIMEOUT`` seconds.
+
+Each code has a key holding the customer's NPI, claimed with SET NX so two
+customers never share a code, and spent with GETDEL so a loan code is used
+once. A second key per (purpose, NPI) points at the outstanding code while
+it may still be mailed again (until ``CODE_REUSE_MIN_TTL`` seconds before it
+expires); it is claimed with SET NX too, so of concurrent requests only one
+issues a code and the others reuse it.
+
+``CODE_STORE_BACKEND`` picks where they live: "redis", "memory" for
+single-process installs without Redis, or "database" (the ``IssuedCode``
+table). The three stores behave the same.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from score.utils import generate_random_code
+from .models import IssuedCode
+
+PURPOSES = {
+    "consultation": "DATA_TIMEOUT",
+    "loan": "LOAN_REGISTER_TIMEOUT",
+}
+
+
+def lifetime(purpose):
+    return getattr(settings, PURPOSES[purpose])
+
+
+class RedisCodeStore:
+    def __init__(self, prefix=None):
+        self.prefix = prefix or settings.CODE_STORE_KEY_PREFIX
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def code_key(self, purpose, code):
+        return f"{self.prefix}:{purpose}:{code}"
+
+    def npi_key(self, purpose, npi):
+        return f"{self.prefix}:{purpose}:npi:{npi}"
+
+    def issue(self, purpose, npi):
+        """
+        Return ``(code, issued)``: the outstanding code of ``npi`` if it is
+        valid for at least ``CODE_REUSE_MIN_TTL`` more seconds (``issued``
+        False), else a new one.
+        """
+        ttl = lifetime(purpose)
+        while (True):
+            code = generate_random_code()
+            while (not self.redis.set(self.code_key(purpose, code), npi, nx=True, ex=ttl)):
+                code = generate_random_code()
+            reusable = max(ttl - settings.CODE_REUSE_MIN_TTL, 1)
+            if (self.redis.set(self.npi_key(purpose, npi), code, nx=True, ex=reusable)):
+                return code, True
+            # Another request holds a code for this NPI: give ours back and reuse theirs
+            self.redis.delete(self.code_key(purpose, code))
+            current = self.redis.get(self.npi_key(purpose, npi))
+            if (current):
+                return current.decode(), False
+
+    def peek(self, purpose, code):
+        """NPI the valid ``code`` was issued for, or None."""
+        npi = self.redis.get(self.code_key(purpose, code))
+        return npi.decode() if npi else None
+
+    def consume(self, purpose, code):
+        """Like ``peek``, and spend the code: None for every later call."""
+        npi = self.redis.getdel(self.code_key(purpose, code))
+        if (not npi):
+            return None
+        npi = npi.decode()
+        self.redis.delete(self.npi_key(purpose, npi))
+        return npi
+
+
+class MemoryCodeStore:
+    """
+    Codes in a dict of this process: each worker process would have its own,
+    so only for installs served by one process (and tests).
+
+    Keys are filed in a hashed timing wheel of ``slots`` one-second slots, by
+    expiry second; each call sweeps the slots the clock went past since the
+    previous one, so expiry costs O(1) per key. Keys due in a later turn of
+    the wheel stay in their slot. Reads check the deadline themselves.
+    """
+
+    slots = 1024
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (value, deadline)
+        self.wheel = [set() for _ in range(self.slots)]
+        self.tick = int(clock())
+
+    def _sweep(self, now):
+        tick = int(now)
+        # The current second again: keys due later within it were left there
+        for second in range(max(self.tick, tick - self.slots + 1), tick + 1):
+            slot = self.wheel[second % self.slots]
+            for key in [key for key in slot if self.entries[key][1] <= now]:
+                slot.discard(key)
+                del self.entries[key]
+        self.tick = max(self.tick, tick)
+
+    def _get(self, key, now):
+        entry = self.entries.get(key)
+        return entry if entry and entry[1] > now else None
+
+    def _set(self, key, value, deadline):
+        self._delete(key)
+        self.entries[key] = (value, deadline)
+        self.wheel[int(deadline) % self.slots].add(key)
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if (entry):
+            self.wheel[int(entry[1]) % self.slots].discard(key)
+        return entry
+
+    def issue(self, purpose, npi):
+        ttl = lifetime(purpose)
+        with self.lock:
+            now = self.clock()
+            self._sweep(now)
+            current = self._get(("npi", purpose, npi), now)
+            if (current and current[1] - now >= settings.CODE_REUSE_MIN_TTL):
+                return current[0], False
+            code = generate_random_code()
+            while (self._get(("code", purpose, code), now)):
+                code = generate_random_code()
+            self._set(("code", purpose, code), npi, now + ttl)
+            self._set(("npi", purpose, npi), code, now + ttl)
+        return code, True
+
+    def peek(self, purpose, code):
+        with self.lock:
+            now = self.clock()
+            self._sweep(now)
+            entry = self._get(("code", purpose, code), now)
+        return entry[0] if entry else None
+
+    def consume(self, purpose, code):
+        with self.lock:
+            now = self.clock()
+            self._sweep(now)
+            if (not self._get(("code", purpose, code), now)):
+                return None
+            npi = self._delete(("code", purpose, code))[0]
+            self._delete(("npi", purpose, npi))
+        return npi
+
+
+class DatabaseCodeStore:
+    """
+    Codes in the ``IssuedCode`` table, for SQLite (3.35+) or PostgreSQL. An
+    INSERT ... ON CONFLICT DO NOTHING on the unique (purpose, code) plays SET
+    NX, and DELETE ... RETURNING plays GETDEL. Expired rows are purged through
+    the ``expires_at`` index each time a code is issued.
+
+    An issue runs in a transaction that first takes a write lock (the purge
+    on SQLite, an advisory lock on the purpose and NPI on PostgreSQL), so
+    concurrent requests for one NPI look for the outstanding code in turn.
+
+    The statements are written out rather than built by the ORM: compiling
+    them cost more than running them (under 300 cycles/s on SQLite).
+    """
+
+    def __init__(self):
+        quote = connection.ops.quote_name
+        table = quote(IssuedCode._meta.db_table)
+        self.select_code = (
+            f"SELECT code FROM {table} WHERE purpose = %s AND npi = %s AND expires_at >= %s "
+            f"ORDER BY expires_at DESC LIMIT 1"
+        )
+        self.purge = f"DELETE FROM {table} WHERE expires_at <= %s"
+        self.lock = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+        self.insert = (
+            f"INSERT INTO {table} (purpose, code, npi, expires_at) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (purpose, code) DO NOTHING"
+        )
+        self.select_npi = f"SELECT npi FROM {table} WHERE purpose = %s AND code = %s AND expires_at > %s"
+        self.delete = f"DELETE FROM {table} WHERE purpose = %s AND code = %s AND expires_at > %s RETURNING npi"
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _when(self, seconds=0):
+        return connection.ops.adapt_datetimefield_value(timezone.now() + timedelta(seconds=seconds))
+
+    def issue(self, purpose, npi):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if (connection.vendor == "postgresql"):
+                cursor.execute(self.lock, [f"{purpose}:{npi}"])
+            cursor.execute(self.purge, [self._when()])
+            cursor.execute(self.select_code, [purpose, npi, self._when(settings.CODE_REUSE_MIN_TTL)])
+            current = cursor.fetchone()
+            if (current):
+                return current[0], False
+            expires_at = self._when(lifetime(purpose))
+            while (True):
+                code = generate_random_code()
+                cursor.execute(self.insert, [purpose, code, npi, expires_at])
+                if (cursor.rowcount == 1):
+                    return code, True
+
+    def peek(self, purpose, code):
+        return self._fetch(self.select_npi, [purpose, code, self._when()])
+
+    def consume(self, purpose, code):
+        # Of concurrent requests, only the one whose DELETE removed the row gets the NPI
+        return self._fetch(self.delete, [purpose, code, self._when()])
+
+
+memory_store = MemoryCodeStore()
+
+
+def get_code_store():
+    if settings.CODE_STORE_BACKEND == "memory":
+        return memory_store
+    if settings.CODE_STORE_BACKEND == "database":
+        return DatabaseCodeStore()
+    return RedisCodeStore()
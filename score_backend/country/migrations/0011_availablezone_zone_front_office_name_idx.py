@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('country', '0010_remove_availablezone_localisation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='availablezone',
+            index=models.Index(fields=['front_office', 'name'], name='zone_front_office_name_idx'),
+        ),
+    ]
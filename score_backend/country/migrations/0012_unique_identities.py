@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('country', '0011_availablezone_zone_front_office_name_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='huissier',
+            name='npi',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='financial',
+            constraint=models.UniqueConstraint(fields=('npi', 'name'), name='financial_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='frontoffice',
+            constraint=models.UniqueConstraint(fields=('name', 'npi', 'phone', 'country'), name='front_office_unique'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('country', '0012_unique_identities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IssuedCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(max_length=20)),
+                ('code', models.CharField(max_length=20)),
+                ('npi', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['purpose', 'npi', 'expires_at'], name='issued_code_npi_idx')],
+                'constraints': [models.UniqueConstraint(fields=('purpose', 'code'), name='issued_code_unique')],
+            },
+        ),
+    ]
@@ -40,6 +40,11 @@ class FrontOffice(models.Model):
     user = models.OneToOneField(ScoreUser, on_delete=models.CASCADE)  # Liaison à un utilisateur (qui peut se connecter)
     country = models.ForeignKey(Country, on_delete=models.CASCADE)  # Liaison à un pays
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'npi', 'phone', 'country'], name='front_office_unique'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -47,13 +52,16 @@ class AvailableZone(models.Model):
     name = models.CharField(max_length=500)
     front_office = models.ForeignKey(FrontOffice, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [models.Index(fields=['front_office', 'name'], name='zone_front_office_name_idx')]
+
     def __str__(self):
         return self.name
 
 class Huissier(models.Model):
     user = models.OneToOneField(ScoreUser, on_delete=models.CASCADE, related_name='huissier')
     front_office = models.ForeignKey(FrontOffice, on_delete=models.CASCADE)  # Liaison au front office qui l’a créé
-    npi = models.CharField(max_length=100)
+    npi = models.CharField(max_length=100, unique=True)
     phone = models.CharField(max_length=200, verbose_name="Numéro de téléphone", default="00000")
     picture = models.ImageField(upload_to='huissiers/', null=True, blank=True)
     zone = models.CharField(max_length=500, verbose_name="Zone de front office", default="")
@@ -71,5 +79,23 @@ class Financial(models.Model):
     picture = models.ImageField(upload_to='financials/', null=True, blank=True)
     npi = models.CharField(max_length=100)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['npi', 'name'], name='financial_unique')]
+
     def __str__(self):
         return self.name
+
+
+class IssuedCode(models.Model):
+    """Consultation and loan codes, when CODE_STORE_BACKEND is "database" (see country.codes)."""
+    purpose = models.CharField(max_length=20)
+    code = models.CharField(max_length=20)
+    npi = models.CharField(max_length=100)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['purpose', 'code'], name='issued_code_unique')]
+        indexes = [models.Index(fields=['purpose', 'npi', 'expires_at'], name='issued_code_npi_idx')]
+
+    def __str__(self):
+        return f"{self.purpose} code of {self.npi}"
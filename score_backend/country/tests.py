@@ -1,3 +1,417 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework.test import APIClient
+
+from customer.models import Customer, Loan
+from score import bloom
+from score.testing import (
+    Endpoint, FakeRedis, QueryBudgetTestCase, QueryPlanTestCase, full_scans, make_customers, make_huissier,
+)
+from users.models import OutboundEmail
+from .codes import DatabaseCodeStore, MemoryCodeStore, RedisCodeStore, get_code_store
+from .models import AvailableZone, Huissier, IssuedCode
+
+
+class QueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 30)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_zones(self):
+        self.client.force_authenticate(self.huissier.front_office.user)
+        self.assertEndpointIndexed(self.client.get, "/country/get-zones/")
+
+    def test_zone_lookup(self):
+        self.assertIndexed(AvailableZone.objects.filter(name="Z1", front_office=self.huissier.front_office))
+
+    def test_customer_data(self):
+        self.client.force_authenticate(self.huissier.user)
+        with mock.patch("country.codes.get_redis_connection", return_value=FakeRedis()):
+            code, _ = get_code_store().issue("consultation", self.customers[3].npi)
+            self.assertEndpointIndexed(self.client.get, "/country/customer-data/", {"code": code})
+
+    def test_issued_code_statements(self):
+        store = DatabaseCodeStore()
+        now = store._when()
+        for sql, params in [
+            (store.select_code, ["loan", "BEN0000003", now]),
+            (store.purge, [now]),
+            (store.select_npi, ["loan", "code", now]),
+            (store.delete, ["loan", "code", now]),
+        ]:
+            self.assertEqual(full_scans(sql, params), [], f"Full table scan in:\n{sql}")
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class QueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        front_office = cls.huissier.front_office
+        AvailableZone.objects.bulk_create([AvailableZone(name=f"Removable {run}", front_office=front_office) for run in range(2)])
+
+    def setUp(self):
+        redis = FakeRedis()
+        redis.set(get_code_store().code_key("consultation", "code"), "BEN0000003")
+        patcher = mock.patch("country.codes.get_redis_connection", return_value=redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def endpoints(self):
+        country = self.huissier.front_office.country.user
+        front_office = self.huissier.front_office.user
+        huissier = self.huissier.user
+        return [
+            Endpoint("/country/create-front-office/", country, "post", lambda run: {
+                'front_office_name': f"Office {run}", 'username': f"office-{run}", 'npi': f"OFFICE{run}",
+                'phone': "0123", 'email': f"office{run}@ben.org",
+            }, max_queries=7),
+            Endpoint("/country/add-zone/", front_office, "post", lambda run: {'name': f"Zone {run}"}, max_queries=3),
+            Endpoint("/country/remove-zone/", front_office, "post", lambda run: {'name': f"Removable {run}"}, max_queries=3),
+            Endpoint("/country/get-zones/", front_office, max_queries=2),
+            Endpoint("/country/create-huissier/", front_office, "post", lambda run: {
+                'username': f"huissier-{run}", 'npi': f"HUISSIER{run}", 'phone': "0123",
+                'email': f"huissier{run}@ben.org", 'zone': "Z1",
+            }, max_queries=8),
+            Endpoint("/country/create-conseiller/", front_office, "post", lambda run: {
+                'username': f"conseiller-{run}", 'name': f"Conseiller {run}", 'npi': f"CONSEILLER{run}",
+                'phone': "0123", 'email': f"conseiller{run}@ben.org",
+            }, max_queries=7),
+            # A customer per run: a code still outstanding would be reused, without the queued email
+            Endpoint("/country/consultation-request/", huissier, "post", lambda run: {
+                'npi': f"BEN000000{run}", 'document_number': "1",
+            }, max_queries=2),
+            Endpoint("/country/customer-data/?code=code", huissier, max_queries=3),
+            Endpoint("/country/get-loan-code/", huissier, "post", lambda run: {'npi': f"BEN000000{run}"}, max_queries=2),
+            # A loan code is spent by the request: each run gets its own. The
+            # loan and the spending share a transaction (a savepoint here)
+            Endpoint("/country/register-loan/", huissier, "post", lambda run: {
+                'code': get_code_store().issue("loan", "BEN0000003")[0], 'amount': "500", 'periodicity': "monthly",
+                'deadline_amount': "50", 'deadline': "2030-01-01", 'creditor_npi': "BEN0000004",
+            }, max_queries=11),
+        ]
+
+
+class CodeStoreConformance:
+    """
+    What every code store must do. Subclasses set up ``self.store`` and
+    implement ``advance``, moving the store's clock forward.
+    """
+
+    cycles = 2000
+
+    def advance(self, seconds):
+        raise NotImplementedError
+
+    def test_outstanding_code_is_reused(self):
+        code, issued = self.store.issue("consultation", "BEN0000000")
+        self.assertTrue(issued)
+        self.assertEqual(self.store.issue("consultation", "BEN0000000"), (code, False))
+        self.assertNotEqual(self.store.issue("consultation", "BEN0000001")[0], code)
+
+    def test_expiring_code_is_replaced(self):
+        code, _ = self.store.issue("consultation", "BEN0000000")
+        self.advance(settings.DATA_TIMEOUT - settings.CODE_REUSE_MIN_TTL + 5)
+        new_code, issued = self.store.issue("consultation", "BEN0000000")
+        self.assertTrue(issued)
+        self.assertNotEqual(new_code, code)
+        # Until it expires, the older code still works
+        self.assertEqual(self.store.peek("consultation", code), "BEN0000000")
+
+    def test_codes_expire(self):
+        code, _ = self.store.issue("loan", "BEN0000000")
+        self.advance(settings.LOAN_REGISTER_TIMEOUT + 1)
+        self.assertIsNone(self.store.peek("loan", code))
+        self.assertIsNone(self.store.consume("loan", code))
+        self.assertTrue(self.store.issue("loan", "BEN0000000")[1])
+
+    def test_codes_do_not_collide(self):
+        taken, _ = self.store.issue("loan", "BEN0000000")
+        with mock.patch("country.codes.generate_random_code", side_effect=[taken, taken, "fresh"]):
+            self.assertEqual(self.store.issue("loan", "BEN0000001"), ("fresh", True))
+        self.assertEqual(self.store.peek("loan", taken), "BEN0000000")
+
+    def test_code_is_consumed_once(self):
+        code, _ = self.store.issue("loan", "BEN0000000")
+        self.assertEqual(self.store.consume("loan", code), "BEN0000000")
+        self.assertIsNone(self.store.consume("loan", code))
+        self.assertIsNone(self.store.peek("loan", code))
+        self.assertTrue(self.store.issue("loan", "BEN0000000")[1])
+
+    def test_purposes_are_separate(self):
+        code, _ = self.store.issue("consultation", "BEN0000000")
+        self.assertIsNone(self.store.peek("loan", code))
+        self.assertIsNone(self.store.consume("loan", code))
+        self.assertEqual(self.store.peek("consultation", code), "BEN0000000")
+
+    def test_many_cycles(self):
+        for i in range(self.cycles):
+            code, _ = self.store.issue("loan", f"BEN{i:07d}")
+            self.assertEqual(self.store.peek("loan", code), f"BEN{i:07d}")
+            self.assertEqual(self.store.consume("loan", code), f"BEN{i:07d}")
+
+
+class RedisCodeStoreTests(CodeStoreConformance, TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("country.codes.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = RedisCodeStore()
+
+    def advance(self, seconds):
+        self.redis.expires = {key: expires - seconds for key, expires in self.redis.expires.items()}
+
+    def test_concurrent_issues_share_a_code(self):
+        npi_key = self.store.npi_key("loan", "BEN0000000")
+        set_key = self.redis.set
+        racing = {}
+
+        def claimed_meanwhile(key, value, **kwargs):
+            # Another request issues a code between our code key and our NPI key
+            if (key == npi_key and not racing):
+                racing["other"] = None
+                racing["other"] = self.store.issue("loan", "BEN0000000")
+            return set_key(key, value, **kwargs)
+
+        with mock.patch.object(self.redis, "set", side_effect=claimed_meanwhile):
+            code, issued = self.store.issue("loan", "BEN0000000")
+        self.assertEqual(racing["other"], (code, True))
+        self.assertFalse(issued)
+        # The code we had reserved was given back
+        live = [key for key in list(self.redis.values) if self.redis._live(key)]
+        self.assertEqual(live, [self.store.code_key("loan", code), npi_key])
+
+
+class MemoryCodeStoreTests(CodeStoreConformance, TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.store = MemoryCodeStore(clock=lambda: self.now)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def test_wheel_drops_expired_keys(self):
+        for i in range(50):
+            self.store.issue("consultation", f"BEN{i:07d}")
+        self.assertEqual(len(self.store.entries), 100)
+        self.advance(settings.DATA_TIMEOUT + 1)
+        self.store.peek("consultation", "code")
+        self.assertEqual(self.store.entries, {})
+        self.assertFalse(any(self.store.wheel))
+
+    @override_settings(DATA_TIMEOUT=3000)
+    def test_keys_outlive_a_turn_of_the_wheel(self):
+        code, _ = self.store.issue("consultation", "BEN0000000")
+        for _ in range(2):
+            self.advance(MemoryCodeStore.slots)
+            self.assertEqual(self.store.peek("consultation", code), "BEN0000000")
+        self.advance(3000 - 2 * MemoryCodeStore.slots)
+        self.assertIsNone(self.store.peek("consultation", code))
+        self.assertEqual(self.store.entries, {})
+
+
+class DatabaseCodeStoreTests(CodeStoreConformance, TestCase):
+    def setUp(self):
+        self.store = DatabaseCodeStore()
+
+    def advance(self, seconds):
+        IssuedCode.objects.update(expires_at=F("expires_at") - timedelta(seconds=seconds))
+
+    def test_expired_rows_are_purged(self):
+        self.store.issue("loan", "BEN0000000")
+        self.advance(settings.LOAN_REGISTER_TIMEOUT + 1)
+        self.store.issue("loan", "BEN0000001")
+        self.assertEqual(list(IssuedCode.objects.values_list("npi", flat=True)), ["BEN0000001"])
+
+
+class CodeViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        make_customers(cls.huissier, 2, loans_per_customer=0)
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("country.codes.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = get_code_store()
+        self.client = APIClient()
+        self.client.force_authenticate(self.huissier.user)
+
+    def test_consultation_request_mails_once(self):
+        for _ in range(2):
+            response = self.client.post("/country/consultation-request/", {'npi': "BEN0000000", 'document_number': "1"})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        call_command("send_queued_emails", "--once", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        code = self.redis.get(self.store.npi_key("consultation", "BEN0000000")).decode()
+        self.assertIn(code, mail.outbox[0].body)
+        # Delivered: asking again sends nothing
+        response = self.client.post("/country/consultation-request/", {'npi': "BEN0000000", 'document_number': "1"})
+        self.assertEqual(response.data, {"message": "Code already sent"})
+        self.assertFalse(OutboundEmail.objects.exists())
+        # Reading the data does not spend the code
+        for _ in range(2):
+            self.assertEqual(self.client.get("/country/customer-data/", {'code': code}).status_code, 200)
+
+    def test_failed_email_is_sent_again(self):
+        self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        email = OutboundEmail.objects.get()
+        OutboundEmail.objects.update(status="failed", attempts=8)
+        response = self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        self.assertEqual(response.data, {"message": "Code successfully generated"})
+        # The same email is due again, with its expiry
+        retried = OutboundEmail.objects.get()
+        self.assertEqual((retried.pk, retried.status, retried.attempts), (email.pk, "pending", 0))
+        self.assertEqual(retried.expires_at, email.expires_at)
+        self.assertLessEqual(retried.next_attempt_at, timezone.now())
+
+    def test_expired_code_email_is_dropped(self):
+        self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        email = OutboundEmail.objects.get()
+        self.assertAlmostEqual(
+            email.expires_at - email.created_at, timedelta(seconds=settings.LOAN_REGISTER_TIMEOUT),
+            delta=timedelta(seconds=1),
+        )
+        OutboundEmail.objects.update(expires_at=timezone.now())
+        call_command("send_queued_emails", "--once", stdout=StringIO())
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    @override_settings(EMAIL_QUEUE_ENABLED=False)
+    def test_lost_email_spends_the_code(self):
+        with mock.patch("score.utils.send_mail", return_value=0):
+            response = self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        self.assertEqual(response.status_code, 503)
+        response = self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        self.assertEqual(response.data, {"message": "Code successfully generated"})
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_loan_code_registers_one_loan(self):
+        code, _ = self.store.issue("loan", "BEN0000000")
+        data = {
+            'code': code, 'amount': "500", 'periodicity': "monthly", 'deadline_amount': "50",
+            'deadline': "2030-01-01", 'creditor_npi': "BEN0000001",
+        }
+        self.assertEqual(self.client.post("/country/register-loan/", data).status_code, 200)
+        response = self.client.post("/country/register-loan/", data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': "code expired"})
+        self.assertEqual(Loan.objects.filter(customer__npi="BEN0000000").count(), 1)
+
+    def test_invalid_deadline_keeps_the_code(self):
+        code, _ = self.store.issue("loan", "BEN0000000")
+        data = {
+            'code': code, 'amount': "500", 'periodicity': "monthly", 'deadline_amount': "50",
+            'deadline': "2025-13-40", 'creditor_npi': "BEN0000001",
+        }
+        response = self.client.post("/country/register-loan/", data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.store.peek("loan", code), "BEN0000000")
+
+    def test_failed_insert_keeps_the_code(self):
+        code, _ = self.store.issue("loan", "BEN0000000")
+        data = {
+            'code': code, 'amount': "500", 'periodicity': "monthly", 'deadline_amount': "50",
+            'deadline': "2030-01-01", 'creditor_npi': "BEN0000001",
+        }
+        with mock.patch("country.views.Loan.objects.create", side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            self.client.post("/country/register-loan/", data)
+        self.assertEqual(self.store.peek("loan", code), "BEN0000000")
+        # Nor is a loan left behind when the code turns out spent
+        self.store.consume("loan", code)
+        self.assertEqual(self.client.post("/country/register-loan/", data).status_code, 400)
+        self.assertFalse(Loan.objects.filter(customer__npi="BEN0000000").exists())
+
+    def test_email_reference_is_bounded(self):
+        customer = Customer.objects.get(npi="BEN0000000")
+        Customer.objects.filter(pk=customer.pk).update(npi="N" * 100)
+        self.client.post("/country/get-loan-code/", {'npi': "N" * 100})
+        self.assertEqual(OutboundEmail.objects.get().reference, f"loan:{customer.pk}")
+
+    def test_missing_or_unknown_code(self):
+        self.assertEqual(self.client.get("/country/customer-data/").status_code, 400)
+        self.assertEqual(self.client.get("/country/customer-data/", {'code': "nope"}).status_code, 400)
+
+    def test_redis_unavailable(self):
+        with mock.patch.object(self.redis, "get", side_effect=RedisError):
+            response = self.client.get("/country/customer-data/", {'code': "code"})
+        self.assertEqual(response.status_code, 503)
+
+    @override_settings(
+        CODE_STORE_BACKEND="memory", CACHES={'default': {'BACKEND': "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_without_redis(self):
+        self.client.post("/country/get-loan-code/", {'npi': "BEN0000000"})
+        code = OutboundEmail.objects.get().body.rsplit(" ", 1)[1]
+        response = self.client.post("/country/register-loan/", {
+            'code': code, 'amount': "500", 'periodicity': "monthly", 'deadline_amount': "50",
+            'deadline': "2030-01-01", 'creditor_npi': "BEN0000001",
+        })
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(BLOOM_FILTER_BITS=1 << 12, PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class BloomFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+
+    def setUp(self):
+        # A loaded, empty local copy: Redis is not involved
+        self.filter = bloom.BloomFilter()
+        self.filter.bitmap = bytearray((1 << 12) // 8)
+        self.filter.loaded_at = float("inf")
+        patcher = mock.patch.object(bloom, "_filter", self.filter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bits(self):
+        bitmap = bytearray(8)
+        bloom.set_bits(bitmap, [0, 9, 63])
+        self.assertEqual(bitmap, bytes([0x80, 0x40, 0, 0, 0, 0, 0, 0x01]))
+        self.assertTrue(bloom.has_bits(bitmap, [0, 63]))
+        self.assertFalse(bloom.has_bits(bitmap, [0, 1]))
+        self.assertEqual(len(set(bloom.offsets("huissier.npi", "HBEN"))), 7)
+
+    def test_definite_negative_skips_query(self):
+        huissiers = Huissier.objects.filter(npi="HBEN")
+        with self.assertNumQueries(0):
+            self.assertFalse(bloom.exists(huissiers, ("huissier.npi", "HBEN")))
+        self.filter.add([("huissier.npi", "HBEN")])
+        with self.assertNumQueries(1):
+            self.assertTrue(bloom.exists(huissiers, ("huissier.npi", "HBEN")))
+        self.assertEqual(self.filter.stats, {"negatives": 1, "positives": 1, "false_positives": 0})
+
+    def test_saved_rows_are_added(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Huissier.objects.filter(pk=self.huissier.pk).get().save()
+        self.assertTrue(self.filter.might_contain("huissier.npi", "HBEN"))
+        self.assertFalse(self.filter.might_contain("huissier.npi", "HOTHER"))
+
+    def test_missed_duplicate_hits_constraint(self):
+        # The filter does not know this NPI yet: the unique constraint answers
+        client = APIClient()
+        client.force_authenticate(self.huissier.front_office.user)
+        response = client.post("/country/create-huissier/", {
+            'username': "huissier-2", 'npi': "HBEN", 'phone': "0123", 'email': "huissier2@ben.org", 'zone': "Z1",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Huissier.objects.filter(user__username="huissier-2").exists())
@@ -10,24 +10,64 @@ from country.models import FrontOffice, Huissier, Financial, AvailableZone
 from django.contrib.auth.hashers import make_password
 from score.permissions import IsCountry, IsPasswordChanged, IsFrontOffice, IsHuissier
 from users.utils import generate_random_password
-from score.utils import generate_random_code, send_email
-# from django.core.cache import cache
-from django.conf import settings
-import redis
+from score.utils import send_email
+from users.outbox import retry
+from score.validators import validate_amount, validate_date
+from score import bloom
+from django.db import IntegrityError, transaction
+from redis.exceptions import RedisError
 from customer.serializers import CustomerListSerializer, LoanSerializer, ReceivableLoanSerializer
+from customer.percentiles import percentile
+from customer.loaders import CreditorNames, with_loans
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from .codes import get_code_store, lifetime
 from .serializers import ZoneSerializer
 
-cache = redis.StrictRedis(host='localhost', port=6379, db=0)
+
+def _mail_code(purpose, customer, subject, message):
+    """
+    Mail ``customer`` their ``purpose`` code, ``message`` being formatted
+    with it. The outstanding code is not mailed again once its email went
+    out; while that email is still queued, or failed, it is retried now.
+    The email is dropped unsent when the code expires.
+    """
+    store = get_code_store()
+    # By id: an NPI can be as long as the reference column
+    reference = f"{purpose}:{customer.pk}"
+    try:
+        code, issued = store.issue(purpose, customer.npi)
+    except RedisError:
+        return Response({
+            'error': "Code service unavailable"
+        }, status=503)
+    if (not issued):
+        return Response({
+            "message": "Code successfully generated" if retry(reference) else "Code already sent"
+        }, status=200)
+    data = {
+        'subject': subject,
+        'message': message.format(code=code),
+        'to': customer.email,
+        'reference': reference,
+        'expires_in': lifetime(purpose),
+    }
+    if (not send_email(data)):
+        # Sent from the request, and lost: spent, the code will not be reused
+        store.consume(purpose, code)
+        return Response({
+            'error': "Email could not be sent"
+        }, status=503)
+    return Response({
+        "message": "Code successfully generated"
+    }, status=200)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CreateFrontOffice(APIView):
     permission_classes = [IsAuthenticated, IsCountry, IsPasswordChanged]
 
     def post(self, request: Request):
-        user = request.user
-        country = user.country
+        country = request.actor.country
         name = request.data.get('front_office_name')
         username = request.data.get('username')
         npi = request.data.get('npi')
@@ -42,26 +82,30 @@ class CreateFrontOffice(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if ScoreUser.objects.filter(username=username, email=email).exists():
+        if bloom.exists(ScoreUser.objects.filter(username=username, email=email), ("user.username", username), ("user.email", email)):
             return Response({"error": "Un utilisateur avec ce NPI existe déjà."}, status=400)
-        if FrontOffice.objects.filter(name=name, npi=npi, phone=phone, country=country).exists():
+        if bloom.exists(FrontOffice.objects.filter(name=name, npi=npi, phone=phone, country=country), ("front_office.npi", npi), ("front_office.phone", phone)):
             return Response({"error": "Ce front office existe déjà"}, status=400)
 
-        new_user = ScoreUser.objects.create(
-            username=username,
-            email=email,
-            role="front office",
-            password=make_password(password),
-        )
-        new_user.save()
-        office = FrontOffice()
-        office.name = name
-        # office.localisation = localisation
-        office.npi = npi
-        office.phone = phone
-        office.country = country
-        office.user = new_user
-        office.save()
+        # The checks above may miss a concurrent insert: the constraints decide
+        try:
+            with transaction.atomic():
+                new_user = ScoreUser.objects.create(
+                    username=username,
+                    email=email,
+                    role="front office",
+                    password=make_password(password),
+                )
+                office = FrontOffice()
+                office.name = name
+                # office.localisation = localisation
+                office.npi = npi
+                office.phone = phone
+                office.country = country
+                office.user = new_user
+                office.save()
+        except IntegrityError:
+            return Response({"error": "Ce front office ou cet utilisateur existe déjà"}, status=400)
 
         return Response({"message": "Front-office créé avec succès.", 'password': password}, status=201)
 
@@ -71,8 +115,6 @@ class CreateHuissier(APIView):
     permission_classes = [IsAuthenticated, IsFrontOffice, IsPasswordChanged]
 
     def post(self, request):
-        user = request.user
-        
         username = request.data.get('username')
         npi = request.data.get('npi')
         phone = request.data.get('phone')
@@ -86,29 +128,30 @@ class CreateHuissier(APIView):
                 status=400
             )
 
-        if ScoreUser.objects.filter(username=username, email=email).exists():
+        if bloom.exists(ScoreUser.objects.filter(username=username, email=email), ("user.username", username), ("user.email", email)):
             return Response({"error": "Ce utilisateur existe déjà."}, status=400)
-        if (AvailableZone.objects.filter(name=zone, front_office=user.frontoffice).exists() == False):
+        if (AvailableZone.objects.filter(name=zone, front_office=request.actor.front_office).exists() == False):
             return Response({
                 'error': "Invalid zone"
             }, status=400)
-        if Huissier.objects.filter(npi=npi).exists():
+        if bloom.exists(Huissier.objects.filter(npi=npi), ("huissier.npi", npi)):
             return Response({"error": "Un utilisateur avec cet npi existe déjà."}, status=400)
-        new_user = ScoreUser.objects.create(
-            username=username,
-            email=email,
-            role="huissier",
-            password=make_password(password),
-        )
-        new_user.save()
-
-        huissier = Huissier.objects.create(
-            user=new_user,
-            front_office=user.frontoffice,
-            phone=phone,
-            npi=npi,
-        )
-        huissier.save()
+        try:
+            with transaction.atomic():
+                new_user = ScoreUser.objects.create(
+                    username=username,
+                    email=email,
+                    role="huissier",
+                    password=make_password(password),
+                )
+                Huissier.objects.create(
+                    user=new_user,
+                    front_office=request.actor.front_office,
+                    phone=phone,
+                    npi=npi,
+                )
+        except IntegrityError:
+            return Response({"error": "Un utilisateur avec ce nom, cet email ou cet npi existe déjà."}, status=400)
 
         return Response({"message": "Huissier créé avec succès.", 'password': password}, status=201)
 
@@ -117,19 +160,18 @@ class AddZone(APIView):
     permission_classes = [IsAuthenticated, IsFrontOffice, IsPasswordChanged]
 
     def post(self, request: Request):
-        user = request.user
         name = request.data.get("name")
         if (not all([name])):
             return Response({
                 'error': "Les champs name & localisation sont requis"
             }, status=400)
-        if (AvailableZone.objects.filter(name=name, front_office=user.frontoffice).exists()):
+        if (AvailableZone.objects.filter(name=name, front_office=request.actor.front_office).exists()):
             return Response({
                 'error': "This zone already exists"
             }, status=400)
         AvailableZone.objects.create(
             name=name,
-            front_office=user.frontoffice
+            front_office=request.actor.front_office
         )
         return Response({
             'message': "Zone added"
@@ -139,8 +181,7 @@ class Zones(APIView):
     permission_classes = [IsAuthenticated, IsFrontOffice, IsPasswordChanged]
 
     def get(self, request: Request):
-        user = request.user
-        zone = AvailableZone.objects.filter(front_office=user.frontoffice)
+        zone = AvailableZone.objects.filter(front_office=request.actor.front_office)
         return Response({
             'zones': ZoneSerializer(zone, many=True).data
         })
@@ -151,14 +192,13 @@ class RemoveZone(APIView):
     permission_classes = [IsAuthenticated, IsFrontOffice, IsPasswordChanged]
 
     def post(self, request: Request):
-        user = request.user
         name = request.data.get("name")
         if not name:
             return Response({
                 'error': "Le champs name est requis"
             }, status=400)
         try:
-            zone = AvailableZone.objects.get(name=name, front_office=user.frontoffice)
+            zone = AvailableZone.objects.get(name=name, front_office=request.actor.front_office)
         except AvailableZone.DoesNotExist:
             return Response({
                 'error': "Zone not found"
@@ -173,8 +213,6 @@ class CreateConseillerFinancier(APIView):
     permission_classes = [IsAuthenticated, IsFrontOffice, IsPasswordChanged]
 
     def post(self, request):
-        user = request.user
-        
         username = request.data.get("username")
         email = request.data.get('email')
         password = generate_random_password()
@@ -188,24 +226,27 @@ class CreateConseillerFinancier(APIView):
                 status=400
             )
 
-        if ScoreUser.objects.filter(username=username, email=email).exists():
+        if bloom.exists(ScoreUser.objects.filter(username=username, email=email), ("user.username", username), ("user.email", email)):
             return Response({"error": "Ce utilisateur existe déjà."}, status=400)
-        if Financial.objects.filter(npi=npi, name=name).exists():
+        if bloom.exists(Financial.objects.filter(npi=npi, name=name), ("financial.npi", npi)):
             return Response({"error": "Ce conseiller financier existe déjà."}, status=400)
-        new_user = ScoreUser.objects.create(
-            email=email,
-            username=username,
-            password=make_password(password),
-            role="conseiller"
-        )
-
-        Financial.objects.create(
-            user=new_user,
-            front_office=user.frontoffice,
-            name=name,
-            phone=phone,
-            npi=npi,
-        )
+        try:
+            with transaction.atomic():
+                new_user = ScoreUser.objects.create(
+                    email=email,
+                    username=username,
+                    password=make_password(password),
+                    role="conseiller"
+                )
+                Financial.objects.create(
+                    user=new_user,
+                    front_office=request.actor.front_office,
+                    name=name,
+                    phone=phone,
+                    npi=npi,
+                )
+        except IntegrityError:
+            return Response({"error": "Ce conseiller financier ou cet utilisateur existe déjà."}, status=400)
         return Response({"message": "Conseiller financier créé avec succès.", 'password': password}, status=201)
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -229,20 +270,9 @@ class ConsultCustomerAccount(APIView):
                 "error": "No customer found with the given NPI."
             }, status=404)
 
-        # Génère un code unique aléatoire
-        unique_code = generate_random_code()
-        while (cache.get(unique_code) != None):
-            unique_code = generate_random_code()
-        cache.set(unique_code, npi, ex=settings.DATA_TIMEOUT)
-        data = {
-            'subject': "Code de consultation",
-            'message': f"Votre code de consultation de compte: {unique_code}",
-            'to': customer.email
-        }
-        send_email(data)
-        return Response({
-            "message": "Code successfully generated"
-        }, status=200)
+        return _mail_code(
+            "consultation", customer, "Code de consultation", "Votre code de consultation de compte: {code}",
+        )
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CheckConsultationCode(APIView):
@@ -250,20 +280,32 @@ class CheckConsultationCode(APIView):
 
     def get(self, request: Request):
         code = request.GET.get('code')
-        npi = cache.get(code).decode()
+        if not code:
+            return Response({
+                'error': "Invalid code"
+            }, status=400)
+        try:
+            npi = get_code_store().peek("consultation", code)
+        except RedisError:
+            return Response({
+                'error': "Code service unavailable"
+            }, status=503)
         if not npi:
             return Response({
                 'error': "Invalid code"
             }, status=400)
         try:
-            customer = Customer.objects.get(npi=npi)
+            customer = with_loans(Customer.objects.select_related('features')).get(npi=npi)
         except Customer.DoesNotExist:
             return Response({
                 'error': "Invalid code"
             }, status=400)
-        receivables = Loan.objects.filter(creditor_npi=customer.npi)
-        parsed_customer = CustomerListSerializer(customer).data
+        receivables = customer.receivables.select_related('customer')
+        parsed_customer = CustomerListSerializer(customer, context={
+            'creditor_names': CreditorNames.for_customers([customer])
+        }).data
         parsed_customer["receivables"] = ReceivableLoanSerializer(receivables, many=True).data
+        parsed_customer["percentile"] = percentile(customer.country_id, customer.credit_score)
         return Response({
             'customer': parsed_customer
         }, status=200)
@@ -284,20 +326,9 @@ class RegisterLoanCode(APIView):
             return Response({
                 'error': "customer not found"
             }, status=404)
-        # Génère un code unique aléatoire
-        unique_code = generate_random_code()
-        while (cache.get(unique_code)):
-            unique_code = generate_random_code()
-        cache.set(unique_code, npi, ex=settings.DATA_TIMEOUT)
-        data = {
-            'subject': "Code d'enregistrement de dette",
-            'message': f"Votre code d'enregistrement de dette: {unique_code}",
-            'to': customer.email
-        }
-        send_email(data)
-        return Response({
-            "message": "Code successfully generated"
-        }, status=200)
+        return _mail_code(
+            "loan", customer, "Code d'enregistrement de dette", "Votre code d'enregistrement de dette: {code}",
+        )
 
 @method_decorator(csrf_exempt, name='dispatch')
 class RegisterLoan(APIView):
@@ -318,13 +349,28 @@ class RegisterLoan(APIView):
             return Response({
                 'error': "Invalid periodicity field"
             }, status=400)
+        if (validate_amount(amount) is None or validate_amount(deadline_amount) is None):
+            return Response({
+                'error': "Invalid amount"
+            }, status=400)
+        deadline = validate_date(deadline)
+        if (not deadline):
+            return Response({
+                'error': "Invalid deadline, expected YYYY-MM-DD"
+            }, status=400)
         try:
             creditor = Customer.objects.get(npi=creditor_npi)
         except Customer.DoesNotExist:
             return Response({
                 'error': "Invalid creditor npi"
             }, status=400)
-        npi = cache.get(code).decode()
+        store = get_code_store()
+        try:
+            npi = store.peek("loan", code)
+        except RedisError:
+            return Response({
+                'error': "Code service unavailable"
+            }, status=503)
         if (not npi):
             return Response({
                 'error': "code expired"
@@ -339,14 +385,31 @@ class RegisterLoan(APIView):
             return Response({
                 'error': "Invalid creditor npi"
             }, status=400)
-        Loan.objects.create(
-            amount=amount,
-            periodicity=periodicity,
-            deadline_amount=deadline_amount,
-            deadline=deadline,
-            customer=customer,
-            creditor_npi=creditor_npi
-        )
+        # Spent last, and atomically: one loan per code even under concurrent
+        # requests. The loan is rolled back when the code could not be spent,
+        # and a failed insert leaves the code unspent.
+        with transaction.atomic():
+            Loan.objects.create(
+                amount=amount,
+                periodicity=periodicity,
+                deadline_amount=deadline_amount,
+                deadline=deadline,
+                customer=customer,
+                creditor=creditor,
+                creditor_npi=creditor_npi
+            )
+            try:
+                spent = store.consume("loan", code)
+            except RedisError:
+                transaction.set_rollback(True)
+                return Response({
+                    'error': "Code service unavailable"
+                }, status=503)
+            if (spent != npi):
+                transaction.set_rollback(True)
+                return Response({
+                    'error': "code expired"
+                }, status=400)
         return Response({
             'message': "loan successfully registered"
         })
@@ -0,0 +1,68 @@
+"""
+Overdue-alert index.
+
+``OverdueAlert`` holds one row per pending loan of a customer followed by a
+huissier, keyed by deadline, so the loans overdue on any given day are a
+range read and day rollover needs no write. The loan/repayment signals keep
+rows current; ``sweep`` repairs what bulk writes and ``.update()`` bypass.
+"""
+from django.db.models import prefetch_related_objects
+
+from users.serializers import LoanSerializer
+from .models import Loan, OverdueAlert
+
+
+def overdue_alerts(huissier, today):
+    """Serialized overdue loans of ``huissier``, oldest deadline first."""
+    return list(
+        OverdueAlert.objects.filter(huissier=huissier, deadline__lt=today)
+        .order_by('deadline', 'loan_id').values_list('data', flat=True)
+    )
+
+
+def refresh_alerts(loans):
+    """Rebuild the alert rows of ``loans``, a queryset or a list of loans."""
+    loans = list(loans)
+    if not loans:
+        return
+    # Relations already loaded on the instances are not fetched again.
+    prefetch_related_objects(loans, 'customer', 'repayments')
+    alerts = [
+        OverdueAlert(
+            loan=loan, huissier_id=loan.customer.huissier_id, deadline=loan.deadline,
+            data=LoanSerializer(loan).data,
+        )
+        for loan in loans
+        if loan.status == 'pending' and loan.customer.huissier_id is not None
+    ]
+    if len(alerts) < len(loans):
+        OverdueAlert.objects.filter(loan__in=[loan.pk for loan in loans]).exclude(
+            loan__in=[alert.loan_id for alert in alerts]
+        ).delete()
+    if alerts:
+        OverdueAlert.objects.bulk_create(
+            alerts, update_conflicts=True, unique_fields=['loan'],
+            update_fields=['huissier', 'deadline', 'data'],
+        )
+
+
+def sweep(chunk_size=2000):
+    """
+    Reconcile the whole index with the loans table: refresh every pending
+    loan and drop rows left by loans that are done or lost their huissier.
+    Return ``(refreshed, removed)`` counts.
+    """
+    refreshed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Loan.objects.filter(id__gt=last_id, status='pending').order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        refresh_alerts(Loan.objects.filter(id__in=ids))
+        refreshed += len(ids)
+        last_id = ids[-1]
+    removed, _ = OverdueAlert.objects.exclude(loan__status='pending').delete()
+    stale, _ = OverdueAlert.objects.filter(loan__customer__huissier__isnull=True).delete()
+    return refreshed, removed + stale
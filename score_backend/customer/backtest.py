@@ -0,0 +1,165 @@
+"""
+Score backtesting.
+
+Every resolved loan is paired with the score its borrower had when the loan
+was granted (replayed from ``ScoreHistory``) and with its realised outcome:
+a default when it is still pending past its deadline, a repayment when it is
+done. Loans are streamed from a single query in chunks and folded into
+fixed-size score histograms, so memory does not grow with the number of
+loans.
+
+Stability compares customers with customers: the score each customer of the
+country had at a baseline date against the one they have now, both replayed
+from ``ScoreHistory``.
+"""
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import numpy as np
+from django.db.models import OuterRef, Subquery
+from django.utils.timezone import make_aware, now
+
+from .models import Customer, Loan, ScoreHistory
+
+# One bin per score point (0-100) and ten calibration buckets.
+BINS = 101
+BUCKETS = 10
+# Default PSI baseline: the score distribution this many days ago.
+BASELINE_DAYS = 180
+
+
+class Backtest:
+    def __init__(self):
+        self.defaults = np.zeros(BINS, dtype=np.int64)
+        self.repaid = np.zeros(BINS, dtype=np.int64)
+        self.score_sums = np.zeros(BUCKETS)
+        self.unscored = 0
+
+    def add(self, scores, defaulted):
+        bins = np.clip(np.floor(scores), 0, BINS - 1).astype(np.int64)
+        self.defaults += np.bincount(bins[defaulted], minlength=BINS)
+        self.repaid += np.bincount(bins[~defaulted], minlength=BINS)
+        self.score_sums += np.bincount(_buckets(scores), weights=scores, minlength=BUCKETS)
+
+    def auc(self):
+        """Probability that a repaid loan was scored above a defaulted one."""
+        bad, good = self.defaults.sum(), self.repaid.sum()
+        if not bad or not good:
+            return None
+        bad_below = np.concatenate([[0], np.cumsum(self.defaults)[:-1]])
+        return float(np.sum(self.repaid * (bad_below + 0.5 * self.defaults)) / (bad * good))
+
+    def ks(self):
+        bad, good = self.defaults.sum(), self.repaid.sum()
+        if not bad or not good:
+            return None
+        return float(np.max(np.abs(np.cumsum(self.defaults) / bad - np.cumsum(self.repaid) / good)))
+
+    def calibration(self):
+        """
+        Observed default rate per score bucket next to the rate implied by
+        the score (a score of 80 stands for a 20% default probability).
+        """
+        defaults = self.defaults[:100].reshape(BUCKETS, -1).sum(axis=1)
+        loans = defaults + self.repaid[:100].reshape(BUCKETS, -1).sum(axis=1)
+        # A score of exactly 100 belongs to the last bucket.
+        defaults[-1] += self.defaults[100]
+        loans[-1] += self.defaults[100] + self.repaid[100]
+        return [
+            {
+                "bucket": f"{10 * i}-{10 * (i + 1)}",
+                "loans": int(loans[i]),
+                "defaults": int(defaults[i]),
+                "observed_default_rate": float(defaults[i] / loans[i]) if loans[i] else None,
+                "expected_default_rate": float(1 - self.score_sums[i] / loans[i] / 100) if loans[i] else None,
+            }
+            for i in range(BUCKETS)
+        ]
+
+
+def _buckets(scores):
+    return np.clip(np.floor(np.asarray(scores) / 10), 0, BUCKETS - 1).astype(np.int64)
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def population_stability(expected, actual):
+    """Population stability index between two bucket count vectors."""
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if not expected.sum() or not actual.sum():
+        return None
+    e = np.maximum(expected / expected.sum(), 1e-6)
+    a = np.maximum(actual / actual.sum(), 1e-6)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def score_distribution(country, moment, chunk_size=50000):
+    """
+    Bucket counts of the scores the customers of ``country`` had at
+    ``moment``, one per customer; customers not registered yet are left out.
+    """
+    replayed = Subquery(
+        ScoreHistory.objects.filter(customer=OuterRef("pk"), effective_date__lte=moment)
+        .order_by("-effective_date")
+        .values("score")[:1]
+    )
+    scores = Customer.objects.filter(country=country).annotate(replayed_score=replayed).values_list(
+        "replayed_score", flat=True,
+    )
+    counts = np.zeros(BUCKETS, dtype=np.int64)
+    for chunk in _chunks(scores.iterator(chunk_size=chunk_size), chunk_size):
+        chunk = np.array(chunk, dtype=np.float64)  # None becomes nan
+        counts += np.bincount(_buckets(chunk[~np.isnan(chunk)]), minlength=BUCKETS)
+    return counts
+
+
+def backtest_country(country, chunk_size=50000, today=None, baseline=None):
+    """
+    Backtest the loans of ``country``; return its report entry. The PSI
+    compares the customers' scores at the start of ``baseline`` (default
+    ``BASELINE_DAYS`` ago) with their current ones.
+    """
+    today = today or date.today()
+    baseline = baseline or today - timedelta(days=BASELINE_DAYS)
+    # Score in effect before the day the loan was granted.
+    replayed = Subquery(
+        ScoreHistory.objects.filter(customer=OuterRef("customer"), effective_date__lt=OuterRef("date"))
+        .order_by("-effective_date")
+        .values("score")[:1]
+    )
+    rows = (
+        Loan.objects.filter(customer__country=country)
+        .exclude(status="pending", deadline__gte=today)
+        .annotate(replayed_score=replayed)
+        .values_list("replayed_score", "status")
+        .iterator(chunk_size=chunk_size)
+    )
+    backtest = Backtest()
+    for chunk in _chunks(rows, chunk_size):
+        scores, statuses = zip(*chunk)
+        scores = np.array(scores, dtype=np.float64)  # None becomes nan
+        defaulted = np.array([s != "done" for s in statuses], dtype=bool)
+        scored = ~np.isnan(scores)
+        backtest.unscored += int((~scored).sum())
+        backtest.add(scores[scored], defaulted[scored])
+
+    then = score_distribution(country, make_aware(datetime.combine(baseline, time.min)), chunk_size)
+    current = score_distribution(country, now(), chunk_size)
+    return {
+        "country": country.country_code,
+        "loans": int(backtest.defaults.sum() + backtest.repaid.sum()),
+        "defaults": int(backtest.defaults.sum()),
+        "unscored_loans": backtest.unscored,
+        "auc": backtest.auc(),
+        "ks": backtest.ks(),
+        "psi": population_stability(then, current),
+        "psi_baseline": baseline.isoformat(),
+        "calibration": backtest.calibration(),
+    }
@@ -0,0 +1,239 @@
+"""
+Default-probability model.
+
+A logistic regression fitted with NumPy only (iteratively reweighted least
+squares) on historical loan outcomes. Artifacts are versioned ``.npy`` files
+in ``settings.SCORE_MODEL_DIR`` with a JSON sidecar; they are memory-mapped
+and loaded once per process.
+"""
+import json
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils.timezone import now
+
+from .scoring import (
+    compute_features, load_customers, load_history, load_stored_features, write_scores,
+)
+
+MODEL_FEATURES = (
+    "loan_count",
+    "completion_ratio",
+    "log_outstanding_principal",
+    "overdue_count",
+    "months_past_due",
+    "repayment_count",
+    "on_time_ratio",
+    "creditor_count",
+    "months_inactive",
+)
+
+
+def feature_matrix(features, today=None):
+    """Turn a feature dict (see ``scoring.compute_features``) into model inputs."""
+    today = (today or date.today()).toordinal()
+    loan_count = np.asarray(features["loan_count"], dtype=np.float64)
+    last_activity = np.asarray(features["last_activity"], dtype=np.float64)
+    inactive = np.where(last_activity > 0, today - last_activity, 3650.0)
+    return np.column_stack([
+        loan_count,
+        np.asarray(features["done_count"]) / np.maximum(loan_count, 1.0),
+        np.log1p(np.asarray(features["outstanding_principal"], dtype=np.float64)),
+        np.asarray(features["overdue_count"], dtype=np.float64),
+        np.minimum(np.asarray(features["max_days_past_due"]), 365) / 30.0,
+        np.asarray(features["repayment_count"], dtype=np.float64),
+        np.asarray(features["on_time_ratio"], dtype=np.float64),
+        np.asarray(features["creditor_count"], dtype=np.float64),
+        np.minimum(inactive, 3650.0) / 30.0,
+    ])
+
+
+def _subset(arrays, mask):
+    return {name: values[mask] for name, values in arrays.items()}
+
+
+def build_training_set(customers, cutoff, today=None):
+    """
+    Features as of ``cutoff`` and default labels realised after it.
+
+    Features only see loans granted and repayments made before ``cutoff``;
+    loans that were not yet due at the cutoff count as pending. A customer is
+    labelled 1 when one of the loans granted since the cutoff is still
+    pending past its deadline, 0 when they all are done. Customers whose
+    recent loans are not resolved yet are left out.
+    """
+    today = today or date.today()
+    customer_ids, _, _, loans, repayments = load_history(customers)
+    cutoff_ordinal = cutoff.toordinal()
+
+    before = loans["date"] < cutoff_ordinal
+    history = _subset(loans, before)
+    history["done"] = history["done"] & (history["deadline"] < cutoff_ordinal)
+    features = compute_features(
+        customer_ids, history, _subset(repayments, repayments["date"] < cutoff_ordinal), cutoff,
+    )
+
+    outcome = _subset(loans, ~before)
+    defaulted = ~outcome["done"] & (outcome["deadline"] < today.toordinal())
+    # Loans of customers created after they were read have no row to label
+    resolved = (outcome["done"] | defaulted) & np.isin(outcome["customer_id"], customer_ids)
+    cidx = np.searchsorted(customer_ids, outcome["customer_id"][resolved])
+    n = len(customer_ids)
+    labelled = np.bincount(cidx, minlength=n) > 0
+    y = np.bincount(cidx, weights=defaulted[resolved], minlength=n) > 0
+
+    return feature_matrix(features, cutoff)[labelled], y[labelled].astype(np.float64)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def fit_logistic(X, y, l2=1.0, iterations=25, tol=1e-8):
+    """
+    Fit an L2-regularised logistic regression with IRLS.
+    Return ``(mean, scale, coefficients)``, the intercept being ``coefficients[0]``.
+    """
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    Z = np.column_stack([np.ones(len(X)), (X - mean) / scale])
+    penalty = l2 * np.eye(Z.shape[1])
+    penalty[0, 0] = 0.0  # The intercept is not regularised
+
+    w = np.zeros(Z.shape[1])
+    for _ in range(iterations):
+        p = _sigmoid(Z @ w)
+        hessian = (Z * (p * (1 - p))[:, None]).T @ Z + penalty
+        gradient = Z.T @ (p - y) + penalty @ w
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < tol:
+            break
+    return mean, scale, w
+
+
+def auc(y, p):
+    """Area under the ROC curve (Mann-Whitney statistic, ties averaged)."""
+    positives = y.sum()
+    negatives = len(y) - positives
+    if not positives or not negatives:
+        return None
+    order = np.argsort(p, kind="mergesort")
+    ranks = np.empty(len(p))
+    ranks[order] = np.arange(1, len(p) + 1)
+    # Average the ranks of tied predictions
+    _, inverse, counts = np.unique(p, return_inverse=True, return_counts=True)
+    ranks = np.bincount(inverse, weights=ranks)[inverse] / counts[inverse]
+    return float((ranks[y == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def model_dir():
+    return Path(settings.SCORE_MODEL_DIR)
+
+
+def _artifact(version):
+    return model_dir() / f"default-model-v{version}.npy"
+
+
+def latest_version():
+    versions = [int(path.stem.rsplit("-v", 1)[1]) for path in model_dir().glob("default-model-v*.npy")]
+    return max(versions) if versions else None
+
+
+def save_model(mean, scale, coefficients, metadata):
+    """Write a new artifact version and return its number."""
+    version = (latest_version() or 0) + 1
+    model_dir().mkdir(parents=True, exist_ok=True)
+    params = np.vstack([
+        np.concatenate([[0.0], mean]),
+        np.concatenate([[1.0], scale]),
+        coefficients,
+    ])
+    np.save(_artifact(version), params)
+    metadata = {"version": version, "features": list(MODEL_FEATURES), "trained_at": now().isoformat(), **metadata}
+    _artifact(version).with_suffix(".json").write_text(json.dumps(metadata, indent=2))
+    return version
+
+
+class DefaultModel:
+    def __init__(self, path):
+        # Rows: feature means, feature scales, coefficients (intercept first)
+        self.params = np.load(path, mmap_mode="r")
+        self.metadata = json.loads(Path(path).with_suffix(".json").read_text())
+        self.version = self.metadata["version"]
+
+    def predict(self, X):
+        mean, scale, coefficients = self.params
+        return _sigmoid(coefficients[0] + ((X - mean[1:]) / scale[1:]) @ coefficients[1:])
+
+    def predict_features(self, features, today=None):
+        return self.predict(feature_matrix(features, today))
+
+    def score(self, features, today=None):
+        """0-100 credit scores: the probability of not defaulting."""
+        return np.round(100.0 * (1.0 - self.predict_features(features, today)), 2)
+
+
+@lru_cache(maxsize=None)
+def _load(path):
+    return DefaultModel(path)
+
+
+@lru_cache(maxsize=None)
+def _default_version():
+    version = settings.SCORE_MODEL_VERSION or latest_version()
+    if version is None:
+        raise FileNotFoundError(f"No default model artifact in {model_dir()}")
+    return version
+
+
+def load_model(version=None):
+    """
+    Return the artifact ``version`` (settings.SCORE_MODEL_VERSION, or the
+    latest one, by default). Each artifact is loaded once per process.
+    """
+    return _load(str(_artifact(version or _default_version())))
+
+
+def train(customers, cutoff, l2=1.0, today=None):
+    """Fit a model on ``customers`` and save it. Return the saved metadata."""
+    X, y = build_training_set(customers, cutoff, today)
+    if not len(y) or y.min() == y.max():
+        raise ValueError("Training needs both defaulted and repaid customers")
+    mean, scale, coefficients = fit_logistic(X, y, l2=l2)
+    p = _sigmoid(coefficients[0] + ((X - mean) / scale) @ coefficients[1:])
+    metadata = {
+        "cutoff": cutoff.isoformat(),
+        "l2": l2,
+        "samples": int(len(y)),
+        "default_rate": float(y.mean()),
+        "train_auc": auc(y, p),
+        "train_log_loss": float(-np.mean(y * np.log(p + 1e-12) + (1 - y) * np.log(1 - p + 1e-12))),
+    }
+    version = save_model(mean, scale, coefficients, metadata)
+    return {"version": version, **metadata}
+
+
+def score_with_model(customers, chunk_size=10000, model=None, today=None):
+    """
+    Score ``customers`` with the trained model, ``chunk_size`` customers at a
+    time, reading their features from the feature store.
+    Return ``(scored, updated)`` counts.
+    """
+    model = model or load_model()
+    scored = updated = 0
+    last_id = 0
+    while True:
+        ids = list(customers.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        customer_ids, previous, countries = load_customers(customers.filter(id__gte=ids[0], id__lte=ids[-1]))
+        scores = model.score(load_stored_features(customer_ids), today)
+        updated += write_scores(customer_ids, scores, previous, countries)
+        scored += len(customer_ids)
+        last_id = int(customer_ids[-1])
+    return scored, updated
@@ -0,0 +1,120 @@
+"""
+Queue of customers whose score must be recomputed.
+
+Loan and repayment writes mark their customer dirty (see ``signals``); the
+``drain_dirty_scores`` worker pops small batches and re-scores them. The
+queue lives in a Redis set; when Redis is unreachable the ids are kept in the
+``DirtyCustomer`` table instead and drained from there.
+
+Popping does not forget a customer: ``ack`` does, once the batch is scored
+and committed. A worker that dies mid-batch leaves its customers queued (in
+the table) or in the processing set (in Redis), which ``recover`` puts back.
+A customer marked again while its batch is scored stays queued.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .models import DirtyCustomer
+
+
+class DatabaseDirtyQueue:
+    def __init__(self):
+        self.popped_at = None
+
+    def mark(self, customer_ids):
+        # A customer already queued is marked anew: an ack of a batch popped earlier keeps it
+        DirtyCustomer.objects.bulk_create(
+            [DirtyCustomer(customer_id=customer_id) for customer_id in set(customer_ids)],
+            update_conflicts=True, unique_fields=["customer_id"], update_fields=["marked_at"],
+        )
+
+    def pop(self, count):
+        self.popped_at = now()
+        return list(
+            DirtyCustomer.objects.filter(marked_at__lte=self.popped_at).order_by("marked_at")
+            .values_list("customer_id", flat=True)[:count]
+        )
+
+    def ack(self, customer_ids):
+        if customer_ids:
+            DirtyCustomer.objects.filter(customer_id__in=customer_ids, marked_at__lte=self.popped_at).delete()
+
+    def recover(self):
+        # Rows stay queued until acked: nothing to put back
+        pass
+
+    def size(self):
+        return DirtyCustomer.objects.count()
+
+
+class RedisDirtyQueue:
+    def __init__(self, key=None):
+        self.key = key or settings.SCORE_DIRTY_QUEUE_KEY
+        self.processing = f"{self.key}:processing"
+        self.fallback = DatabaseDirtyQueue()
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def mark(self, customer_ids):
+        try:
+            self.redis.sadd(self.key, *set(customer_ids))
+        except RedisError:
+            self.fallback.mark(customer_ids)
+
+    def pop(self, count):
+        # Ids parked in the table while Redis was down are drained first.
+        ids = self.fallback.pop(count)
+        if len(ids) < count:
+            try:
+                candidates = self.redis.srandmember(self.key, count - len(ids)) or []
+                pipeline = self.redis.pipeline()
+                for customer_id in candidates:
+                    pipeline.smove(self.key, self.processing, customer_id)
+                # SMOVE is atomic: of concurrent workers, the one that moved an id owns it
+                ids += [int(i) for i, moved in zip(candidates, pipeline.execute()) if moved]
+            except RedisError:
+                pass
+        return ids
+
+    def ack(self, customer_ids):
+        self.fallback.ack(customer_ids)
+        if customer_ids:
+            try:
+                self.redis.srem(self.processing, *customer_ids)
+            except RedisError:
+                # Left in the processing set: recovered, and re-scored, by the next worker start
+                pass
+
+    def recover(self):
+        """
+        Queue again the batches of workers that died before acking them (and,
+        with several workers, those in flight: they are only scored twice).
+        """
+        try:
+            self.redis.pipeline().sunionstore(self.key, self.key, self.processing).delete(self.processing).execute()
+        except RedisError:
+            pass
+
+    def size(self):
+        try:
+            return self.redis.scard(self.key) + self.fallback.size()
+        except RedisError:
+            return self.fallback.size()
+
+
+def get_dirty_queue():
+    if settings.SCORE_DIRTY_QUEUE_BACKEND == "database":
+        return DatabaseDirtyQueue()
+    return RedisDirtyQueue()
+
+
+def mark_dirty(*customer_ids):
+    """Queue ``customer_ids`` for re-scoring once the current transaction commits."""
+    customer_ids = [i for i in customer_ids if i is not None]
+    if customer_ids:
+        transaction.on_commit(lambda: get_dirty_queue().mark(customer_ids))
@@ -0,0 +1,81 @@
+"""
+NPI -> identity lookups for the creditor field of the loan form, which calls
+``/customer/by-npi/`` on every keystroke.
+
+Identities are cached read-through in the default cache, unknown NPIs for a
+short while only. Customer saves and deletes invalidate the entry once the
+transaction commits. When the cache is unreachable lookups go to the
+database.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from .models import Customer
+
+_UNKNOWN = "unknown"
+CACHE_ERRORS = (ConnectionInterrupted, RedisError)
+
+
+def _key(npi):
+    return f"{settings.NPI_CACHE_KEY_PREFIX}:{npi}"
+
+
+def _identity(npi, first_name, last_name, uuid, country_code):
+    return {'npi': npi, 'name': first_name + " " + last_name, 'uuid': uuid, 'country': country_code}
+
+
+def _fields():
+    return 'npi', 'first_name', 'last_name', 'uuid', 'country__country_code'
+
+
+def lookup(npi):
+    """{npi, name, uuid, country} of the customer with ``npi``, or None."""
+    try:
+        cached = cache.get(_key(npi))
+    except CACHE_ERRORS:
+        cached = None
+    if cached == _UNKNOWN:
+        return None
+    if cached is not None:
+        return cached
+
+    row = Customer.objects.filter(npi=npi).values_list(*_fields()).first()
+    identity = _identity(*row) if row else None
+    try:
+        if identity is None:
+            cache.set(_key(npi), _UNKNOWN, settings.NPI_NEGATIVE_CACHE_TTL)
+        else:
+            cache.set(_key(npi), identity, settings.NPI_CACHE_TTL)
+    except CACHE_ERRORS:
+        pass
+    return identity
+
+
+def search(prefix, limit):
+    """
+    The first ``limit`` customers whose NPI starts with ``prefix``, in NPI
+    order. Written as a range rather than LIKE so that every backend serves
+    it from the NPI unique index, whatever the column collation.
+    """
+    rows = (
+        Customer.objects.filter(npi__gte=prefix, npi__lt=prefix + "\uffff")
+        .order_by('npi').values_list(*_fields())[:limit]
+    )
+    return [_identity(*row) for row in rows]
+
+
+def invalidate(*npis):
+    """Drop the cached identities of ``npis`` once the transaction commits."""
+    keys = [_key(npi) for npi in npis if npi]
+
+    def delete():
+        try:
+            cache.delete_many(keys)
+        except CACHE_ERRORS:
+            pass
+
+    if keys:
+        transaction.on_commit(delete)
@@ -0,0 +1,211 @@
+"""
+Bulk customer import, for onboarding the existing borrowers of a front
+office in one upload instead of one ``/customer/new/`` POST each.
+
+Rows are validated a column at a time with the rules of ``CreateCustomer``.
+Valid rows are then inserted in batches, each in its own transaction: one
+``npi__in`` query weeds out the NPIs already registered and the rest go in
+with one multi-row INSERT. No signal is sent, so what ``customer_created``
+maintains (identity cache, percentile index, existence filter) is updated
+here, once per batch.
+"""
+import csv
+import io
+import uuid
+from itertools import zip_longest
+
+from django.db import IntegrityError, connection, transaction
+
+from score import bloom
+from score.validators import validate_column
+from .identity import invalidate
+from .models import Customer
+from .percentiles import record_customers
+
+NAME_VALIDATOR = {
+    'required': "Missing field",
+    'length': {
+        'value': 2,
+        'message': "This field must have at least 2 characters"
+    },
+    'name': "Invalid format"
+}
+
+NUMBER_VALIDATOR = {
+    'required': "Missing field",
+    'length': {
+        'value': 6,
+        'message': "This field must have at least 6 characters"
+    },
+    'number': "Phone must be number"
+}
+
+EMAIL_VALIDATOR = {
+    'required': "Missing field",
+    'length': {
+        'value': 5,
+        'message': "Email must be valid"
+    },
+    'email': "Invalid email format"
+}
+
+# In the order CreateCustomer reports them
+VALIDATORS = {
+    "npi": NAME_VALIDATOR,
+    "last_name": NAME_VALIDATOR,
+    "first_name": NAME_VALIDATOR,
+    "phone_number": NUMBER_VALIDATOR,
+    "email": EMAIL_VALIDATOR,
+}
+
+
+INSERT_FIELDS = (
+    "uuid", "first_name", "last_name", "npi", "phone_number", "email", "huissier_id", "zone", "front_office_id",
+    "country_id",
+)
+# Tries of a batch that concurrent imports keep conflicting with, before going a row at a time
+IMPORT_ATTEMPTS = 3
+
+
+class InvalidImport(ValueError):
+    pass
+
+
+def _columns(columns, count):
+    missing = [name for name in VALIDATORS if name not in columns]
+    if (missing):
+        raise InvalidImport(f"Missing columns: {', '.join(missing)}")
+    if (not count):
+        raise InvalidImport("No rows to import")
+    return {
+        name: [str(value).strip() if value is not None else "" for value in columns[name]]
+        for name in VALIDATORS
+    }
+
+
+def read_csv(file):
+    """Columns of a CSV file (bytes, UTF-8) whose first row names them."""
+    try:
+        text = file.read().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise InvalidImport("The file must be UTF-8 encoded")
+    reader = csv.reader(io.StringIO(text, newline=""))
+    header = [name.strip() for name in next(reader, [])]
+    # Short rows are padded; values beyond the header are ignored
+    columns = list(zip_longest(*reader, fillvalue=""))
+    count = len(columns[0]) if columns else 0
+    data = {name: columns[i] if i < len(columns) else [""] * count for i, name in enumerate(header)}
+    return _columns(data, count)
+
+
+def read_rows(rows):
+    """Columns of a list of {column: value} objects."""
+    if (not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows)):
+        raise InvalidImport("customers must be a list of objects")
+    names = set().union(*rows) if rows else set()
+    return _columns({name: [row.get(name) for row in rows] for name in names}, len(rows))
+
+
+def _bulk_insert(model, attnames, rows):
+    """
+    INSERT ``rows``, tuples of database values for ``attnames``, with a
+    single executemany; the other fields get their default. ``bulk_create``
+    prepares each value through its field and, on SQLite, compiles one
+    statement per 90 rows: that alone held it under 10k rows/s.
+    """
+    fields = {field.attname: field for field in model._meta.concrete_fields if not field.primary_key}
+    defaults = {
+        attname: field.get_db_prep_save(field.get_default(), connection)
+        for attname, field in fields.items() if attname not in attnames
+    }
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        quote(model._meta.db_table),
+        ", ".join(quote(fields[attname].column) for attname in [*attnames, *defaults]),
+        ", ".join(["%s"] * len(fields)),
+    )
+    extra = tuple(defaults.values())
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [row + extra for row in rows])
+
+
+def _insert(columns, rows, huissier, errors):
+    npis = columns["npi"]
+    phones = columns["phone_number"]
+    with transaction.atomic():
+        existing = set(Customer.objects.filter(npi__in=[npis[row] for row in rows]).values_list("npi", flat=True))
+        new_rows = []
+        for row in rows:
+            if (npis[row] in existing):
+                errors[row] = {"npi": "Customer already exists"}
+            else:
+                new_rows.append(row)
+        country_id = huissier.front_office.country_id
+        _bulk_insert(Customer, INSERT_FIELDS, [
+            (
+                str(uuid.uuid4()), columns["first_name"][row], columns["last_name"][row], npis[row],
+                phones[row], columns["email"][row], huissier.id, huissier.zone,
+                huissier.front_office_id, country_id,
+            )
+            for row in new_rows
+        ])
+
+        created = [npis[row] for row in new_rows]
+        invalidate(*created)
+        bloom.add({("customer.npi", npi) for npi in created} | {("customer.phone", phones[row]) for row in new_rows})
+        # A Redis outage must not fail the import: rebuild_percentiles repairs the index
+        transaction.on_commit(
+            lambda: record_customers([country_id] * len(created), [0.0] * len(created)), robust=True,
+        )
+    return len(created)
+
+
+def import_customers(columns, huissier, batch_size):
+    """
+    Create the customers of ``columns`` (see ``read_csv``) for ``huissier``,
+    ``batch_size`` rows per transaction. Return the report: the number of
+    customers created and the errors of the rejected rows, numbered from 1
+    (the first row after the CSV header).
+    """
+    errors = {}
+    for name, rules in VALIDATORS.items():
+        for row, error in enumerate(validate_column(columns[name], rules)):
+            if (error and row not in errors):
+                errors[row] = {name: error}
+
+    first = {}
+    for row, npi in enumerate(columns["npi"]):
+        if (row in errors):
+            continue
+        if (npi in first):
+            errors[row] = {"npi": f"Duplicate of row {first[npi] + 1}"}
+        else:
+            first[npi] = row
+
+    valid = [row for row in range(len(columns["npi"])) if row not in errors]
+    created = 0
+    for start in range(0, len(valid), batch_size):
+        rows = valid[start:start + batch_size]
+        for _ in range(IMPORT_ATTEMPTS):
+            try:
+                created += _insert(columns, rows, huissier, errors)
+                break
+            except IntegrityError:
+                # An NPI registered since the check: checking again finds it
+                rows = [row for row in rows if row not in errors]
+        else:
+            # Concurrent imports keep racing this batch: a row at a time, the losers become row errors
+            for row in rows:
+                try:
+                    created += _insert(columns, [row], huissier, errors)
+                except IntegrityError:
+                    errors[row] = {"npi": "Customer already exists"}
+
+    return {
+        'created': created,
+        'rejected': len(errors),
+        'errors': [
+            {'row': row + 1, 'npi': columns["npi"][row], 'errors': errors[row]}
+            for row in sorted(errors)
+        ],
+    }
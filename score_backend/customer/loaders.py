@@ -0,0 +1,37 @@
+from django.db.models import Prefetch
+
+from .models import Customer, Loan
+
+
+def with_loans(customers):
+    """Prefetch the loans of ``customers`` along with their creditor."""
+    return customers.prefetch_related(Prefetch('loans', queryset=Loan.objects.select_related('creditor')))
+
+
+class CreditorNames:
+    """
+    Creditor NPI -> name resolution for a whole response, for the loans not
+    linked to their ``creditor`` yet.
+
+    Their creditor NPIs are resolved with a single ``npi__in`` query, run the
+    first time a name is needed. Pass it to the serializers as the
+    ``creditor_names`` context entry.
+    """
+
+    def __init__(self, loans):
+        self.loans = loans
+        self.names = None
+
+    @classmethod
+    def for_customers(cls, customers):
+        return cls(Loan.objects.filter(customer__in=customers, creditor__isnull=True))
+
+    def get(self, npi):
+        if self.names is None:
+            self.names = {
+                npi: first_name + " " + last_name
+                for npi, first_name, last_name in Customer.objects.filter(
+                    npi__in=self.loans.values("creditor_npi")
+                ).values_list("npi", "first_name", "last_name")
+            }
+        return self.names.get(npi, "Undefined")
@@ -0,0 +1,67 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import now
+
+from country.models import Country
+from customer.backtest import backtest_country
+
+
+class Command(BaseCommand):
+    help = "Backtest credit scores against realised loan defaults (AUC, KS, calibration, PSI per country)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country", help="Country code, e.g. BEN. Every country when omitted.")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Loans read per chunk")
+        parser.add_argument("--output", default="backtest.json", help="Report path, .json or .csv")
+        parser.add_argument("--baseline", help="PSI baseline date YYYY-MM-DD (default: 180 days ago)")
+
+    def handle(self, *args, **options):
+        countries = Country.objects.all()
+        if options["country"]:
+            countries = countries.filter(country_code=options["country"])
+            if not countries.exists():
+                raise CommandError(f"Unknown country code '{options['country']}'")
+        output = options["output"]
+        if not output.endswith((".json", ".csv")):
+            raise CommandError("The report must be a .json or .csv file")
+        baseline = None
+        if options["baseline"]:
+            baseline = parse_date(options["baseline"])
+            if not baseline:
+                raise CommandError("Invalid baseline, expected YYYY-MM-DD")
+
+        reports = []
+        for country in countries:
+            start = time.perf_counter()
+            report = backtest_country(country, chunk_size=options["chunk_size"], baseline=baseline)
+            reports.append(report)
+            auc = f"{report['auc']:.3f}" if report["auc"] is not None else "n/a"
+            ks = f"{report['ks']:.3f}" if report["ks"] is not None else "n/a"
+            psi = f"{report['psi']:.3f}" if report["psi"] is not None else "n/a"
+            self.stdout.write(
+                f"{report['country']}: {report['loans']} loans, {report['defaults']} defaults, "
+                f"AUC {auc}, KS {ks}, PSI {psi} ({time.perf_counter() - start:.2f}s)"
+            )
+
+        if output.endswith(".json"):
+            with open(output, "w") as f:
+                json.dump({"generated_at": now().isoformat(), "countries": reports}, f, indent=2)
+        else:
+            with open(output, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow([
+                    "country", "auc", "ks", "psi", "bucket", "loans", "defaults",
+                    "observed_default_rate", "expected_default_rate",
+                ])
+                for report in reports:
+                    for bucket in report["calibration"]:
+                        writer.writerow([
+                            report["country"], report["auc"], report["ks"], report["psi"], bucket["bucket"],
+                            bucket["loans"], bucket["defaults"],
+                            bucket["observed_default_rate"], bucket["expected_default_rate"],
+                        ])
+        self.stdout.write(self.style.SUCCESS(f"Report written to {output}"))
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from customer.dirty import get_dirty_queue
+from customer.scoring import rescore_customers
+
+
+class Command(BaseCommand):
+    help = "Re-score the customers marked dirty by loan and repayment writes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.SCORE_DRAIN_BATCH_SIZE)
+        parser.add_argument("--max-batch-size", type=int, default=settings.SCORE_DRAIN_MAX_BATCH_SIZE)
+        parser.add_argument(
+            "--latency-target", type=float, default=settings.SCORE_DRAIN_LATENCY_TARGET,
+            help="Seconds a batch should take; the batch size adapts to stay under it",
+        )
+        parser.add_argument("--poll-interval", type=float, default=settings.SCORE_DRAIN_POLL_INTERVAL)
+        parser.add_argument("--once", action="store_true", help="Drain the queue then exit")
+
+    def handle(self, *args, **options):
+        queue = get_dirty_queue()
+        queue.recover()
+        batch_size = options["batch_size"]
+        target = options["latency_target"]
+
+        while True:
+            customer_ids = queue.pop(batch_size)
+            if not customer_ids:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            start = time.perf_counter()
+            try:
+                scored, updated = rescore_customers(customer_ids)
+            except Exception:
+                # Back in the queue, for the next worker
+                queue.mark(customer_ids)
+                queue.ack(customer_ids)
+                raise
+            queue.ack(customer_ids)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{scored} customers re-scored, {updated} updated in {elapsed * 1000:.0f}ms "
+                f"(batch size {batch_size})"
+            )
+
+            # Keep each batch under the latency target: halve the batch when it
+            # is too slow, grow it back while there is room.
+            if elapsed > target:
+                batch_size = max(1, batch_size // 2)
+            elif elapsed < target / 2 and len(customer_ids) == batch_size:
+                batch_size = min(options["max_batch_size"], batch_size * 2)
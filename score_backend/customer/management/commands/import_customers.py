@@ -0,0 +1,54 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from country.models import Huissier
+from customer.imports import import_customers, read_csv, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import customers from a CSV file (header row first) or a JSON list of objects"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or .json file")
+        parser.add_argument("--huissier", required=True, help="NPI of the huissier the customers are assigned to")
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.CUSTOMER_IMPORT_BATCH_SIZE,
+            help="Rows checked and inserted per transaction",
+        )
+        parser.add_argument("--report", help="Write the rejected rows to this JSON file")
+
+    def handle(self, *args, **options):
+        try:
+            huissier = Huissier.objects.select_related("front_office").get(npi=options["huissier"])
+        except Huissier.DoesNotExist:
+            raise CommandError(f"Unknown huissier '{options['huissier']}'")
+
+        start = time.perf_counter()
+        try:
+            with open(options["path"], "rb") as f:
+                if options["path"].endswith(".json"):
+                    columns = read_rows(json.load(f))
+                else:
+                    columns = read_csv(f)
+        except (OSError, ValueError) as e:
+            # InvalidImport and JSON errors are both ValueErrors
+            raise CommandError(str(e))
+        report = import_customers(columns, huissier, max(options["batch_size"], 1))
+        elapsed = time.perf_counter() - start
+
+        if options["report"]:
+            with open(options["report"], "w") as f:
+                json.dump(report["errors"], f, indent=2)
+        else:
+            for error in report["errors"][:20]:
+                self.stdout.write(f"row {error['row']} ({error['npi']}): {error['errors']}")
+            if report["rejected"] > 20:
+                self.stdout.write(f"... {report['rejected'] - 20} more, see --report")
+        rows = report["created"] + report["rejected"]
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} customers created, {report['rejected']} rows rejected "
+            f"in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from country.models import Country
+from customer.models import Customer
+from customer.scoring import refresh_features
+
+
+class Command(BaseCommand):
+    help = "Rebuild the CustomerFeatures table chunk by chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country", help="Country code, e.g. BEN. Every country when omitted.")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Customers per chunk")
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.all()
+        if options["country"]:
+            try:
+                country = Country.objects.get(country_code=options["country"])
+            except Country.DoesNotExist:
+                raise CommandError(f"Unknown country code '{options['country']}'")
+            customers = customers.filter(country=country)
+
+        start = time.perf_counter()
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                customers.filter(id__gt=last_id).order_by("id")
+                .values_list("id", flat=True)[:options["chunk_size"]]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                total += refresh_features(customers.filter(id__gte=ids[0], id__lte=ids[-1]))
+            last_id = ids[-1]
+            self.stdout.write(f"{total} customers rebuilt")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} feature rows rebuilt in {time.perf_counter() - start:.2f}s"
+        ))
@@ -0,0 +1,28 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from country.models import Country
+from customer.models import Customer
+from customer.percentiles import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-country score percentile index in Redis"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country", help="Country code, e.g. BEN. Every country when omitted.")
+
+    def handle(self, *args, **options):
+        countries = Country.objects.all()
+        if options["country"]:
+            countries = countries.filter(country_code=options["country"])
+            if not countries.exists():
+                raise CommandError(f"Unknown country code '{options['country']}'")
+
+        for country in countries:
+            scores = np.fromiter(
+                Customer.objects.filter(country=country).values_list("credit_score", flat=True),
+                dtype=np.float64,
+            )
+            count = rebuild(country.id, scores)
+            self.stdout.write(self.style.SUCCESS(f"{country.country_code}: {count} customers indexed"))
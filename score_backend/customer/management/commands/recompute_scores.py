@@ -0,0 +1,168 @@
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from country.models import Country
+from customer.models import Customer
+from customer.scoring import recompute_scores
+
+
+def _init_worker():
+    # Spawned workers (macOS, Windows) start without Django set up; forked
+    # ones inherit it. Either way each worker opens its own DB connection.
+    if not apps.ready:
+        django.setup()
+
+
+def _recompute_range(country_id, start_id, end_id, batch_size):
+    start = time.perf_counter()
+    scored, updated = recompute_scores(
+        Customer.objects.filter(country_id=country_id, id__gte=start_id, id__lte=end_id),
+        batch_size=batch_size,
+    )
+    return os.getpid(), scored, updated, time.perf_counter() - start
+
+
+class Checkpoint:
+    """Customer-id ranges already recomputed, per country, stored as JSON."""
+
+    def __init__(self, path, resume):
+        self.path = path
+        self.done = defaultdict(list)
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                self.done.update(json.load(f))
+
+    def add(self, country_id, start_id, end_id):
+        self.done[str(country_id)].append([start_id, end_id])
+        with open(self.path, "w") as f:
+            json.dump(self.done, f)
+
+    def pending(self, country_id, ids):
+        """Filter out of ``ids`` (sorted array) those in a completed range."""
+        keep = np.ones(len(ids), dtype=bool)
+        for start_id, end_id in self.done.get(str(country_id), []):
+            keep[np.searchsorted(ids, start_id):np.searchsorted(ids, end_id, side="right")] = False
+        return ids[keep]
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = "Recompute the credit score of every customer of a country (or of all countries)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country", help="Country code, e.g. BEN. Every country when omitted.")
+        parser.add_argument("--batch-size", type=int, default=900, help="Customer ids per UPDATE query")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (one on SQLite)")
+        parser.add_argument(
+            "--range-size", type=int, default=50000,
+            help="Customers per unit of work handed to a worker",
+        )
+        parser.add_argument(
+            "--checkpoint", default=str(settings.BASE_DIR / "recompute_scores.checkpoint.json"),
+            help="File recording the ranges already recomputed",
+        )
+        parser.add_argument("--resume", action="store_true", help="Skip the ranges done by a previous run")
+
+    def partition(self, countries, checkpoint, range_size):
+        units = []
+        for country in countries:
+            ids = np.fromiter(
+                Customer.objects.filter(country=country).order_by("id").values_list("id", flat=True),
+                dtype=np.int64,
+            )
+            ids = checkpoint.pending(country.id, ids)
+            for i in range(0, len(ids), range_size):
+                chunk = ids[i:i + range_size]
+                units.append((country, int(chunk[0]), int(chunk[-1])))
+        return units
+
+    def run(self, units, workers, batch_size):
+        """Recompute ``units``, yielding ``(unit, result, error)`` as each one finishes."""
+        if (workers == 1):
+            for country, start_id, end_id in units:
+                try:
+                    result = _recompute_range(country.id, start_id, end_id, batch_size)
+                except Exception as e:
+                    yield (country, start_id, end_id), None, e
+                else:
+                    yield (country, start_id, end_id), result, None
+            return
+
+        # Workers must not inherit the parent's open connections.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {
+                pool.submit(_recompute_range, country.id, start_id, end_id, batch_size): (country, start_id, end_id)
+                for country, start_id, end_id in units
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield futures[future], None, e
+                else:
+                    yield futures[future], result, None
+
+    def handle(self, *args, **options):
+        countries = Country.objects.all()
+        if options["country"]:
+            countries = countries.filter(country_code=options["country"])
+            if not countries.exists():
+                raise CommandError(f"Unknown country code '{options['country']}'")
+
+        checkpoint = Checkpoint(options["checkpoint"], options["resume"])
+        units = self.partition(countries, checkpoint, options["range_size"])
+        if not units:
+            self.stdout.write("Nothing to recompute")
+            checkpoint.clear()
+            return
+
+        workers = options["workers"]
+        if (connection.vendor == "sqlite" and workers > 1):
+            # SQLite takes one writer at a time: concurrent workers fail with "database is locked"
+            self.stderr.write("SQLite database: recomputing with a single worker")
+            workers = 1
+
+        start = time.perf_counter()
+        per_worker = defaultdict(lambda: [0, 0.0])
+        failures = 0
+        for (country, start_id, end_id), result, error in self.run(units, workers, options["batch_size"]):
+            if (error):
+                failures += 1
+                self.stderr.write(f"{country.country_code} [{start_id}-{end_id}] failed: {error}")
+                continue
+            pid, scored, updated, elapsed = result
+            checkpoint.add(country.id, start_id, end_id)
+            per_worker[pid][0] += scored
+            per_worker[pid][1] += elapsed
+            self.stdout.write(
+                f"{country.country_code} [{start_id}-{end_id}]: {scored} customers scored, "
+                f"{updated} updated in {elapsed:.2f}s (worker {pid})"
+            )
+
+        for pid, (scored, elapsed) in sorted(per_worker.items()):
+            self.stdout.write(f"Worker {pid}: {scored} customers, {scored / elapsed if elapsed else 0:.0f} customers/s")
+        total = sum(scored for scored, _ in per_worker.values())
+        elapsed = time.perf_counter() - start
+        if failures:
+            raise CommandError(
+                f"{failures} of {len(units)} ranges failed; rerun with --resume to finish "
+                f"({total} customers scored so far)"
+            )
+        checkpoint.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} customers scored in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} customers/s)"
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from country.models import Country
+from customer.default_model import load_model, score_with_model
+from customer.models import Customer
+
+
+class Command(BaseCommand):
+    help = "Score customers with the trained default-probability model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country", help="Country code, e.g. BEN. Every country when omitted.")
+        parser.add_argument("--model-version", type=int, help="Artifact version (latest by default)")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Customers scored per batch")
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.all()
+        if options["country"]:
+            try:
+                country = Country.objects.get(country_code=options["country"])
+            except Country.DoesNotExist:
+                raise CommandError(f"Unknown country code '{options['country']}'")
+            customers = customers.filter(country=country)
+        try:
+            model = load_model(options["model_version"])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+
+        start = time.perf_counter()
+        scored, updated = score_with_model(customers, chunk_size=options["chunk_size"], model=model)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{scored} customers scored with model v{model.version}, {updated} updated "
+            f"in {elapsed:.2f}s ({scored / elapsed if elapsed else 0:.0f} customers/s)"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer.alerts import sweep
+
+
+class Command(BaseCommand):
+    help = "Reconcile the overdue-alert index with the loans table (run daily, after midnight)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Loans per chunk")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        refreshed, removed = sweep(options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{refreshed} pending loans refreshed, {removed} stale alerts removed "
+            f"in {time.perf_counter() - start:.2f}s"
+        ))
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0005_loan_creditor_npi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyCustomer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_id', models.BigIntegerField(unique=True)),
+                ('marked_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
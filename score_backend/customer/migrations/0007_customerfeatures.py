@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0006_dirtycustomer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerFeatures',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='customer.customer')),
+                ('loan_count', models.PositiveIntegerField(default=0)),
+                ('done_count', models.PositiveIntegerField(default=0)),
+                ('outstanding_principal', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('overdue_count', models.PositiveIntegerField(default=0)),
+                ('max_days_past_due', models.PositiveIntegerField(default=0)),
+                ('repayment_count', models.PositiveIntegerField(default=0)),
+                ('on_time_ratio', models.FloatField(default=1.0)),
+                ('creditor_count', models.PositiveIntegerField(default=0)),
+                ('last_activity', models.DateField(blank=True, null=True)),
+                ('computed_on', models.DateField()),
+            ],
+        ),
+    ]
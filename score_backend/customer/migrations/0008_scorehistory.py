@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0007_customerfeatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('effective_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_history', to='customer.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'effective_date'], name='customer_sc_custome_227fa6_idx')],
+            },
+        ),
+    ]
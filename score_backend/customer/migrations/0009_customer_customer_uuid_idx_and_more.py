@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('country', '0011_availablezone_zone_front_office_name_idx'),
+        ('customer', '0008_scorehistory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['uuid'], name='customer_uuid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['country', 'id'], name='customer_country_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['huissier', 'id'], name='customer_huissier_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['zone', 'id'], name='customer_zone_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['customer', 'deadline'], name='loan_pending_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['creditor_npi'], name='loan_creditor_npi_idx'),
+        ),
+    ]
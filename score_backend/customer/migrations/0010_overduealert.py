@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('country', '0011_availablezone_zone_front_office_name_idx'),
+        ('customer', '0009_customer_customer_uuid_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueAlert',
+            fields=[
+                ('loan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='alert', serialize=False, to='customer.loan')),
+                ('deadline', models.DateField()),
+                ('data', models.JSONField()),
+                ('huissier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='country.huissier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['huissier', 'deadline'], name='alert_huissier_deadline_idx')],
+            },
+        ),
+    ]
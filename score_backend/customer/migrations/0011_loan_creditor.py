@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0010_overduealert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='creditor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='receivables', to='customer.customer'),
+        ),
+    ]
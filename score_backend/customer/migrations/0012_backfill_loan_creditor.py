@@ -0,0 +1,30 @@
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def backfill_creditors(apps, schema_editor):
+    # One UPDATE per range of loan ids, each committed on its own, so large
+    # tables are never locked by a single long transaction.
+    Loan = apps.get_model('customer', 'Loan')
+    Customer = apps.get_model('customer', 'Customer')
+    creditor = Subquery(Customer.objects.filter(npi=OuterRef('creditor_npi')).values('id')[:1])
+    last_id = Loan.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        with transaction.atomic():
+            Loan.objects.filter(
+                id__gt=start, id__lte=start + BATCH_SIZE, creditor__isnull=True, creditor_npi__isnull=False,
+            ).update(creditor=creditor)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('customer', '0011_loan_creditor'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_creditors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, transaction
+from django.utils.timezone import now
+
+BATCH_SIZE = 10000
+
+
+def seed_score_history(apps, schema_editor):
+    # Customers scored before the history existed: their current score becomes
+    # the first entry, so score_as_of knows them from now on. The unscored
+    # ones (the 0.0 default) get their first entry from their first score.
+    Customer = apps.get_model('customer', 'Customer')
+    ScoreHistory = apps.get_model('customer', 'ScoreHistory')
+    seeded_at = now()
+    last_id = Customer.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        with transaction.atomic():
+            customers = Customer.objects.filter(
+                id__gt=start, id__lte=start + BATCH_SIZE, score_history__isnull=True,
+            ).exclude(credit_score=0.0).values_list('id', 'credit_score')
+            ScoreHistory.objects.bulk_create([
+                ScoreHistory(customer_id=customer_id, score=score, effective_date=seeded_at)
+                for customer_id, score in customers
+            ])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('customer', '0012_backfill_loan_creditor'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_score_history, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 
 # customer/models.py
 from django.db import models
+from django.utils.timezone import now
 from users.models import ScoreUser  # Pour faire le lien avec les huissiers
 from country.models import Country, FrontOffice, Huissier
 
@@ -19,6 +20,15 @@ class Customer(models.Model):
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
     # huissier = models.ForeignKey(ScoreUser, on_delete=models.CASCADE, limit_choices_to={'role': 'huissier'})
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['uuid'], name='customer_uuid_idx'),
+            # (filter, id) pairs serve both the filter and the keyset pagination order
+            models.Index(fields=['country', 'id'], name='customer_country_id_idx'),
+            models.Index(fields=['huissier', 'id'], name='customer_huissier_id_idx'),
+            models.Index(fields=['zone', 'id'], name='customer_zone_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -39,6 +49,7 @@ class Loan(models.Model):
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans')
     creditor_npi = models.CharField(verbose_name="NPI du créancier", null=True)
+    creditor = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='receivables')
     date = models.DateField(auto_now_add=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     periodicity = models.CharField(max_length=20, choices=PERIODICITY_CHOICES)
@@ -49,6 +60,16 @@ class Loan(models.Model):
     solvability = models.BooleanField(default=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            # Overdue alerts: pending loans of a customer by deadline
+            models.Index(
+                fields=['customer', 'deadline'], name='loan_pending_deadline_idx',
+                condition=models.Q(status='pending'),
+            ),
+            models.Index(fields=['creditor_npi'], name='loan_creditor_npi_idx'),
+        ]
+
     def __str__(self):
         return f"Loan #{self.id} - {self.customer}"
 
@@ -59,3 +80,55 @@ class Repayment(models.Model):
     def __str__(self):
         return f"Repayment on {self.date} for Loan #{self.loan.id}"
 
+class ScoreHistory(models.Model):
+    """Append-only log of credit score changes."""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='score_history')
+    score = models.FloatField()
+    effective_date = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [models.Index(fields=['customer', 'effective_date'])]
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.score} on {self.effective_date}"
+
+class CustomerFeatures(models.Model):
+    """Loan aggregates of a customer, kept current by the loan/repayment write path."""
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='features')
+    loan_count = models.PositiveIntegerField(default=0)
+    done_count = models.PositiveIntegerField(default=0)
+    outstanding_principal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    overdue_count = models.PositiveIntegerField(default=0)
+    max_days_past_due = models.PositiveIntegerField(default=0)
+    repayment_count = models.PositiveIntegerField(default=0)
+    on_time_ratio = models.FloatField(default=1.0)
+    creditor_count = models.PositiveIntegerField(default=0)
+    last_activity = models.DateField(null=True, blank=True)
+    computed_on = models.DateField()  # Date the overdue figures were computed for
+
+    def __str__(self):
+        return f"Features of {self.customer_id}"
+
+class DirtyCustomer(models.Model):
+    """Customers waiting for a re-score, used when Redis is unavailable."""
+    customer_id = models.BigIntegerField(unique=True)
+    marked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Dirty customer #{self.customer_id}"
+
+class OverdueAlert(models.Model):
+    """
+    Pending loans of each huissier, with the loan already serialized, so the
+    alerts poll is a single range read on (huissier, deadline).
+    """
+    loan = models.OneToOneField(Loan, on_delete=models.CASCADE, primary_key=True, related_name='alert')
+    huissier = models.ForeignKey(Huissier, on_delete=models.CASCADE, related_name='alerts')
+    deadline = models.DateField()
+    data = models.JSONField()
+
+    class Meta:
+        indexes = [models.Index(fields=['huissier', 'deadline'], name='alert_huissier_deadline_idx')]
+
+    def __str__(self):
+        return f"Alert for loan #{self.loan_id}"
@@ -0,0 +1,152 @@
+"""
+Per-country score percentiles.
+
+Scores are rounded to two decimals in [0, 100], so the distribution of a
+country is held exactly as counts over 10001 bins. Unlike a t-digest or KLL
+sketch this supports removing a customer's previous score when it changes.
+The counts live in a Redis hash per country (updated with HINCRBY from every
+score write) and each process keeps a Fenwick tree copy of them, so a
+percentile lookup is O(log n) in memory.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+BINS = 10001
+
+# Redis down, or a cache that is not Redis (get_redis_connection raises NotImplementedError)
+UNAVAILABLE = (RedisError, NotImplementedError)
+
+
+def score_bins(scores):
+    return np.clip(np.rint(np.asarray(scores, dtype=np.float64) * 100), 0, BINS - 1).astype(np.int64)
+
+
+class FenwickTree:
+    """Prefix sums over bin counts with O(log n) update and query."""
+
+    def __init__(self, counts):
+        tree = [0] + np.asarray(counts, dtype=np.int64).tolist()
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = int(np.sum(counts))
+
+    def add(self, index, delta):
+        self.total += delta
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index):
+        """Sum of the counts of bins ``0..index``."""
+        total = 0
+        i = index + 1
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+def _key(country_id):
+    return f"{settings.SCORE_PERCENTILE_KEY_PREFIX}:{country_id}"
+
+
+# country id -> (loaded at, FenwickTree)
+_trees = {}
+
+
+def _load(country_id):
+    counts = np.zeros(BINS, dtype=np.int64)
+    stored = get_redis_connection("default").hgetall(_key(country_id))
+    if stored:
+        bins = np.fromiter((int(b) for b in stored.keys()), dtype=np.int64, count=len(stored))
+        counts[bins] = np.fromiter((int(c) for c in stored.values()), dtype=np.int64, count=len(stored))
+    return FenwickTree(counts)
+
+
+def _tree(country_id):
+    loaded_at, tree = _trees.get(country_id, (0, None))
+    if tree is None or time.monotonic() - loaded_at > settings.SCORE_PERCENTILE_REFRESH:
+        try:
+            fresh = _load(country_id)
+        except UNAVAILABLE:
+            if tree is None:
+                raise
+            # Answer from the copy at hand; the reload is tried again after the next interval
+            fresh = tree
+        _trees[country_id] = (time.monotonic(), fresh)
+        tree = fresh
+    return tree
+
+
+def percentile(country_id, score):
+    """
+    Percentage (0-100) of the customers of the country scoring below
+    ``score``, ties counting for half. None when the index is unavailable.
+    """
+    try:
+        tree = _tree(country_id)
+    except UNAVAILABLE:
+        return None
+    if not tree.total:
+        return None
+    index = int(score_bins([score])[0])
+    below = tree.prefix(index - 1) if index else 0
+    equal = tree.prefix(index) - below
+    return round(100.0 * (below + equal / 2) / tree.total, 1)
+
+
+def _increment(countries, bins, deltas):
+    keys = np.asarray(countries, dtype=np.int64) * BINS + bins
+    keys, inverse = np.unique(keys, return_inverse=True)
+    deltas = np.bincount(inverse, weights=deltas, minlength=len(keys)).astype(np.int64)
+    keys, deltas = keys[deltas != 0].tolist(), deltas[deltas != 0].tolist()
+    if not keys:
+        return
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for key, delta in zip(keys, deltas):
+            pipe.hincrby(_key(key // BINS), key % BINS, delta)
+        pipe.execute()
+    except UNAVAILABLE:
+        # The rebuild command brings the index back in line.
+        return
+    for key, delta in zip(keys, deltas):
+        if key // BINS in _trees:
+            _trees[key // BINS][1].add(key % BINS, delta)
+
+
+def record_score_changes(countries, previous, scores):
+    """Move customers of ``countries`` from their ``previous`` score bin to the new one."""
+    countries = np.asarray(countries, dtype=np.int64)
+    ones = np.ones(len(countries))
+    _increment(
+        np.concatenate([countries, countries]),
+        np.concatenate([score_bins(previous), score_bins(scores)]),
+        np.concatenate([-ones, ones]),
+    )
+
+
+def record_customers(countries, scores, delta=1):
+    """Count customers in (``delta=1``) or out of (``delta=-1``) the index."""
+    _increment(countries, score_bins(scores), np.full(len(countries), delta))
+
+
+def rebuild(country_id, scores):
+    """Replace the index of a country by the distribution of ``scores``."""
+    counts = np.bincount(score_bins(scores), minlength=BINS)
+    bins = np.flatnonzero(counts)
+    pipe = get_redis_connection("default").pipeline()
+    pipe.delete(_key(country_id))
+    if len(bins):
+        pipe.hset(_key(country_id), mapping=dict(zip(bins.tolist(), counts[bins].tolist())))
+    pipe.execute()
+    _trees[country_id] = (time.monotonic(), FenwickTree(counts))
+    return int(counts.sum())
@@ -0,0 +1,422 @@
+"""
+Vectorized credit scoring.
+
+Loan and repayment history is pulled with one query per table, turned into
+per-customer NumPy feature arrays and reduced to a 0-100 score. Nothing in
+here iterates over model instances: a whole country is scored with a handful
+of array operations.
+"""
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils.timezone import now
+
+from .dirty import mark_dirty
+from .models import Customer, CustomerFeatures, Loan, Repayment, ScoreHistory
+from .percentiles import record_score_changes
+
+FEATURES = (
+    "loan_count",
+    "done_count",
+    "outstanding_principal",
+    "overdue_count",
+    "max_days_past_due",
+    "repayment_count",
+    "on_time_ratio",
+    "creditor_count",
+    "last_activity",
+)
+
+# Weights of each component in the final score (they sum to 100).
+WEIGHTS = {
+    "punctuality": 35.0,
+    "completion": 20.0,
+    "delinquency": 30.0,
+    "overdue_share": 15.0,
+}
+# Customers without any loan get a neutral score.
+NEUTRAL_SCORE = 50.0
+# credit_score of a customer never scored yet (the field default): not a score
+UNSCORED = 0.0
+# Days past due after which the delinquency component is fully lost.
+MAX_DAYS_PAST_DUE = 90
+
+
+def _column(values, dtype, convert=None):
+    if convert is not None:
+        values = (convert(v) for v in values)
+    return np.fromiter(values, dtype=dtype)
+
+
+def _ordinal(value):
+    return value.toordinal() if value else 0
+
+
+def load_customers(customers):
+    """Return sorted customer ids, their current scores and their country ids as arrays."""
+    rows = list(customers.order_by("id").values_list("id", "credit_score", "country_id"))
+    ids, scores, countries = zip(*rows) if rows else ((), (), ())
+    return _column(ids, np.int64), _column(scores, np.float64), _column(countries, np.int64)
+
+
+def load_loans(customers):
+    """Load every loan of ``customers`` in one query, ordered by id."""
+    rows = list(
+        Loan.objects.filter(customer__in=customers.values("id"))
+        .order_by("id")
+        .values_list("id", "customer_id", "amount", "deadline", "date", "status", "creditor_npi")
+    )
+    columns = list(zip(*rows)) if rows else [()] * 7
+    return {
+        "id": _column(columns[0], np.int64),
+        "customer_id": _column(columns[1], np.int64),
+        "amount": _column(columns[2], np.float64, float),
+        "deadline": _column(columns[3], np.int64, _ordinal),
+        "date": _column(columns[4], np.int64, _ordinal),
+        "done": _column(columns[5], bool, lambda s: s == "done"),
+        "creditor_npi": np.array(columns[6], dtype=object),
+    }
+
+
+def load_repayments(customers):
+    """Load every repayment of ``customers`` in one query."""
+    rows = list(
+        Repayment.objects.filter(loan__customer__in=customers.values("id"))
+        .values_list("loan_id", "date")
+    )
+    columns = list(zip(*rows)) if rows else [()] * 2
+    return {
+        "loan_id": _column(columns[0], np.int64),
+        "date": _column(columns[1], np.int64, _ordinal),
+    }
+
+
+def load_history(customers):
+    """
+    Customers (see ``load_customers``), loans and repayments of the
+    ``customers`` queryset, read in one transaction. Reads only: within an
+    enclosing transaction no savepoint is needed.
+    """
+    with transaction.atomic(savepoint=False):
+        return (*load_customers(customers), load_loans(customers), load_repayments(customers))
+
+
+def compute_features(customer_ids, loans, repayments, today=None):
+    """
+    Build one array per entry of ``FEATURES``, aligned on ``customer_ids``
+    (which must be sorted). ``last_activity`` is a date ordinal, 0 when the
+    customer never had any activity.
+    """
+    today = (today or date.today()).toordinal()
+    n = len(customer_ids)
+
+    # Loans of customers missing from ``customer_ids`` (e.g. created after
+    # the customers were read) are ignored, as they would misalign the arrays.
+    cidx = np.searchsorted(customer_ids, loans["customer_id"])
+    known = cidx < n
+    known[known] = customer_ids[cidx[known]] == loans["customer_id"][known]
+    if not known.all():
+        loans = {name: values[known] for name, values in loans.items()}
+        cidx = cidx[known]
+    done = loans["done"]
+    pending = ~done
+    overdue = pending & (loans["deadline"] < today)
+
+    features = {
+        "loan_count": np.bincount(cidx, minlength=n),
+        "done_count": np.bincount(cidx, weights=done, minlength=n).astype(np.int64),
+        "outstanding_principal": np.bincount(cidx, weights=loans["amount"] * pending, minlength=n),
+        "overdue_count": np.bincount(cidx, weights=overdue, minlength=n).astype(np.int64),
+    }
+
+    days_past_due = np.where(overdue, today - loans["deadline"], 0)
+    max_days_past_due = np.zeros(n, dtype=np.int64)
+    np.maximum.at(max_days_past_due, cidx, days_past_due)
+    features["max_days_past_due"] = max_days_past_due
+
+    # Repayments are matched to their loan (loans are sorted by id) and
+    # counted as on time when made on or before the loan deadline.
+    # Repayments of loans missing from ``loans`` are ignored.
+    lidx = np.searchsorted(loans["id"], repayments["loan_id"])
+    known = lidx < len(loans["id"])
+    known[known] = loans["id"][lidx[known]] == repayments["loan_id"][known]
+    lidx = lidx[known]
+    rcidx = cidx[lidx]
+    on_time = repayments["date"][known] <= loans["deadline"][lidx]
+    repayment_count = np.bincount(rcidx, minlength=n)
+    on_time_count = np.bincount(rcidx, weights=on_time, minlength=n)
+    features["repayment_count"] = repayment_count
+    features["on_time_ratio"] = np.divide(
+        on_time_count, repayment_count,
+        out=np.ones(n, dtype=np.float64), where=repayment_count > 0,
+    )
+
+    with_creditor = np.array([npi is not None and npi != "" for npi in loans["creditor_npi"]], dtype=bool)
+    if with_creditor.any():
+        _, creditor = np.unique(loans["creditor_npi"][with_creditor].astype(str), return_inverse=True)
+        pairs = np.unique(cidx[with_creditor] * (creditor.max() + 1) + creditor)
+        features["creditor_count"] = np.bincount(pairs // (creditor.max() + 1), minlength=n)
+    else:
+        features["creditor_count"] = np.zeros(n, dtype=np.int64)
+
+    last_activity = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last_activity, cidx, loans["date"])
+    np.maximum.at(last_activity, rcidx, repayments["date"][known])
+    features["last_activity"] = last_activity
+    return features
+
+
+def score_features(features, today=None):
+    """
+    Reduce a feature dict (see ``compute_features``) to 0-100 scores with
+    the engine selected by ``settings.SCORE_ENGINE``.
+    """
+    if settings.SCORE_ENGINE == "model":
+        from .default_model import load_model
+        return load_model().score(features, today)
+    return rule_scores(features)
+
+
+def rule_scores(features):
+    """Rule-based 0-100 scores."""
+    loan_count = np.asarray(features["loan_count"], dtype=np.float64)
+    loans = np.maximum(loan_count, 1.0)
+    completion = np.asarray(features["done_count"]) / loans
+    overdue_share = np.asarray(features["overdue_count"]) / loans
+    delinquency = np.minimum(np.asarray(features["max_days_past_due"]) / MAX_DAYS_PAST_DUE, 1.0)
+
+    raw = (
+        WEIGHTS["punctuality"] * np.asarray(features["on_time_ratio"], dtype=np.float64)
+        + WEIGHTS["completion"] * completion
+        + WEIGHTS["delinquency"] * (1.0 - delinquency)
+        + WEIGHTS["overdue_share"] * (1.0 - overdue_share)
+    )
+    scores = np.where(loan_count > 0, raw, NEUTRAL_SCORE)
+    return np.round(np.clip(scores, 0.0, 100.0), 2)
+
+
+def write_scores(customer_ids, scores, previous, countries, batch_size=900):
+    """
+    Persist the scores that changed, append them to ``ScoreHistory``, update
+    the per-country percentile index and return how many were written.
+
+    Scores are rounded to two decimals, so many customers share a value:
+    rows are grouped by score and written with one
+    ``UPDATE ... WHERE id IN (...)`` per group and batch. This is an order of
+    magnitude faster than ``bulk_update``, whose per-row CASE expressions
+    dominate the runtime on large countries.
+    """
+    changed = np.flatnonzero(np.abs(scores - previous) > 1e-9)
+    changed = changed[np.argsort(scores[changed], kind="stable")]
+    values, starts = np.unique(scores[changed], return_index=True)
+    with transaction.atomic():
+        for value, group in zip(values, np.split(changed, starts[1:])):
+            for start in range(0, len(group), batch_size):
+                ids = customer_ids[group[start:start + batch_size]].tolist()
+                Customer.objects.filter(id__in=ids).update(credit_score=float(value))
+        effective_date = now()
+        ScoreHistory.objects.bulk_create(
+            [
+                ScoreHistory(customer_id=int(customer_ids[i]), score=float(scores[i]), effective_date=effective_date)
+                for i in changed
+            ],
+            batch_size=batch_size,
+        )
+    moved = countries[changed], previous[changed], scores[changed]
+    transaction.on_commit(lambda: record_score_changes(*moved))
+    return len(changed)
+
+
+def recompute_scores(customers, batch_size=900, today=None):
+    """
+    Score every customer of the ``customers`` queryset.
+    Return ``(scored, updated)`` counts.
+    """
+    customer_ids, previous, countries, loans, repayments = load_history(customers)
+    if not len(customer_ids):
+        return 0, 0
+    features = compute_features(customer_ids, loans, repayments, today)
+    scores = score_features(features, today)
+    return len(customer_ids), write_scores(customer_ids, scores, previous, countries, batch_size)
+
+
+def store_features(customer_ids, features, today=None):
+    """Upsert ``CustomerFeatures`` rows from a feature dict."""
+    today = today or date.today()
+    rows = [
+        CustomerFeatures(
+            customer_id=int(customer_id),
+            loan_count=int(features["loan_count"][i]),
+            done_count=int(features["done_count"][i]),
+            outstanding_principal=Decimal(f"{features['outstanding_principal'][i]:.2f}"),
+            overdue_count=int(features["overdue_count"][i]),
+            max_days_past_due=int(features["max_days_past_due"][i]),
+            repayment_count=int(features["repayment_count"][i]),
+            on_time_ratio=float(features["on_time_ratio"][i]),
+            creditor_count=int(features["creditor_count"][i]),
+            last_activity=date.fromordinal(int(features["last_activity"][i])) if features["last_activity"][i] else None,
+            computed_on=today,
+        )
+        for i, customer_id in enumerate(customer_ids)
+    ]
+    CustomerFeatures.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["customer"],
+        update_fields=[*FEATURES, "computed_on"],
+    )
+    return len(rows)
+
+
+def refresh_features(customers, today=None):
+    """Recompute and store the features of the ``customers`` queryset."""
+    customer_ids, _, _, loans, repayments = load_history(customers)
+    if not len(customer_ids):
+        return 0
+    features = compute_features(customer_ids, loans, repayments, today)
+    return store_features(customer_ids, features, today)
+
+
+def stale_customers(today=None):
+    """
+    Customers whose stored overdue figures are out of date: a pending loan
+    of theirs is past its deadline and their row predates ``today`` (or is
+    missing). The figures of everyone else do not depend on the date.
+    """
+    today = today or date.today()
+    return Customer.objects.filter(
+        Q(features__computed_on__lt=today) | Q(features__isnull=True),
+        id__in=Loan.objects.filter(status="pending", deadline__lt=today).values("customer_id"),
+    )
+
+
+def refresh_overdue_features(today=None, chunk_size=10000):
+    """
+    Bring the rows of ``stale_customers`` up to ``today`` and queue their
+    re-score, ``chunk_size`` customers per transaction. Return how many were
+    refreshed.
+    """
+    today = today or date.today()
+    total = 0
+    while True:
+        ids = list(stale_customers(today).order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            return total
+        with transaction.atomic():
+            total += refresh_features(Customer.objects.filter(id__in=ids), today)
+            mark_dirty(*ids)
+
+
+def load_stored_features(customer_ids):
+    """
+    Read the feature store for ``customer_ids`` (sorted) in one query.
+    Customers without a row get the features of a customer without loans.
+    """
+    n = len(customer_ids)
+    features = {name: np.zeros(n, dtype=np.int64) for name in FEATURES}
+    features["outstanding_principal"] = np.zeros(n, dtype=np.float64)
+    features["on_time_ratio"] = np.ones(n, dtype=np.float64)
+    rows = list(
+        CustomerFeatures.objects.filter(customer_id__in=customer_ids.tolist())
+        .values_list("customer_id", *FEATURES)
+    )
+    if rows:
+        columns = list(zip(*rows))
+        idx = np.searchsorted(customer_ids, _column(columns[0], np.int64))
+        for name, values in zip(FEATURES, columns[1:]):
+            if name == "last_activity":
+                values = _column(values, np.int64, _ordinal)
+            elif name == "outstanding_principal":
+                values = _column(values, np.float64, float)
+            features[name][idx] = values
+    return features
+
+
+def row_features(row, today=None):
+    """
+    Feature dict of a single customer from its ``CustomerFeatures`` row
+    (``None`` for a customer without loans).
+    """
+    values = {name: getattr(row, name) if row else 0 for name in FEATURES}
+    values["outstanding_principal"] = float(values["outstanding_principal"])
+    values["on_time_ratio"] = row.on_time_ratio if row else 1.0
+    values["last_activity"] = _ordinal(values["last_activity"])
+    if row and today and row.computed_on < today and row.overdue_count:
+        # Overdue loans kept aging since the row was computed.
+        values["max_days_past_due"] += (today - row.computed_on).days
+    return {name: np.array([value]) for name, value in values.items()}
+
+
+def overlay_loan(features, amount, deadline, today=None):
+    """
+    Return a copy of a single-customer feature dict with a hypothetical
+    pending loan of ``amount`` due on ``deadline`` added to it.
+    """
+    today = today or date.today()
+    projected = {name: values.copy() for name, values in features.items()}
+    projected["loan_count"] += 1
+    projected["outstanding_principal"] += float(amount)
+    projected["last_activity"] = np.maximum(projected["last_activity"], today.toordinal())
+    if deadline < today:
+        projected["overdue_count"] += 1
+        projected["max_days_past_due"] = np.maximum(projected["max_days_past_due"], (today - deadline).days)
+    return projected
+
+
+def rescore_customers(customer_ids, batch_size=900):
+    """
+    Re-score the given customers only (incremental path). Features are read
+    from the feature store rather than recomputed from their loans; the
+    customers without a row yet (``recompute_scores`` stores none) get it
+    computed from their loans first.
+    """
+    customers = Customer.objects.filter(id__in=list(customer_ids))
+    missing = list(customers.filter(features__isnull=True).values_list("id", flat=True))
+    if missing:
+        refresh_features(Customer.objects.filter(id__in=missing))
+    customer_ids, previous, countries = load_customers(customers)
+    if not len(customer_ids):
+        return 0, 0
+    scores = score_features(load_stored_features(customer_ids))
+    return len(customer_ids), write_scores(customer_ids, scores, previous, countries, batch_size)
+
+
+def score_as_of(customer, moment):
+    """Score of ``customer`` at ``moment`` (None before it was registered)."""
+    return (
+        ScoreHistory.objects.filter(customer=customer, effective_date__lte=moment)
+        .order_by("-effective_date")
+        .values_list("score", flat=True)
+        .first()
+    )
+
+
+def score_series(customer, end, points):
+    """
+    Score history of ``customer`` up to ``end`` downsampled to at most
+    ``points`` (timestamp, score) pairs sampled at evenly spaced instants,
+    each keeping the last score in effect at that instant.
+
+    The sampling runs in the database: each change is filed under the first
+    instant at or after it, and only the last change of each instant is read.
+    """
+    history = ScoreHistory.objects.filter(customer=customer, effective_date__lte=end)
+    span = history.aggregate(count=Count("id"), first=Min("effective_date"), last=Max("effective_date"))
+    if span["count"] <= points:
+        return list(history.order_by("effective_date").values_list("effective_date", "score"))
+    step = (span["last"] - span["first"]) / (points - 1)
+    instant = Case(
+        *[When(effective_date__lte=span["first"] + step * k, then=Value(k)) for k in range(points - 1)],
+        default=Value(points - 1),
+    )
+    last = Window(RowNumber(), partition_by=instant, order_by=[F("effective_date").desc(), F("id").desc()])
+    return list(
+        history.annotate(last=last).filter(last=1)
+        .order_by("effective_date").values_list("effective_date", "score")
+    )
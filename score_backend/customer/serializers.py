@@ -1,11 +1,17 @@
 from rest_framework import serializers
-from .models import Customer, Loan
+from .models import Customer, CustomerFeatures, Loan
 from score.utils import FileSerializer
 
 class CreditorNPISerializer(serializers.Field):
-    def to_representation(self, value):
+    def to_representation(self, value: Loan):
+        if value.creditor_id is not None:
+            return value.creditor.first_name + " " + value.creditor.last_name
+        # Loans not linked to their creditor yet are resolved by NPI
+        creditor_names = self.context.get("creditor_names")
+        if creditor_names is not None:
+            return creditor_names.get(value.creditor_npi)
         try:
-            customer = Customer.objects.get(npi=value)
+            customer = Customer.objects.get(npi=value.creditor_npi)
             return customer.first_name + " " + customer.last_name
         except Customer.DoesNotExist:
             return "Undefined"
@@ -15,10 +21,10 @@ class ReceivableCustomerFieldSerializer(serializers.Field):
         return value.first_name + " " + value.last_name
 
 class LoanSerializer(serializers.ModelSerializer):
-    creditor_npi = CreditorNPISerializer()
+    creditor_npi = CreditorNPISerializer(source='*')
     class Meta:
         model = Loan
-        fields = '__all__'
+        exclude = ['creditor']
 
 class ReceivableLoanSerializer(serializers.ModelSerializer):
     customer = ReceivableCustomerFieldSerializer()
@@ -26,8 +32,14 @@ class ReceivableLoanSerializer(serializers.ModelSerializer):
         model = Loan
         fields = ['customer', 'date', 'amount', 'periodicity', 'deadline_amount', 'deadline', 'verified', 'solvability', 'status']
 
+class CustomerFeaturesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerFeatures
+        exclude = ["customer"]
+
 class CustomerListSerializer(serializers.ModelSerializer):
     loans = LoanSerializer(many=True)
+    features = CustomerFeaturesSerializer(read_only=True)
     class Meta:
         model = Customer
-        fields = ["uuid", "npi", "phone_number", 'loans']
+        fields = ["uuid", "npi", "phone_number", 'loans', 'features']
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .alerts import refresh_alerts
+from .dirty import mark_dirty
+from .identity import invalidate
+from .models import Customer, Loan, Repayment, ScoreHistory
+from .percentiles import record_customers
+from .scoring import UNSCORED, refresh_features
+
+
+def _cascaded(origin, model):
+    # Deletions cascading from a customer (or anything above it) leave
+    # nothing to maintain: its feature row goes away with it.
+    return origin is not None and getattr(origin, "model", type(origin)) is not model
+
+
+def customer_changed(customer_id):
+    """Refresh the feature row in the current transaction and queue a re-score."""
+    if customer_id is None:
+        return
+    refresh_features(Customer.objects.filter(id=customer_id))
+    mark_dirty(customer_id)
+
+
+@receiver(post_save, sender=Loan)
+def loan_saved(sender, instance: Loan, **kwargs):
+    customer_changed(instance.customer_id)
+    refresh_alerts([instance])
+
+
+@receiver(post_delete, sender=Loan)
+def loan_deleted(sender, instance: Loan, origin=None, **kwargs):
+    if not _cascaded(origin, Loan):
+        customer_changed(instance.customer_id)
+
+
+@receiver(post_save, sender=Repayment)
+def repayment_saved(sender, instance: Repayment, **kwargs):
+    customer_changed(Loan.objects.filter(id=instance.loan_id).values_list("customer_id", flat=True).first())
+    refresh_alerts(Loan.objects.filter(id=instance.loan_id))
+
+
+@receiver(post_delete, sender=Repayment)
+def repayment_deleted(sender, instance: Repayment, origin=None, **kwargs):
+    # Repayments deleted with their loan are handled by the loan's own signal.
+    if not _cascaded(origin, Repayment):
+        customer_changed(Loan.objects.filter(id=instance.loan_id).values_list("customer_id", flat=True).first())
+        refresh_alerts(Loan.objects.filter(id=instance.loan_id))
+
+
+def _saved(name, attname, update_fields):
+    return update_fields is None or name in update_fields or attname in update_fields
+
+
+def _remember(instance: Customer, update_fields=None):
+    # Deferred fields are left out: reading them would query the row
+    for name, attname in (("npi", "npi"), ("huissier", "huissier_id")):
+        if _saved(name, attname, update_fields):
+            setattr(instance, f"_stored_{attname}", instance.__dict__.get(attname))
+
+
+@receiver(post_init, sender=Customer)
+def customer_loaded(sender, instance: Customer, **kwargs):
+    # The NPI and huissier as stored, so a save tells what changed without reading the row again
+    _remember(instance)
+
+
+@receiver(post_save, sender=Customer)
+def customer_created(sender, instance: Customer, created, update_fields=None, **kwargs):
+    # A changed NPI drops its old cache entry too
+    invalidate(instance.npi, instance._stored_npi if _saved("npi", "npi", update_fields) else None)
+    if created:
+        if (instance.credit_score != UNSCORED):
+            # Created with a score: the first entry of the history. Otherwise
+            # the first score written is, as score_as_of must not answer 0.0
+            ScoreHistory.objects.create(customer=instance, score=instance.credit_score)
+        transaction.on_commit(lambda: record_customers([instance.country_id], [instance.credit_score]))
+    elif (_saved("huissier", "huissier_id", update_fields)
+          and instance.__dict__.get("huissier_id") != instance._stored_huissier_id):
+        # Alerts follow the customer
+        refresh_alerts(Loan.objects.filter(customer_id=instance.id, status='pending'))
+    _remember(instance, update_fields)
+
+
+@receiver(post_delete, sender=Customer)
+def customer_deleted(sender, instance: Customer, **kwargs):
+    invalidate(instance.npi)
+    transaction.on_commit(lambda: record_customers([instance.country_id], [instance.credit_score], -1))
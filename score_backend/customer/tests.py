@@ -1,3 +1,898 @@
-from django.test import TestCase
+from bisect import bisect_right
+from datetime import date, timedelta
+from importlib import import_module
+from io import StringIO
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from redis.exceptions import RedisError
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+
+from score.testing import (
+    Endpoint, FakeRedis, QueryBudgetTestCase, QueryPlanTestCase, make_customers, make_huissier,
+)
+from . import default_model, identity, imports, percentiles
+from .backtest import Backtest, backtest_country, population_stability
+from .alerts import overdue_alerts
+from .dirty import DatabaseDirtyQueue, RedisDirtyQueue
+from .imports import import_customers, read_csv
+from .models import Customer, CustomerFeatures, DirtyCustomer, Loan, OverdueAlert, Repayment, ScoreHistory
+from .scoring import (
+    MAX_DAYS_PAST_DUE, NEUTRAL_SCORE, WEIGHTS, compute_features, load_history, recompute_scores, refresh_features,
+    refresh_overdue_features, rescore_customers, row_features, score_as_of, score_features, score_series,
+    stale_customers,
+)
+
+
+class QueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 30)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.huissier.user)
+
+    def test_customers_list(self):
+        self.assertEndpointIndexed(self.client.get, "/customer/list/")
+
+    def test_customers_list_page(self):
+        response = self.assertEndpointIndexed(self.client.get, "/customer/list/", {"limit": 10})
+        self.assertEndpointIndexed(self.client.get, "/customer/list/", {"limit": 10, "cursor": response.data["next"]})
+
+    def test_customers_list_stream_values(self):
+        for value, content_type in [("1", "application/json"), ("true", "application/json"),
+                                    ("ndjson", "application/x-ndjson")]:
+            with self.subTest(stream=value):
+                response = self.client.get("/customer/list/", {"stream": value})
+                self.assertTrue(response.streaming)
+                self.assertEqual(response["Content-Type"], content_type)
+                b"".join(response.streaming_content)
+        for value in ("0", "false"):
+            with self.subTest(stream=value):
+                response = self.client.get("/customer/list/", {"stream": value})
+                self.assertFalse(response.streaming)
+                self.assertEqual(len(response.data["customers"]), 30)
+        response = self.client.get("/customer/list/", {"stream": "yes"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_customer_by_npi(self):
+        self.assertEndpointIndexed(self.client.get, "/customer/by-npi/", {"npi": self.customers[3].npi})
+
+    def test_customer_by_uuid(self):
+        self.assertIndexed(Customer.objects.filter(uuid=self.customers[3].uuid))
+
+    def test_receivables(self):
+        self.assertIndexed(self.customers[3].receivables.select_related('customer'))
+        self.assertIndexed(Loan.objects.filter(creditor_npi=self.customers[3].npi))
+
+
+class QueryBudgetTests(QueryBudgetTestCase):
+    def endpoints(self):
+        user = self.huissier.user
+        return [
+            Endpoint("/customer/new/", user, "post", lambda run: {
+                'first_name': "New", 'last_name': "Customer", 'npi': f"NEW{run:05d}",
+                'phone_number': "01234567", 'email': f"new{run}@customer.org",
+            }, max_queries=6),
+            Endpoint("/customer/import/", user, "post", lambda run: {'customers': [
+                {'first_name': "New", 'last_name': "Customer", 'npi': f"IMPORT{run}{i}", 'phone_number': "01234567",
+                 'email': f"import{run}{i}@customer.org"}
+                for i in range(5)
+            ]}, max_queries=6),
+            Endpoint("/customer/list/", user, max_queries=3),
+            Endpoint("/customer/list/?limit=5", user, max_queries=3),
+            Endpoint("/customer/list/?stream=1", user, max_queries=3),
+            Endpoint("/customer/by-npi/", user, data={'npi': "BEN0000003"}, max_queries=1),
+            Endpoint("/customer/simulate-loan/", user, "post", {
+                'npi': "BEN0000003", 'amount': "500", 'periodicity': "monthly",
+                'deadline_amount': "50", 'deadline': "2030-01-01",
+            }, max_queries=1),
+            Endpoint("/customer/scores/batch/", user, "post", {'npis': ["BEN0000001", "BEN0000002", "UNKNOWN"]}, max_queries=1),
+        ]
+
+
+class OverdueAlertTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customer = make_customers(cls.huissier, 1, loans_per_customer=0)[0]
+
+    def test_write_path(self):
+        today = date.today()
+        loan = Loan.objects.create(
+            customer=self.customer, amount=100, periodicity="monthly", deadline_amount=10,
+            deadline=today - timedelta(days=3),
+        )
+        self.assertEqual([alert['id'] for alert in overdue_alerts(self.huissier, today)], [loan.id])
+        # Not overdue yet the day of the deadline
+        self.assertEqual(overdue_alerts(self.huissier, today - timedelta(days=3)), [])
+
+        Repayment.objects.create(loan=loan, date=today)
+        self.assertEqual(len(overdue_alerts(self.huissier, today)[0]['repayments']), 1)
+
+        loan.status = "done"
+        loan.save()
+        self.assertEqual(overdue_alerts(self.huissier, today), [])
+
+    def test_alerts_follow_the_huissier(self):
+        loan = Loan.objects.create(
+            customer=self.customer, amount=100, periodicity="monthly", deadline_amount=10,
+            deadline=date.today() - timedelta(days=3),
+        )
+        customer = Customer.objects.get(pk=self.customer.pk)
+        with mock.patch("customer.signals.refresh_alerts") as refresh:
+            customer.first_name = "Renamed"
+            with self.assertNumQueries(1):  # The UPDATE: the stored values were kept when the row was loaded
+                customer.save()
+            customer.save(update_fields=["first_name"])
+        refresh.assert_not_called()
+
+        other = make_huissier("TGO")
+        customer.huissier = other
+        customer.save()
+        self.assertEqual(list(OverdueAlert.objects.values_list("loan_id", "huissier_id")), [(loan.id, other.id)])
+        customer.huissier = self.huissier
+        customer.save(update_fields=["huissier"])
+        self.assertEqual([alert['id'] for alert in overdue_alerts(self.huissier, date.today())], [loan.id])
+
+    def test_sweep(self):
+        loan = Loan.objects.create(
+            customer=self.customer, amount=100, periodicity="monthly", deadline_amount=10,
+            deadline=date.today() - timedelta(days=3),
+        )
+        OverdueAlert.objects.all().delete()
+        Loan.objects.filter(id=loan.id).update(deadline=date.today() - timedelta(days=5))
+        call_command("sweep_overdue_alerts", stdout=StringIO())
+        self.assertEqual(OverdueAlert.objects.get().deadline, date.today() - timedelta(days=5))
+
+        Loan.objects.filter(id=loan.id).update(status="done")
+        call_command("sweep_overdue_alerts", stdout=StringIO())
+        self.assertFalse(OverdueAlert.objects.exists())
+
+    def test_alerts_index(self):
+        self.assertIndexed(OverdueAlert.objects.filter(huissier=self.huissier, deadline__lt=date.today()))
+
+
+class CreditorBackfillTests(TestCase):
+    def test_backfill(self):
+        huissier = make_huissier()
+        borrower, creditor = make_customers(huissier, 2, loans_per_customer=0)
+        linked = Loan.objects.create(
+            customer=borrower, creditor_npi=creditor.npi, amount=100, periodicity="monthly",
+            deadline_amount=10, deadline=date.today(),
+        )
+        unknown = Loan.objects.create(
+            customer=borrower, creditor_npi="UNKNOWN", amount=100, periodicity="monthly",
+            deadline_amount=10, deadline=date.today(),
+        )
+        backfill = import_module("customer.migrations.0012_backfill_loan_creditor")
+        backfill.backfill_creditors(apps, None)
+        linked.refresh_from_db()
+        unknown.refresh_from_db()
+        self.assertEqual(linked.creditor, creditor)
+        self.assertIsNone(unknown.creditor)
+
+
+@override_settings(CACHES={'default': {'BACKEND': "django.core.cache.backends.locmem.LocMemCache"}})
+class IdentityCacheTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 12, loans_per_customer=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_read_through(self):
+        customer = self.customers[3]
+        with self.assertNumQueries(1):
+            self.assertEqual(identity.lookup(customer.npi)['uuid'], customer.uuid)
+        with self.assertNumQueries(0):
+            self.assertEqual(identity.lookup(customer.npi)['country'], "BEN")
+
+    def test_unknown_npi(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(identity.lookup("BEN9"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(identity.lookup("BEN9"))
+
+    def test_invalidation(self):
+        customer = self.customers[3]
+        old_npi = customer.npi
+        identity.lookup(old_npi)
+        identity.lookup("BEN9")
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.first_name = "Renamed"
+            customer.save()
+        self.assertEqual(identity.lookup(old_npi)['name'], f"Renamed {customer.last_name}")
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.npi = "BEN9"
+            customer.save()
+        self.assertIsNone(identity.lookup(old_npi))
+        self.assertEqual(identity.lookup("BEN9")['uuid'], customer.uuid)
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.delete()
+        self.assertIsNone(identity.lookup("BEN9"))
+
+    def test_prefix_search(self):
+        client = APIClient()
+        client.force_authenticate(self.huissier.user)
+        response = client.get("/customer/by-npi/", {'prefix': "BEN000001", 'limit': 2})
+        self.assertEqual([match['npi'] for match in response.data['customers']], ["BEN0000010", "BEN0000011"])
+        self.assertIndexed(Customer.objects.filter(npi__gte="BEN0", npi__lt="BEN0\uffff").order_by('npi')[:10])
+
+
+class CustomerImportTests(TestCase):
+    HEADER = "first_name,last_name,npi,phone_number,email\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 3, loans_per_customer=0)
+
+    def csv(self, rows):
+        return SimpleUploadedFile("customers.csv", (self.HEADER + "".join(rows)).encode(), content_type="text/csv")
+
+    def test_csv_upload(self):
+        client = APIClient()
+        client.force_authenticate(self.huissier.user)
+        response = client.post("/customer/import/", {'batch_size': 2, 'file': self.csv([
+            "Jean,Doe,IMP001,01234567,jean@doe.org\n",
+            "J,Doe,IMP002,01234567,j@doe.org\n",
+            "Jeanne,Doe,BEN0000001,01234567,jeanne@doe.org\n",
+            "Paul,Doe,IMP003,0123,paul@doe.org\n",
+            "Jean,Doe,IMP001,01234567,jean2@doe.org\n",
+            "Marie,Doe,IMP004,01234567\n",
+            "Luc,Doe,IMP005,01234567,luc@doe.org\n",
+        ])})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [
+            {'row': 2, 'npi': "IMP002", 'errors': {'first_name': "This field must have at least 2 characters"}},
+            {'row': 3, 'npi': "BEN0000001", 'errors': {'npi': "Customer already exists"}},
+            {'row': 4, 'npi': "IMP003", 'errors': {'phone_number': "This field must have at least 6 characters"}},
+            {'row': 5, 'npi': "IMP001", 'errors': {'npi': "Duplicate of row 1"}},
+            {'row': 6, 'npi': "IMP004", 'errors': {'email': "Missing field"}},
+        ])
+        customer = Customer.objects.get(npi="IMP005")
+        self.assertEqual((customer.huissier, customer.zone, customer.country_id, customer.credit_score),
+                         (self.huissier, "Z1", self.huissier.front_office.country_id, 0.0))
+        self.assertTrue(customer.uuid)
+
+    def test_invalid_upload(self):
+        client = APIClient()
+        client.force_authenticate(self.huissier.user)
+        response = client.post("/customer/import/", {'customers': [{'npi': "IMP001"}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.data['error'].startswith("Missing columns: "))
+
+    def test_one_existence_query_per_batch(self):
+        columns = read_csv(self.csv(f"Jean,Doe,IMP{i:03d},01234567,jean@doe.org\n" for i in range(10)))
+        with self.assertNumQueries(4 * 4):  # savepoint, npi__in, INSERT, release
+            report = import_customers(columns, self.huissier, 3)
+        self.assertEqual(report['created'], 10)
+
+    def test_concurrent_imports(self):
+        columns = read_csv(self.csv(f"Jean,Doe,IMP{i:03d},01234567,jean@doe.org\n" for i in range(4)))
+        bulk_insert = imports._bulk_insert
+        calls = []
+
+        def racing(model, attnames, rows):
+            # Another import keeps registering IMP001 between the check and the INSERT
+            calls.append(len(rows))
+            if (any(row[3] == "IMP001" for row in rows)):
+                raise IntegrityError("UNIQUE constraint failed: customer.npi")
+            bulk_insert(model, attnames, rows)
+
+        with mock.patch("customer.imports._bulk_insert", side_effect=racing):
+            report = import_customers(columns, self.huissier, 4)
+        self.assertEqual(calls, [4] * imports.IMPORT_ATTEMPTS + [1] * 4)
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(report['errors'], [{'row': 2, 'npi': "IMP001", 'errors': {'npi': "Customer already exists"}}])
+        self.assertEqual(Customer.objects.filter(npi__startswith="IMP").count(), 3)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write(self.HEADER + "Jean,Doe,IMP001,01234567,jean@doe.org\nJ,Doe,IMP002,01234567,j@doe.org\n")
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command("import_customers", f.name, "--huissier", self.huissier.npi, stdout=out)
+        self.assertIn("row 2 (IMP002)", out.getvalue())
+        self.assertIn("1 customers created, 1 rows rejected", out.getvalue())
+
+    def test_large_import(self):
+        # Throughput is reported by the import_customers command (rows/s), not asserted here
+        rows = 20000
+        columns = read_csv(self.csv(f"Jean,Doe,IMP{i:06d},01234567,jean{i}@doe.org\n" for i in range(rows)))
+        report = import_customers(columns, self.huissier, 2000)
+        self.assertEqual((report['created'], report['rejected']), (rows, 0))
+        self.assertEqual(Customer.objects.filter(npi__startswith="IMP").count(), rows)
+
+
+def baseline_score(customer, today):
+    """The rule score of ``customer`` computed loan by loan over the ORM."""
+    loans = list(customer.loans.prefetch_related('repayments'))
+    if not loans:
+        return NEUTRAL_SCORE
+    overdue = [loan for loan in loans if loan.status != "done" and loan.deadline < today]
+    repayments = [(repayment, loan) for loan in loans for repayment in loan.repayments.all()]
+    on_time = (
+        sum(repayment.date <= loan.deadline for repayment, loan in repayments) / len(repayments)
+        if repayments else 1.0
+    )
+    days_past_due = max([(today - loan.deadline).days for loan in overdue], default=0)
+    score = (
+        WEIGHTS["punctuality"] * on_time
+        + WEIGHTS["completion"] * sum(loan.status == "done" for loan in loans) / len(loans)
+        + WEIGHTS["delinquency"] * (1 - min(days_past_due / MAX_DAYS_PAST_DUE, 1))
+        + WEIGHTS["overdue_share"] * (1 - len(overdue) / len(loans))
+    )
+    return round(min(max(score, 0.0), 100.0), 2)
+
+
+class ScoringTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = date.today()
+        huissier = make_huissier()
+        cls.customers = make_customers(huissier, 8, loans_per_customer=3)
+        make_customers(huissier, 2, loans_per_customer=0)
+        # Late repayments, a long-overdue loan and a loan not due yet
+        late = Loan.objects.filter(customer=cls.customers[2], status="done").first()
+        Repayment.objects.create(loan=late, date=late.deadline + timedelta(days=10))
+        Loan.objects.filter(customer=cls.customers[4], status="pending").update(
+            deadline=cls.today - timedelta(days=200),
+        )
+        Loan.objects.create(
+            customer=cls.customers[6], creditor_npi=cls.customers[0].npi, amount=80, periodicity="monthly",
+            deadline_amount=10, deadline=cls.today + timedelta(days=5),
+        )
+
+    def test_matches_loan_by_loan_computation(self):
+        scored, updated = recompute_scores(Customer.objects.all(), today=self.today)
+        self.assertEqual(scored, 10)
+        for customer in Customer.objects.all():
+            with self.subTest(customer=customer.npi):
+                self.assertAlmostEqual(customer.credit_score, baseline_score(customer, self.today), places=6)
+        self.assertEqual(ScoreHistory.objects.count(), updated)
+        # Nothing changed: nothing written
+        self.assertEqual(recompute_scores(Customer.objects.all(), today=self.today), (10, 0))
+
+    def test_one_update_per_score_and_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            _, updated = recompute_scores(Customer.objects.all(), batch_size=2, today=self.today)
+        scores = list(Customer.objects.values_list("credit_score", flat=True))
+        expected = sum(-(-scores.count(score) // 2) for score in set(scores))
+        updates = [query for query in queries.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(updated, 10)
+        self.assertEqual(len(updates), expected)
+        self.assertLess(len(updates), updated)
+
+    def test_rescore_agrees_with_recompute(self):
+        # As after a full recompute: scored, but no feature row stored
+        recompute_scores(Customer.objects.all(), today=self.today)
+        CustomerFeatures.objects.all().delete()
+        self.assertEqual(rescore_customers([customer.id for customer in self.customers]), (8, 0))
+        self.assertEqual(CustomerFeatures.objects.count(), 8)
+        for customer in self.customers:
+            with self.subTest(customer=customer.npi):
+                customer.refresh_from_db()
+                self.assertAlmostEqual(customer.credit_score, baseline_score(customer, self.today), places=6)
+
+    def test_loans_of_unknown_customers_are_ignored(self):
+        customer_ids, _, _, loans, repayments = load_history(Customer.objects.all())
+        # As if a customer with loans had been created between the reads
+        missing = list(customer_ids).index(self.customers[7].id)
+        known = compute_features(np.delete(customer_ids, missing), loans, repayments, self.today)
+        everyone = compute_features(customer_ids, loans, repayments, self.today)
+        for name, values in known.items():
+            with self.subTest(feature=name):
+                self.assertEqual(len(values), len(customer_ids) - 1)
+                self.assertTrue((values == np.delete(everyone[name], missing)).all())
+
+
+class OverdueFeatureTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = date.today()
+        huissier = make_huissier()
+        cls.customer, cls.current = make_customers(huissier, 2, loans_per_customer=0)
+        # Written through the signals: the rows are computed today
+        for customer in (cls.customer, cls.current):
+            Loan.objects.create(
+                customer=customer, amount=100, periodicity="monthly", deadline_amount=10,
+                deadline=cls.today + timedelta(days=3),
+            )
+        Loan.objects.filter(customer=cls.current).update(status="done")
+
+    def test_loan_passing_its_deadline(self):
+        features = CustomerFeatures.objects.get(customer=self.customer)
+        self.assertEqual((features.overdue_count, features.max_days_past_due), (0, 0))
+
+        later = self.today + timedelta(days=10)
+        self.assertEqual(list(stale_customers(later)), [self.customer])
+        with mock.patch("customer.scoring.mark_dirty") as mark_dirty:
+            self.assertEqual(refresh_overdue_features(later), 1)
+        mark_dirty.assert_called_once_with(self.customer.id)
+        features.refresh_from_db()
+        self.assertEqual((features.overdue_count, features.max_days_past_due, features.computed_on), (1, 7, later))
+        # Up to date until the next day
+        self.assertEqual(refresh_overdue_features(later), 0)
+        self.assertEqual(list(stale_customers(later + timedelta(days=1))), [self.customer])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("refresh_overdue_features", stdout=out)
+        self.assertIn("0 feature rows refreshed", out.getvalue())
+
+    def test_stale_customers_index(self):
+        self.assertIndexed(stale_customers(self.today))
+
+
+class DirtyQueueTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("customer.dirty.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unacked_batch_is_recovered(self):
+        queue = RedisDirtyQueue()
+        queue.mark([1, 2, 3])
+        batch = queue.pop(2)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(queue.size(), 1)
+        # The worker died before its ack: the next one gets the batch back
+        restarted = RedisDirtyQueue()
+        restarted.recover()
+        self.assertEqual(sorted(restarted.pop(5)), [1, 2, 3])
+        restarted.ack([1, 2, 3])
+        restarted.recover()
+        self.assertEqual(restarted.size(), 0)
+
+    def test_marked_while_scored(self):
+        for queue in (RedisDirtyQueue(), DatabaseDirtyQueue()):
+            with self.subTest(queue=type(queue).__name__):
+                queue.mark([1, 2])
+                batch = queue.pop(5)
+                queue.mark([1])
+                queue.ack(batch)
+                self.assertEqual(queue.size(), 1)
+                self.assertEqual(queue.pop(5), [1])
+
+    def test_database_queue(self):
+        queue = DatabaseDirtyQueue()
+        queue.mark([3, 1, 3])
+        queue.mark([2])
+        self.assertEqual(queue.size(), 3)
+        # Oldest marks first
+        self.assertEqual(sorted(queue.pop(2)), [1, 3])
+        queue.ack([1, 3])
+        self.assertEqual(queue.pop(5), [2])
+
+    def test_redis_unavailable(self):
+        queue = RedisDirtyQueue()
+        with mock.patch.object(self.redis, "sadd", side_effect=RedisError):
+            queue.mark([1, 2])
+        self.assertEqual(sorted(DirtyCustomer.objects.values_list("customer_id", flat=True)), [1, 2])
+        queue.mark([3])
+        with mock.patch.object(self.redis, "scard", side_effect=RedisError):
+            self.assertEqual(queue.size(), 2)
+        # The parked ids come first, then Redis makes up the batch
+        batch = queue.pop(3)
+        self.assertEqual((sorted(batch[:2]), batch[2]), ([1, 2], 3))
+        with mock.patch.object(self.redis, "srandmember", side_effect=RedisError):
+            self.assertEqual(sorted(queue.pop(3)), [1, 2])
+        queue.ack(batch)
+        self.assertEqual(queue.size(), 0)
+
+    def test_database_rows_stay_until_acked(self):
+        queue = DatabaseDirtyQueue()
+        queue.mark([1, 2])
+        self.assertEqual(sorted(queue.pop(5)), [1, 2])
+        self.assertEqual(queue.size(), 2)
+        queue.ack([1, 2])
+        self.assertEqual(queue.size(), 0)
+
+
+@override_settings(SCORE_DIRTY_QUEUE_BACKEND="database")
+class DirtyScoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = make_customers(make_huissier(), 6, loans_per_customer=2)
+        DirtyCustomer.objects.all().delete()
+
+    def dirty(self):
+        return sorted(DirtyCustomer.objects.values_list("customer_id", flat=True))
+
+    def test_loan_and_repayment_writes(self):
+        customer, other = self.customers[:2]
+        writes = [
+            (customer, lambda: Loan.objects.create(
+                customer=customer, amount=100, periodicity="monthly", deadline_amount=10,
+                deadline=date.today() + timedelta(days=30),
+            )),
+            (customer, lambda: Loan.objects.filter(customer=customer).first().delete()),
+            (other, lambda: Repayment.objects.create(loan=Loan.objects.filter(customer=other).first(), date=date.today())),
+            (other, lambda: Repayment.objects.filter(loan__customer=other).first().delete()),
+        ]
+        for marked, write in writes:
+            DirtyCustomer.objects.all().delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+                # Not before the write commits
+                self.assertEqual(self.dirty(), [])
+            self.assertEqual(self.dirty(), [marked.id])
+
+    def test_drain(self):
+        refresh_features(Customer.objects.all())
+        dirty = [customer.id for customer in self.customers[1:4]]
+        DatabaseDirtyQueue().mark(dirty)
+        out = StringIO()
+        call_command("drain_dirty_scores", "--once", stdout=out)
+        self.assertIn("3 customers re-scored, 3 updated", out.getvalue())
+        for customer in Customer.objects.filter(id__in=[customer.id for customer in self.customers]):
+            with self.subTest(customer=customer.npi):
+                if customer.id in dirty:
+                    self.assertAlmostEqual(customer.credit_score, baseline_score(customer, date.today()), places=6)
+                else:
+                    self.assertEqual(customer.credit_score, 0.0)
+        self.assertEqual(self.dirty(), [])
+
+    def test_failed_batch_is_queued_again(self):
+        dirty = [customer.id for customer in self.customers[:2]]
+        DatabaseDirtyQueue().mark(dirty)
+        with mock.patch(
+            "customer.management.commands.drain_dirty_scores.rescore_customers", side_effect=RuntimeError,
+        ), self.assertRaises(RuntimeError):
+            call_command("drain_dirty_scores", "--once", stdout=StringIO())
+        self.assertEqual(self.dirty(), sorted(dirty))
+
+
+class ScoreHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.front_office = cls.huissier.front_office
+
+    def create_customer(self, npi, **fields):
+        return Customer.objects.create(
+            first_name="Jean", last_name="Doe", email="jean@doe.org", npi=npi, phone_number="0",
+            zone=self.huissier.zone, huissier=self.huissier, front_office=self.front_office,
+            country=self.front_office.country, **fields,
+        )
+
+    def test_seeded_on_creation(self):
+        before = now()
+        customer = self.create_customer("HIST001", credit_score=NEUTRAL_SCORE)
+        self.assertIsNone(score_as_of(customer, before))
+        self.assertEqual(score_as_of(customer, now()), NEUTRAL_SCORE)
+        # A first score equal to the stored one writes nothing, the seeded row still answers
+        self.assertEqual(recompute_scores(Customer.objects.filter(pk=customer.pk)), (1, 0))
+        self.assertEqual(score_as_of(customer, now()), NEUTRAL_SCORE)
+        customer.save()
+        self.assertEqual(customer.score_history.count(), 1)
+
+    def test_unscored_customers_are_not_seeded(self):
+        customer = self.create_customer("HIST001")
+        self.assertFalse(customer.score_history.exists())
+        self.assertIsNone(score_as_of(customer, now()))
+        self.assertEqual(recompute_scores(Customer.objects.filter(pk=customer.pk)), (1, 1))
+        self.assertEqual(score_as_of(customer, now()), NEUTRAL_SCORE)
+
+    def test_backfill_skips_unscored_customers(self):
+        scored = self.create_customer("HIST001", credit_score=72.5)
+        self.create_customer("HIST002")
+        ScoreHistory.objects.all().delete()
+        import_module("customer.migrations.0013_seed_score_history").seed_score_history(apps, None)
+        self.assertEqual(list(ScoreHistory.objects.values_list("customer_id", "score")), [(scored.id, 72.5)])
+
+    def test_imports_are_not_seeded(self):
+        columns = read_csv(SimpleUploadedFile(
+            "customers.csv",
+            (CustomerImportTests.HEADER + "".join(f"Jean,Doe,HIST{i:03d},01234567,jean@doe.org\n" for i in range(5))).encode(),
+        ))
+        self.assertEqual(import_customers(columns, self.huissier, 2)['created'], 5)
+        # Unscored: the history starts with the first score
+        self.assertFalse(ScoreHistory.objects.exists())
+        recompute_scores(Customer.objects.filter(npi__startswith="HIST"))
+        self.assertEqual(
+            sorted(ScoreHistory.objects.values_list("customer__npi", "score")),
+            [(f"HIST{i:03d}", NEUTRAL_SCORE) for i in range(5)],
+        )
+
+    def test_series_samples_the_last_score_of_each_instant(self):
+        customer = self.create_customer("HIST001")
+        start = now() - timedelta(days=100)
+        rng = np.random.default_rng(7)
+        offsets = np.sort(rng.choice(100 * 24, size=60, replace=False))
+        ScoreHistory.objects.bulk_create([
+            ScoreHistory(customer=customer, score=float(i), effective_date=start + timedelta(hours=int(offset)))
+            for i, offset in enumerate(offsets)
+        ])
+        rows = list(customer.score_history.order_by("effective_date").values_list("effective_date", "score"))
+        moments = [row[0] for row in rows]
+        end = now()
+        for points in (2, 7, 25, 59):
+            with self.subTest(points=points):
+                step = (moments[-1] - moments[0]) / (points - 1)
+                instants = [moments[0] + step * k for k in range(points - 1)] + [moments[-1]]
+                expected = [rows[i] for i in sorted({bisect_right(moments, instant) - 1 for instant in instants})]
+                with self.assertNumQueries(2):
+                    self.assertEqual(score_series(customer, end, points), expected)
+        self.assertEqual(score_series(customer, end, len(rows)), rows)
+        self.assertEqual(score_series(customer, rows[10][0], 50), rows[:11])
+
+
+class DefaultModelTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(SCORE_MODEL_DIR=directory.name, SCORE_MODEL_VERSION=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for cached in (default_model._load, default_model._default_version):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def test_fit_recovers_coefficients(self):
+        rng = np.random.default_rng(3)
+        X = rng.normal(size=(20000, 3)) * [1.0, 2.0, 0.5] + [0.0, 5.0, 1.0]
+        true = np.array([-0.5, 1.0, -2.0, 0.5])  # Intercept, then per standardised feature
+        Z = np.column_stack([np.ones(len(X)), (X - X.mean(axis=0)) / X.std(axis=0)])
+        y = (rng.random(len(X)) < default_model._sigmoid(Z @ true)).astype(np.float64)
+
+        mean, scale, w = default_model.fit_logistic(X, y, l2=0.0)
+        np.testing.assert_allclose(w, true, atol=0.1)
+        # IRLS converged: the gradient of the log-likelihood vanishes
+        np.testing.assert_allclose(Z.T @ (default_model._sigmoid(Z @ w) - y), 0.0, atol=1e-6)
+
+    def test_auc(self):
+        y = np.array([0.0, 0.0, 1.0, 1.0])
+        self.assertEqual(default_model.auc(y, np.array([0.1, 0.4, 0.35, 0.8])), 0.75)
+        self.assertEqual(default_model.auc(y, np.array([0.1, 0.2, 0.3, 0.4])), 1.0)
+        self.assertEqual(default_model.auc(y, np.full(4, 0.5)), 0.5)
+        self.assertEqual(default_model.auc(y, np.array([0.1, 0.5, 0.5, 0.9])), 0.875)
+        self.assertIsNone(default_model.auc(np.ones(4), np.arange(4.0)))
+
+    def test_artifact_round_trip(self):
+        with self.assertRaises(FileNotFoundError):
+            default_model.load_model()
+        mean, scale, coefficients = np.array([1.0, 2.0]), np.array([0.5, 4.0]), np.array([0.3, -1.0, 2.0])
+        self.assertEqual(default_model.save_model(mean, scale, coefficients, {"cutoff": "2025-01-01"}), 1)
+        self.assertEqual(default_model.save_model(mean, scale, -coefficients, {}), 2)
+
+        X = np.array([[1.0, 2.0], [3.0, -2.0]])
+        model = default_model.load_model()
+        self.assertEqual(model.version, 2)
+        self.assertIs(default_model.load_model(2), model)
+        first = default_model.load_model(1)
+        self.assertEqual(first.metadata["cutoff"], "2025-01-01")
+        np.testing.assert_allclose(first.predict(X), default_model._sigmoid(0.3 + ((X - mean) / scale) @ [-1.0, 2.0]))
+
+    def test_train_and_score(self):
+        today = date.today()
+        cutoff = today - timedelta(days=90)
+        huissier = make_huissier()
+        customers = make_customers(huissier, 20, loans_per_customer=2)
+        defaulters = [customer.id for customer in customers[::2]]
+        # One loan before the cutoff, one after; defaulters were already late at the cutoff and default again
+        for customer in customers:
+            before, after = customer.loans.order_by("id")
+            late = customer.id in defaulters
+            Loan.objects.filter(pk=before.pk).update(
+                date=cutoff - timedelta(days=60), deadline=cutoff - timedelta(days=10 if late else -10),
+            )
+            Loan.objects.filter(pk=after.pk).update(
+                date=today - timedelta(days=30), status="pending" if late else "done",
+                deadline=today - timedelta(days=5),
+            )
+
+        metadata = default_model.train(Customer.objects.all(), cutoff, today=today)
+        self.assertEqual((metadata["version"], metadata["samples"], metadata["default_rate"]), (1, 20, 0.5))
+        self.assertEqual(metadata["train_auc"], 1.0)
+        self.assertEqual(default_model.load_model().metadata["train_auc"], 1.0)
+
+        X, y = default_model.build_training_set(Customer.objects.all(), cutoff, today)
+        p = default_model.load_model().predict(X)
+        self.assertTrue((p[y == 1] > 0.5).all() and (p[y == 0] < 0.5).all())
+
+
+class RecomputeCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        huissier = make_huissier()
+        cls.customers = make_customers(huissier, 9, loans_per_customer=2)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, "checkpoint.json")
+
+    def recompute(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command(
+            "recompute_scores", "--range-size", "3", "--workers", "4", "--checkpoint", self.checkpoint, *args,
+            stdout=out, stderr=err,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        from customer.management.commands import recompute_scores as command
+        ids = [customer.id for customer in self.customers]
+        recompute_range = command._recompute_range
+        ranges = []
+
+        def interrupted(country_id, start_id, end_id, batch_size):
+            ranges.append((start_id, end_id))
+            if (len(ranges) == 2):
+                raise KeyboardInterrupt
+            return recompute_range(country_id, start_id, end_id, batch_size)
+
+        with mock.patch.object(command, "_recompute_range", interrupted), self.assertRaises(KeyboardInterrupt):
+            self.recompute()
+        # SQLite: the ranges ran one after the other in this process
+        self.assertEqual(ranges, [(ids[0], ids[2]), (ids[3], ids[5])])
+        self.assertTrue(os.path.exists(self.checkpoint))
+        scored = set(Customer.objects.exclude(credit_score=0.0).values_list("id", flat=True))
+        self.assertEqual(scored, set(ids[:3]))
+
+        with mock.patch.object(command, "_recompute_range", side_effect=recompute_range) as recompute:
+            out, err = self.recompute("--resume")
+        self.assertEqual([call.args[1:3] for call in recompute.call_args_list], [(ids[3], ids[5]), (ids[6], ids[8])])
+        self.assertIn("SQLite database: recomputing with a single worker", err)
+        self.assertIn("6 customers scored", out)
+        self.assertFalse(Customer.objects.filter(credit_score=0.0).exists())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class SimulateLoanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 3, loans_per_customer=3)
+        # bulk_create bypassed the feature store the simulation reads
+        refresh_features(Customer.objects.all())
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.huissier.user)
+
+    def simulate(self, **data):
+        return self.client.post("/customer/simulate-loan/", {
+            'npi': self.customers[1].npi, 'amount': "250", 'periodicity': "monthly",
+            'deadline_amount': "25", 'deadline': str(date.today() + timedelta(days=30)), **data,
+        }, format="json")
+
+    def test_projection_matches_the_registered_loan(self):
+        today = date.today()
+        customer = self.customers[1]
+        for deadline in (today + timedelta(days=30), today - timedelta(days=120)):
+            with self.subTest(deadline=deadline):
+                response = self.simulate(deadline=str(deadline))
+                self.assertEqual(response.status_code, 200)
+                loan = Loan.objects.create(
+                    customer=customer, amount=250, periodicity="monthly", deadline_amount=25, deadline=deadline,
+                )
+                features = row_features(CustomerFeatures.objects.get(customer=customer), today)
+                self.assertAlmostEqual(response.data['projected_score'], float(score_features(features, today)[0]))
+                loan.delete()
+
+    def test_invalid_amounts(self):
+        for field in ('amount', 'deadline_amount'):
+            for value in ("NaN", "Infinity", "-Infinity", "sNaN", "-10", "0", "abc"):
+                with self.subTest(field=field, value=value):
+                    response = self.simulate(**{field: value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.data, {'error': "Invalid amount"})
+
+    def test_invalid_deadline(self):
+        for value in ("2025-13-40", "2025-02-30", "tomorrow"):
+            with self.subTest(value=value):
+                response = self.simulate(deadline=value)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'error': "Invalid deadline, expected YYYY-MM-DD"})
+
+
+@override_settings(SCORE_PERCENTILE_REFRESH=60)
+class PercentileIndexTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(percentiles._trees, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fenwick_tree(self):
+        counts = np.random.default_rng(5).integers(0, 50, size=percentiles.BINS)
+        tree = percentiles.FenwickTree(counts)
+        expected = np.cumsum(counts)
+        for index in (0, 1, 2, 1023, 1024, 5000, percentiles.BINS - 1):
+            self.assertEqual(tree.prefix(index), expected[index])
+        tree.add(1024, 7)
+        tree.add(3, -2)
+        self.assertEqual(tree.prefix(2), expected[2])
+        self.assertEqual(tree.prefix(1023), expected[1023] - 2)
+        self.assertEqual(tree.prefix(percentiles.BINS - 1), expected[-1] + 5)
+        self.assertEqual(tree.total, expected[-1] + 5)
+
+    def test_percentile(self):
+        # Stored as HINCRBY leaves it: bin (score * 100) -> count, as bytes
+        stored = {b"1000": b"1", b"2000": b"2", b"3050": b"1", b"10000": b"0"}
+        redis = mock.Mock(**{"hgetall.side_effect": lambda key: stored if key == percentiles._key(1) else {}})
+        with mock.patch("customer.percentiles.get_redis_connection", return_value=redis):
+            self.assertEqual(percentiles.percentile(1, 5), 0.0)
+            self.assertEqual(percentiles.percentile(1, 10), 12.5)  # Half of the tie
+            self.assertEqual(percentiles.percentile(1, 20), 50.0)
+            self.assertEqual(percentiles.percentile(1, 20.004), 50.0)  # Same bin once rounded
+            self.assertEqual(percentiles.percentile(1, 25), 75.0)
+            self.assertEqual(percentiles.percentile(1, 30.5), 87.5)
+            self.assertEqual(percentiles.percentile(1, 100), 100.0)
+            self.assertIsNone(percentiles.percentile(2, 50))  # No customer in the country
+        # Loaded once, then served from the local tree
+        redis.hgetall.assert_has_calls([mock.call(percentiles._key(1)), mock.call(percentiles._key(2))])
+        self.assertEqual(redis.hgetall.call_count, 2)
+
+    def test_reload_failure(self):
+        percentiles._trees[1] = (0, percentiles.FenwickTree(np.bincount([100, 300], minlength=percentiles.BINS)))
+        for error in (RedisError, NotImplementedError):
+            with self.subTest(error=error), mock.patch(
+                "customer.percentiles.get_redis_connection", side_effect=error,
+            ):
+                # A stale copy still answers; without one there is no percentile, not an error
+                self.assertEqual(percentiles.percentile(1, 2), 50.0)
+                self.assertIsNone(percentiles.percentile(2, 2))
+
+
+class BacktestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = date.today()
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 4, loans_per_customer=0)
+        ScoreHistory.objects.bulk_create([
+            ScoreHistory(customer=customer, score=score, effective_date=now() - timedelta(days=200))
+            for customer, score in zip(cls.customers, (15, 15, 85, 85))
+        ] + [ScoreHistory(customer=cls.customers[1], score=85, effective_date=now() - timedelta(days=50))])
+        # Three defaults of the customer scored 15, one repaid loan for each customer scored 85
+        for customer, status, count in [(cls.customers[0], "pending", 3)] + [(c, "done", 1) for c in cls.customers[1:]]:
+            for _ in range(count):
+                Loan.objects.create(
+                    customer=customer, amount=100, periodicity="monthly", deadline_amount=10,
+                    deadline=cls.today - timedelta(days=5), status=status,
+                )
+        Loan.objects.update(date=cls.today - timedelta(days=30))
+
+    def test_metrics(self):
+        backtest = Backtest()
+        backtest.add(np.array([10.0, 20.0, 35.0, 30.0, 40.0, 90.0]), np.array([True, True, True, False, False, False]))
+        # Defaults' CDF reaches 2/3 at 20 while no repaid loan is below 30
+        self.assertAlmostEqual(backtest.ks(), 2 / 3)
+        # Only the (30, 35) pair of the nine repaid/defaulted pairs is out of order
+        self.assertAlmostEqual(backtest.auc(), 8 / 9)
+        self.assertAlmostEqual(population_stability([50, 50], [25, 75]), 0.25 * np.log(2) + 0.25 * np.log(1.5))
+        self.assertEqual(population_stability([10, 30], [10, 30]), 0.0)
+        self.assertIsNone(population_stability([0, 0], [1, 2]))
+
+    def test_country_report(self):
+        report = backtest_country(self.huissier.front_office.country, chunk_size=2, today=self.today)
+        self.assertEqual((report["loans"], report["defaults"], report["unscored_loans"]), (6, 3, 0))
+        self.assertEqual((report["auc"], report["ks"]), (1.0, 1.0))
+        # Customers, not loans: two of four scored 15 at the baseline, one of four now
+        self.assertAlmostEqual(report["psi"], 0.25 * np.log(2) + 0.25 * np.log(1.5))
+        self.assertEqual(report["psi_baseline"], (self.today - timedelta(days=180)).isoformat())
+        # The same customers at both dates
+        report = backtest_country(
+            self.huissier.front_office.country, today=self.today, baseline=self.today - timedelta(days=10),
+        )
+        self.assertEqual(report["psi"], 0.0)
@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import CreateCustomer, CustomersList, CustomerByNPI
+from .views import CreateCustomer, CustomersList, CustomerByNPI, SimulateLoan, BatchScores, ImportCustomers
 
 urlpatterns = [
     path("new/", CreateCustomer.as_view()),
+    path("import/", ImportCustomers.as_view()),
     path("list/", CustomersList.as_view()),
     path("by-npi/", CustomerByNPI.as_view()),
+    path("simulate-loan/", SimulateLoan.as_view()),
+    path("scores/batch/", BatchScores.as_view()),
 ]
\ No newline at end of file
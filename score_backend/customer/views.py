@@ -1,4 +1,6 @@
 from django.shortcuts import render
+from django.conf import settings
+from django.db import IntegrityError, transaction
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -8,11 +10,20 @@ from rest_framework import status
 from users.models import ScoreUser
 from django.contrib.auth.hashers import make_password
 from score.utils import create_file, get_media_url
-from score.permissions import IsHuissier, IsPasswordChanged
-from score.validators import validate_string, validate_file
-from .models import Customer
+from score import bloom
+from score.pagination import KeysetPagination, InvalidPage
+from score.streaming import chunked, stream_response
+from score.permissions import IsHuissier, IsFinancial, IsPasswordChanged
+from score.validators import validate_amount, validate_date, validate_string, validate_file
+from .models import Customer, Loan
 import uuid
+from datetime import date
+from decimal import Decimal
 from .serializers import CustomerListSerializer
+from .loaders import CreditorNames, with_loans
+from . import identity
+from .imports import VALIDATORS, InvalidImport, import_customers, read_csv, read_rows
+from .scoring import overlay_loan, row_features, score_features
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
@@ -144,8 +155,6 @@ class CreateCustomer(APIView):
     permission_classes = [IsAuthenticated, IsHuissier, IsPasswordChanged]
 
     def post(self, request: Request):
-        user = request.user
-
         # Récupération des champs
         first_name = request.data.get("first_name")
         last_name = request.data.get("last_name")
@@ -153,73 +162,88 @@ class CreateCustomer(APIView):
         phone_number = request.data.get("phone_number")
         email = request.data.get("email")
 
-        validator = {
-            'required': "Missing field",
-            'length': {
-                'value': 2,
-                'message': "This field must have at least 2 characters"
-            },
-            'name': "Invalid format"
-        }
-
-        number_validator = {
-            'required': "Missing field",
-            'length': {
-                'value': 6,
-                'message': "This field must have at least 6 characters"
-            },
-            'number': "Phone must be number"
-        }
-
-        email_validator = {
-            'required': "Missing field",
-            'length': {
-                'value': 5,
-                'message': "Email must be valid"
-            },
-            'email': "Invalid email format"
-        }
-
         # Validation des champs
         if not all([first_name, last_name, npi, phone_number, email]):
             return Response({
                 'error': "Fields first_name, last_name, npi, phone_number, email are required"
             }, status=400)
 
-        for field_name, field_value, rules in [
-            ("npi", npi, validator),
-            ("last_name", last_name, validator),
-            ("first_name", first_name, validator),
-            ("phone_number", phone_number, number_validator),
-            ("email", email, email_validator)
-        ]:
-            error = validate_string(field_value, rules)
+        for field_name, rules in VALIDATORS.items():
+            error = validate_string(request.data.get(field_name), rules)
             if error:
                 return Response({'error': f"{field_name}: {error}"}, status=400)
 
         # Vérification d'existence
-        if Customer.objects.filter(npi=npi, phone_number=phone_number, country=user.huissier.front_office.country).exists():
+        actor = request.actor
+        existing = Customer.objects.filter(npi=npi, phone_number=phone_number, country=actor.country)
+        if bloom.exists(existing, ("customer.npi", npi), ("customer.phone", phone_number)):
             return Response({'error': "Customer already exists"}, status=400)
 
         # Création du client
-        customer = Customer.objects.create(
-            uuid=str(uuid.uuid4()),
-            first_name=first_name,
-            last_name=last_name,
-            npi=npi,
-            phone_number=phone_number,
-            email=email,
-            huissier=user.huissier,
-            zone=user.huissier.zone,
-            front_office=user.huissier.front_office,
-            country=user.huissier.front_office.country
-        )
+        try:
+            with transaction.atomic():
+                customer = Customer.objects.create(
+                    uuid=str(uuid.uuid4()),
+                    first_name=first_name,
+                    last_name=last_name,
+                    npi=npi,
+                    phone_number=phone_number,
+                    email=email,
+                    huissier=actor.huissier,
+                    zone=actor.zone,
+                    front_office=actor.front_office,
+                    country=actor.country
+                )
+        except IntegrityError:
+            # npi is unique across countries
+            return Response({'error': "Customer already exists"}, status=400)
         return Response({'message': "Customer successfully created"}, status=201)
 
+class ImportCustomers(APIView):
+    permission_classes = [IsAuthenticated, IsHuissier, IsPasswordChanged]
+
+    def post(self, request: Request):
+        """
+        Create many customers for the huissier: a CSV ``file`` upload with a
+        header row, or a JSON body ``{"customers": [{...}, ...]}``, with the
+        fields of /customer/new/. Answers with a report of the rejected rows.
+        """
+        try:
+            batch_size = int(request.data.get("batch_size", settings.CUSTOMER_IMPORT_BATCH_SIZE))
+        except (TypeError, ValueError):
+            return Response({
+                'error': "invalid batch_size"
+            }, status=400)
+        batch_size = min(max(batch_size, 1), settings.CUSTOMER_IMPORT_MAX_BATCH_SIZE)
+
+        upload = request.FILES.get("file")
+        try:
+            if (upload):
+                columns = read_csv(upload)
+            else:
+                columns = read_rows(request.data.get("customers"))
+        except InvalidImport as e:
+            return Response({'error': str(e)}, status=400)
+
+        report = import_customers(columns, request.actor.huissier, batch_size)
+        return Response(report, status=201 if report['created'] else 400)
+
 class CustomerByNPI(APIView):
     permission_classes = [IsAuthenticated, IsHuissier, IsPasswordChanged]
 
     def get(self, request: Request):
+        prefix = request.GET.get("prefix")
+        if (prefix):
+            # Type-ahead: the first matches in NPI order
+            try:
+                limit = min(int(request.GET.get("limit", settings.NPI_SEARCH_LIMIT)), settings.NPI_SEARCH_MAX_LIMIT)
+            except ValueError:
+                return Response({
+                    'error': "invalid limit"
+                }, status=400)
+            return Response({
+                'customers': identity.search(prefix, max(limit, 1))
+            }, status=200)
         npi = request.GET.get("npi")
         if (not npi):
             return Response({
@@ -229,24 +253,143 @@ class CustomerByNPI(APIView):
             return Response({
                 'error': "invalid npi"
             }, status=400)
-        try:
-            customer = Customer.objects.get(npi=npi)
-        except Customer.DoesNotExist:
+        customer = identity.lookup(npi)
+        if (customer is None):
             return Response({
                 'error': 'customer not found'
             }, status=404)
         return Response({
-            'customer': customer.first_name + " " + customer.last_name
+            'customer': customer['name'],
+            'uuid': customer['uuid'],
+            'country': customer['country']
         }, status=200)
 
+# ?stream= value -> whether to stream one customer per line (ndjson)
+STREAM_FORMATS = {"1": False, "true": False, "ndjson": True}
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CustomersList(APIView):
     permission_classes = [IsAuthenticated, IsHuissier, IsPasswordChanged]
 
     def get(self, request: Request):
-        user = request.user
-        customers = Customer.objects.filter(country=user.huissier.front_office.country)
+        country = request.actor.country
+        stream = request.query_params.get("stream", "")
+        if (stream in STREAM_FORMATS):
+            return self.stream(country, ndjson=STREAM_FORMATS[stream])
+        if (stream not in ("", "0", "false")):
+            return Response({
+                'error': "Invalid stream value, expected 1, true or ndjson"
+            }, status=400)
+        try:
+            paginator = KeysetPagination(request)
+        except InvalidPage as e:
+            return Response({
+                'error': str(e)
+            }, status=400)
+        customers = with_loans(Customer.objects.filter(country=country).select_related('features'))
+        page = paginator.paginate_queryset(customers)
+        return Response(paginator.get_response_data('customers', CustomerListSerializer(page, many=True, context={
+            'creditor_names': CreditorNames.for_customers(page)
+        }).data), status=200)
+
+    def stream(self, country, ndjson):
+        # ?stream=1 streams the usual {"customers": [...]}, ?stream=ndjson one customer per line
+        customers = with_loans(Customer.objects.filter(country=country).select_related('features')).order_by('pk')
+        chunks = (
+            CustomerListSerializer(chunk, many=True, context={
+                'creditor_names': CreditorNames.for_customers(chunk)
+            }).data
+            for chunk in chunked(customers, settings.STREAM_CHUNK_SIZE)
+        )
+        return stream_response('customers', chunks, ndjson=ndjson)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class SimulateLoan(APIView):
+    permission_classes = [IsAuthenticated, IsHuissier, IsPasswordChanged]
+
+    def post(self, request: Request):
+        npi = request.data.get("npi")
+        amount = request.data.get("amount")
+        periodicity = request.data.get("periodicity")
+        deadline_amount = request.data.get("deadline_amount")
+        deadline = request.data.get("deadline")
+        if (not all([npi, amount, periodicity, deadline_amount, deadline])):
+            return Response({
+                'error': "Fields required (npi, amount, periodicity, deadline_amount, deadline)"
+            }, status=400)
+        if (not periodicity in dict(Loan.PERIODICITY_CHOICES)):
+            return Response({
+                'error': "Invalid periodicity field"
+            }, status=400)
+        amount = validate_amount(amount)
+        if (amount is None or validate_amount(deadline_amount) is None):
+            return Response({
+                'error': "Invalid amount"
+            }, status=400)
+        deadline = validate_date(deadline)
+        if (not deadline):
+            return Response({
+                'error': "Invalid deadline, expected YYYY-MM-DD"
+            }, status=400)
+
+        # The only database read: the customer and its feature row.
+        try:
+            customer = Customer.objects.select_related('features').get(npi=npi)
+        except Customer.DoesNotExist:
+            return Response({
+                'error': "customer not found"
+            }, status=404)
+        today = date.today()
+        current = row_features(getattr(customer, 'features', None), today)
+        baseline = float(score_features(current, today)[0])
+        projected = float(score_features(overlay_loan(current, amount, deadline, today), today)[0])
+        return Response({
+            'score': customer.credit_score,
+            'projected_score': projected,
+            'delta': round(projected - baseline, 2)
+        }, status=200)
+
+MAX_BATCH_NPIS = 1000
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchScores(APIView):
+    permission_classes = [IsAuthenticated, IsHuissier | IsFinancial, IsPasswordChanged]
+
+    def post(self, request: Request):
+        npis = request.data.get("npis")
+        if (not isinstance(npis, list) or not npis):
+            return Response({
+                'error': "npis required (list of npi)"
+            }, status=400)
+        if (len(npis) > MAX_BATCH_NPIS):
+            return Response({
+                'error': f"At most {MAX_BATCH_NPIS} npis per request"
+            }, status=400)
+        if (not all(isinstance(npi, str) for npi in npis)):
+            return Response({
+                'error': "invalid npi"
+            }, status=400)
+
+        # One query over the npi unique index, features joined in.
+        found = {
+            npi: (score, outstanding, overdue_count)
+            for npi, score, outstanding, overdue_count in Customer.objects.filter(npi__in=set(npis)).values_list(
+                'npi', 'credit_score', 'features__outstanding_principal', 'features__overdue_count'
+            )
+        }
+        results = []
+        for npi in npis:
+            if npi not in found:
+                results.append({'npi': npi, 'found': False})
+                continue
+            score, outstanding, overdue_count = found[npi]
+            results.append({
+                'npi': npi,
+                'found': True,
+                'score': score,
+                'outstanding_amount': str(outstanding or Decimal("0.00")),
+                'overdue': bool(overdue_count)
+            })
         return Response({
-            'customers': CustomerListSerializer(customers, many=True).data
+            'results': results
         }, status=200)
-    
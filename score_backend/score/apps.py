@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ScoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'score'
+
+    def ready(self):
+        from . import bloom
+        bloom.connect_signals()
@@ -0,0 +1,211 @@
+"""
+Bloom filter over the identifiers the create endpoints check for duplicates
+(NPIs, phone numbers, emails, usernames).
+
+The bitmap lives in Redis and each process keeps a copy it reloads every
+``BLOOM_FILTER_REFRESH`` seconds. ``exists`` answers "definitely absent"
+from that copy without touching the database; anything else falls through
+to the indexed ``.exists()`` query. A value added by another process since
+the last reload can be reported absent, so the uniqueness itself is
+enforced by database constraints and the filter is only an accelerator.
+When Redis is unavailable or the filter was never built, every check goes
+to the database.
+"""
+import hashlib
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+# Namespace -> (model label, field)
+FIELDS = {
+    "customer.npi": ("customer.Customer", "npi"),
+    "customer.phone": ("customer.Customer", "phone_number"),
+    "user.username": ("users.ScoreUser", "username"),
+    "user.email": ("users.ScoreUser", "email"),
+    "huissier.npi": ("country.Huissier", "npi"),
+    "front_office.npi": ("country.FrontOffice", "npi"),
+    "front_office.phone": ("country.FrontOffice", "phone"),
+    "financial.npi": ("country.Financial", "npi"),
+}
+
+UNAVAILABLE = (RedisError, NotImplementedError)  # NotImplementedError: the cache is not Redis
+
+# Set the bits only if the bitmap exists: bits set on a missing key would
+# make a partial filter look built.
+_ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+for i = 1, #ARGV do redis.call('SETBIT', KEYS[1], ARGV[i], 1) end
+return 1
+"""
+
+
+def offsets(namespace, value):
+    """Bit offsets of ``value`` (double hashing over one BLAKE2b digest)."""
+    bits = settings.BLOOM_FILTER_BITS
+    digest = hashlib.blake2b(f"{namespace}:{value}".encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(settings.BLOOM_FILTER_HASHES)]
+
+
+def set_bits(bitmap, positions):
+    # Same bit order as Redis SETBIT: offset 0 is the most significant bit
+    for position in positions:
+        bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+
+def has_bits(bitmap, positions):
+    return all(bitmap[position >> 3] & (0x80 >> (position & 7)) for position in positions)
+
+
+class BloomFilter:
+    def __init__(self):
+        self.bitmap = None
+        self.loaded_at = None
+        self.stats = {"negatives": 0, "positives": 0, "false_positives": 0}
+        self.unflushed = 0
+
+    def redis(self):
+        return get_redis_connection("default")
+
+    def _local(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > settings.BLOOM_FILTER_REFRESH:
+            self.loaded_at = time.monotonic()
+            try:
+                stored = self.redis().get(settings.BLOOM_FILTER_KEY)
+            except UNAVAILABLE:
+                stored = None
+            self.bitmap = bytearray(stored) if stored else None
+        return self.bitmap
+
+    def might_contain(self, namespace, value):
+        bitmap = self._local()
+        return bitmap is None or has_bits(bitmap, offsets(namespace, value))
+
+    def add(self, items):
+        """Add ``(namespace, value)`` pairs here and in Redis."""
+        positions = [position for namespace, value in items if value for position in offsets(namespace, value)]
+        if not positions:
+            return
+        if self.bitmap is not None:
+            set_bits(self.bitmap, positions)
+        try:
+            self.redis().eval(_ADD_SCRIPT, 1, settings.BLOOM_FILTER_KEY, *positions)
+        except UNAVAILABLE:
+            pass
+
+    def record(self, outcome):
+        self.stats[outcome] += 1
+        self.unflushed += 1
+        if self.unflushed >= settings.BLOOM_FILTER_STATS_FLUSH:
+            self.flush_stats()
+
+    def flush_stats(self):
+        stats, self.stats = self.stats, dict.fromkeys(self.stats, 0)
+        self.unflushed = 0
+        try:
+            pipe = self.redis().pipeline()
+            for name, count in stats.items():
+                pipe.hincrby(settings.BLOOM_FILTER_KEY + ":stats", name, count)
+            pipe.execute()
+        except UNAVAILABLE:
+            pass
+
+
+_filter = BloomFilter()
+
+
+def exists(queryset, *items):
+    """
+    ``queryset.exists()`` for a queryset filtering on the ``(namespace,
+    value)`` pairs ``items``: False without a query as soon as one of them is
+    definitely not in the filter.
+    """
+    for namespace, value in items:
+        if not _filter.might_contain(namespace, value):
+            _filter.record("negatives")
+            return False
+    found = queryset.exists()
+    _filter.record("positives" if found else "false_positives")
+    return found
+
+
+def add(items):
+    """Add ``(namespace, value)`` pairs once the transaction commits."""
+    items = list(items)
+    transaction.on_commit(lambda: _filter.add(items))
+
+
+def _instance_items(instance):
+    label = instance._meta.label
+    return [
+        (namespace, getattr(instance, field))
+        for namespace, (model, field) in FIELDS.items()
+        if model == label
+    ]
+
+
+def _saved(sender, instance, **kwargs):
+    # Changed values are added too; the old ones linger as false positives
+    # until the next rebuild.
+    add(_instance_items(instance))
+
+
+def connect_signals():
+    for model in {model for model, _ in FIELDS.values()}:
+        post_save.connect(_saved, sender=model, dispatch_uid=f"bloom-{model}")
+
+
+def rebuild():
+    """
+    Rebuild the bitmap from the database and swap it in. Rows created while
+    it was being built are added again after the swap. Return the number of
+    values added.
+    """
+    bitmap = bytearray(settings.BLOOM_FILTER_BITS // 8)
+    last_ids = {
+        label: apps.get_model(label).objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        for label, _ in FIELDS.values()
+    }
+    count = 0
+    for namespace, (label, field) in FIELDS.items():
+        values = apps.get_model(label).objects.filter(pk__lte=last_ids[label]).values_list(field, flat=True)
+        for value in values.iterator():
+            if value:
+                set_bits(bitmap, offsets(namespace, value))
+                count += 1
+
+    redis = _filter.redis()
+    redis.set(settings.BLOOM_FILTER_KEY + ":building", bytes(bitmap))
+    redis.rename(settings.BLOOM_FILTER_KEY + ":building", settings.BLOOM_FILTER_KEY)
+    redis.delete(settings.BLOOM_FILTER_KEY + ":stats")
+    for label, last_id in last_ids.items():
+        for instance in apps.get_model(label).objects.filter(pk__gt=last_id):
+            _filter.add(_instance_items(instance))
+    _filter.loaded_at = None
+    return count
+
+
+def statistics():
+    """Observed false-positive rate since the last rebuild, and the fill ratio."""
+    redis = _filter.redis()
+    stats = {name.decode(): int(count) for name, count in redis.hgetall(settings.BLOOM_FILTER_KEY + ":stats").items()}
+    negatives = stats.get("negatives", 0)
+    false_positives = stats.get("false_positives", 0)
+    bits_set = redis.bitcount(settings.BLOOM_FILTER_KEY)
+    fill = bits_set / settings.BLOOM_FILTER_BITS
+    return {
+        "checks": negatives + false_positives + stats.get("positives", 0),
+        "negatives": negatives,
+        "positives": stats.get("positives", 0),
+        "false_positives": false_positives,
+        # Checked values that were not in the database but passed the filter
+        "false_positive_rate": false_positives / (negatives + false_positives) if negatives + false_positives else None,
+        "fill_ratio": fill,
+        "estimated_false_positive_rate": fill ** settings.BLOOM_FILTER_HASHES,
+    }
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from score import bloom
+
+
+class Command(BaseCommand):
+    help = "Rebuild the NPI/phone/user existence filter from the database (run after bulk imports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stats", action="store_true", help="Only print the filter statistics")
+
+    def handle(self, *args, **options):
+        try:
+            if not options["stats"]:
+                start = time.perf_counter()
+                count = bloom.rebuild()
+                self.stdout.write(self.style.SUCCESS(
+                    f"{count} values added in {time.perf_counter() - start:.2f}s"
+                ))
+            stats = bloom.statistics()
+        except bloom.UNAVAILABLE as exc:
+            raise CommandError(f"Redis unavailable: {exc}")
+        for name, value in stats.items():
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,67 @@
+import base64
+import json
+
+from django.conf import settings
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(json.dumps({"pk": pk}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        pk = json.loads(base64.urlsafe_b64decode(padded.encode()))["pk"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidPage("Invalid cursor")
+    if (not isinstance(pk, int)):
+        raise InvalidPage("Invalid cursor")
+    return pk
+
+
+class KeysetPagination:
+    """
+    Primary key ordered pagination driven by ``?limit=`` and ``?cursor=``.
+
+    Each page is fetched with ``pk > <last pk of the previous page>``, so a
+    deep page costs the same as the first one. Requests without either
+    parameter get the whole list while ``LIST_LEGACY_FULL_RESPONSE`` is on,
+    for the mobile clients that predate paging.
+    """
+
+    def __init__(self, request):
+        params = request.query_params
+        self.legacy = (
+            settings.LIST_LEGACY_FULL_RESPONSE
+            and "limit" not in params and "cursor" not in params
+        )
+        self.next_cursor = None
+        self.after = decode_cursor(params["cursor"]) if params.get("cursor") else None
+        try:
+            self.limit = int(params.get("limit", settings.LIST_PAGE_SIZE))
+        except ValueError:
+            raise InvalidPage("limit must be an integer")
+        if (self.limit < 1):
+            raise InvalidPage("limit must be positive")
+        self.limit = min(self.limit, settings.LIST_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset):
+        if (self.legacy):
+            return queryset
+        queryset = queryset.order_by("pk")
+        if (self.after is not None):
+            queryset = queryset.filter(pk__gt=self.after)
+        page = list(queryset[:self.limit + 1])
+        if (len(page) > self.limit):
+            page = page[:self.limit]
+            self.next_cursor = encode_cursor(page[-1].pk)
+        return page
+
+    def get_response_data(self, key, data):
+        if (self.legacy):
+            return {key: data}
+        return {key: data, "next": self.next_cursor}
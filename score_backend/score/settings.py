@@ -66,6 +66,7 @@ INSTALLED_APPS = [
     'corsheaders',
     'country',
     'customer',
+    'score',
 ]
 
 AUTH_USER_MODEL = 'users.ScoreUser'
@@ -78,6 +79,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.actor.ActorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     
@@ -160,7 +162,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # rest
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -172,6 +174,10 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+# Authorize from the role/profile claims of the token instead of loading the user
+AUTH_STATELESS_TOKENS = True
+TOKEN_VERSION_KEY_PREFIX = "auth:token-version"
+TOKEN_VERSION_CACHE_TTL = 600  # Bounds how long a revoked token may pass when Redis missed the revocation
 
 # Cache
 CACHES = {
@@ -180,13 +186,70 @@ CACHES = {
         'LOCATION': 'redis://127.0.0.1:6379/1',  # Replace with your Redis server URL
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # One pool per process, shared by the cache and every get_redis_connection() user.
+            # Bounded everywhere: an unreachable Redis fails a request in about a second, not a worker.
+            'SOCKET_CONNECT_TIMEOUT': 0.5,  # seconds
+            'SOCKET_TIMEOUT': 0.5,
+            'CONNECTION_POOL_CLASS': 'redis.BlockingConnectionPool',
+            'CONNECTION_POOL_KWARGS': {
+                'max_connections': 50,
+                'timeout': 1,  # seconds to wait for a free connection
+                'health_check_interval': 30,
+            },
         }
     }
 }
 
+# Customer list pagination
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+LIST_LEGACY_FULL_RESPONSE = True  # Full list when neither ?limit nor ?cursor is given
+STREAM_CHUNK_SIZE = 500  # Customers serialized at a time by ?stream=1
+
+# NPI -> identity cache of /customer/by-npi/
+NPI_CACHE_KEY_PREFIX = "customer:npi"
+NPI_CACHE_TTL = 3600
+NPI_NEGATIVE_CACHE_TTL = 30  # Unknown NPIs, e.g. while the NPI is being typed
+NPI_SEARCH_LIMIT = 10
+NPI_SEARCH_MAX_LIMIT = 50
+
+# Bloom filter in front of the create endpoints' duplicate checks.
+# 2**24 bits (2 MiB) and 7 hashes: about 0.05% false positives at 1M values.
+BLOOM_FILTER_KEY = "score:bloom"
+BLOOM_FILTER_BITS = 1 << 24
+BLOOM_FILTER_HASHES = 7
+BLOOM_FILTER_REFRESH = 30  # seconds before a process reloads the bitmap
+BLOOM_FILTER_STATS_FLUSH = 100  # checks counted locally before being added up in Redis
+
+# Bulk customer import (/customer/import/ and the import_customers command)
+CUSTOMER_IMPORT_BATCH_SIZE = 2000  # Rows checked and inserted per transaction
+CUSTOMER_IMPORT_MAX_BATCH_SIZE = 10000
+
 DATA_TIMEOUT = 900
 LOAN_REGISTER_TIMEOUT = 700
 
+# Consultation and loan codes (country.codes)
+CODE_STORE_BACKEND = "redis"  # "redis", "memory" (a single server process) or "database"
+CODE_STORE_KEY_PREFIX = "codes"
+CODE_REUSE_MIN_TTL = 120  # seconds a code must still be valid to be sent again instead of a new one
+
+# Incremental scoring
+SCORE_DIRTY_QUEUE_BACKEND = "redis"  # "redis" or "database"
+SCORE_DIRTY_QUEUE_KEY = "score:dirty-customers"
+SCORE_DRAIN_BATCH_SIZE = 200
+SCORE_DRAIN_MAX_BATCH_SIZE = 5000
+SCORE_DRAIN_LATENCY_TARGET = 1.0  # seconds per batch
+SCORE_DRAIN_POLL_INTERVAL = 0.5
+
+# Scoring engine: "rules", or "model" for the trained default-probability model
+SCORE_ENGINE = "rules"
+SCORE_MODEL_DIR = BASE_DIR / "models"
+SCORE_MODEL_VERSION = None  # Latest artifact when None
+
+# Per-country score percentiles
+SCORE_PERCENTILE_KEY_PREFIX = "score:percentiles"
+SCORE_PERCENTILE_REFRESH = 60  # seconds before a process reloads a country from Redis
+
 # Email
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = "smtp.gmail.com"
@@ -197,4 +260,14 @@ EMAIL_HOST_USER=env("EMAIL_HOST_USER")
 # EMAIL_HOST_USER = "horuskoeus6@gmail.com"
 # print(f"code {env("EMAIL_HOST_PASSWORD")}")
 EMAIL_HOST_PASSWORD=env("EMAIL_HOST_PASSWORD")
+EMAIL_TIMEOUT = 10  # seconds, for each SMTP operation
+
+# Outbound email queue (users.outbox): requests enqueue, send_queued_emails sends
+EMAIL_QUEUE_ENABLED = True  # False sends from the request, blocking it for the SMTP exchange
+EMAIL_QUEUE_BATCH_SIZE = 50
+EMAIL_QUEUE_POLL_INTERVAL = 1.0
+EMAIL_QUEUE_LEASE = 300  # seconds a claimed email is hidden from other workers
+EMAIL_QUEUE_MAX_ATTEMPTS = 8
+EMAIL_QUEUE_RETRY_DELAY = 30  # seconds before the first retry, doubled after each failure
+EMAIL_QUEUE_MAX_RETRY_DELAY = 3600
 
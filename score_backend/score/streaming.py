@@ -0,0 +1,40 @@
+import json
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def chunked(queryset, chunk_size):
+    """Yield lists of ``chunk_size`` objects read with a server-side cursor."""
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if (not chunk):
+            return
+        yield chunk
+
+
+def _json_array(key, chunks):
+    yield '{"%s": [' % key
+    first = True
+    for chunk in chunks:
+        for item in chunk:
+            yield ("" if first else ",") + json.dumps(item, cls=JSONEncoder)
+            first = False
+    yield "]}"
+
+
+def _ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(item, cls=JSONEncoder) + "\n" for item in chunk)
+
+
+def stream_response(key, chunks, ndjson=False):
+    """
+    Stream serialized ``chunks`` (iterables of dicts) either as ``{key: [...]}``
+    or as newline-delimited JSON, one object per line.
+    """
+    if (ndjson):
+        return StreamingHttpResponse(_ndjson(chunks), content_type="application/x-ndjson")
+    return StreamingHttpResponse(_json_array(key, chunks), content_type="application/json")
@@ -0,0 +1,386 @@
+"""Fixtures and assertions shared by the apps' test suites."""
+import logging
+import re
+import socketserver
+import threading
+import time
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from country.models import AvailableZone, Country, FrontOffice, Huissier
+from customer.alerts import refresh_alerts
+from customer.models import Customer, Loan, Repayment
+from users.models import ScoreUser
+
+# QueryBudgetTestCase reports its measurements here (INFO), for runs that want them
+logger = logging.getLogger(__name__)
+
+
+def make_huissier(code="BEN", zone="Z1"):
+    """A country with one front office and one huissier working in ``zone``."""
+    country_user = ScoreUser.objects.create(
+        username=f"country-{code}", email=f"country@{code}.org", role="country", password_changed=True,
+    )
+    country = Country.objects.create(name=code, country_code=code, phone_code="+229", user=country_user)
+    front_office_user = ScoreUser.objects.create(
+        username=f"fo-{code}", email=f"fo@{code}.org", role="front office", password_changed=True,
+    )
+    front_office = FrontOffice.objects.create(name="FO", npi=f"FO{code}", phone="0", user=front_office_user, country=country)
+    AvailableZone.objects.create(name=zone, front_office=front_office)
+    huissier_user = ScoreUser.objects.create(
+        username=f"huissier-{code}", email=f"huissier@{code}.org", role="huissier", password_changed=True,
+    )
+    return Huissier.objects.create(user=huissier_user, front_office=front_office, npi=f"H{code}", zone=zone)
+
+
+def make_customers(huissier, count, loans_per_customer=2, today=None):
+    """
+    ``count`` customers of ``huissier``, each with ``loans_per_customer`` loans
+    lent by the previous customer: the first one overdue and pending, the
+    others done and repaid.
+    """
+    today = today or date.today()
+    front_office = huissier.front_office
+    prefix = front_office.country.country_code
+    start = Customer.objects.count()
+    customers = Customer.objects.bulk_create([
+        Customer(
+            uuid=f"{prefix}-uuid-{start + i}", first_name="Customer", last_name=str(start + i),
+            email=f"c{start + i}@{prefix}.org", npi=f"{prefix}{start + i:07d}", phone_number="0",
+            zone=huissier.zone, huissier=huissier, front_office=front_office, country=front_office.country,
+        )
+        for i in range(count)
+    ])
+    loans = Loan.objects.bulk_create([
+        Loan(
+            customer=customer, creditor=customers[i - 1], creditor_npi=customers[i - 1].npi, amount=100 * (j + 1),
+            periodicity="monthly", deadline_amount=10,
+            deadline=today + timedelta(days=-30 if j == 0 else 30 * j),
+            status="pending" if j == 0 else "done",
+        )
+        for i, customer in enumerate(customers)
+        for j in range(loans_per_customer)
+    ])
+    Repayment.objects.bulk_create([Repayment(loan=loan, date=today) for loan in loans if loan.status == "done"])
+    # bulk_create bypasses the signals maintaining the alert index
+    refresh_alerts(Loan.objects.filter(customer__in=customers))
+    return customers
+
+
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+_POSTGRES_FULL_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+def full_scans(sql, params=None):
+    """Tables read with a full scan by the plan of ``sql``."""
+    with connection.cursor() as cursor:
+        if (connection.vendor == "postgresql"):
+            # Tiny test tables would always be scanned sequentially otherwise
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+            return [m.group(1) for (line,) in cursor.fetchall() for m in _POSTGRES_FULL_SCAN.finditer(line)]
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [m.group(1) for *_, detail in cursor.fetchall() if (m := _SQLITE_FULL_SCAN.match(detail))]
+
+
+class QueryPlanTestCase(TestCase):
+    """Fails when a query degrades to a full table scan."""
+
+    def assertIndexed(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        self.assertEqual(full_scans(sql, params), [], f"Full table scan in:\n{sql}")
+
+    def assertEndpointIndexed(self, method, *args, **kwargs):
+        """Call ``method`` (e.g. ``self.client.get``) and check every SELECT it ran."""
+        with CaptureQueriesContext(connection) as queries:
+            response = method(*args, **kwargs)
+        self.assertLess(response.status_code, 400, getattr(response, "data", response))
+        selects = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertEqual(full_scans(sql), [], f"Full table scan in:\n{sql}")
+        return response
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` counting queries and their total duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class Endpoint:
+    """
+    One request of a ``QueryBudgetTestCase``. ``path`` and ``data`` may be
+    callables taking the run number, for requests that create rows.
+    """
+
+    def __init__(self, path, user, method="get", data=None, max_queries=None):
+        self.path = path
+        self.user = user
+        self.method = method
+        self.data = data
+        self.max_queries = max_queries
+
+    def resolve(self, value, run):
+        return value(run) if callable(value) else value
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Runs every endpoint of ``endpoints()`` against ``customers`` customers with
+    ``loans_per_customer`` loans each, then again after the dataset grew
+    ``growth`` times. Fails when the query count changes between the two runs
+    (an N+1), exceeds the endpoint's ``max_queries``, or when the queries take
+    more than ``max_db_ms`` in total.
+    """
+
+    customers = 10
+    loans_per_customer = 3
+    growth = 4
+    max_db_ms = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        make_customers(cls.huissier, cls.customers, cls.loans_per_customer)
+
+    def endpoints(self):
+        return []
+
+    def measure(self, endpoint, run):
+        client = APIClient()
+        user = endpoint.user
+        if (user is not None):
+            # Loaded afresh, as the authentication would: no relation cached yet
+            user = type(user).objects.get(pk=user.pk)
+        client.force_authenticate(user)
+        request = getattr(client, endpoint.method)
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = request(
+                endpoint.resolve(endpoint.path, run), endpoint.resolve(endpoint.data, run), format="json",
+            )
+            if (response.streaming):
+                b"".join(response.streaming_content)
+        self.assertLess(
+            response.status_code, 400,
+            f"{endpoint.method.upper()} {endpoint.resolve(endpoint.path, run)}: {getattr(response, 'data', response)}",
+        )
+        return timer.count, 1000 * timer.seconds
+
+    def test_query_budgets(self):
+        endpoints = self.endpoints()
+        if (not endpoints):
+            self.skipTest("No endpoints")
+        results = {endpoint: [] for endpoint in endpoints}
+        for run in range(2):
+            if (run):
+                make_customers(self.huissier, self.customers * (self.growth - 1), self.loans_per_customer)
+            for endpoint in endpoints:
+                results[endpoint].append(self.measure(endpoint, run))
+
+        logger.info(
+            "%s: N=%d, M=%d, growth x%d", type(self).__module__, self.customers, self.loans_per_customer, self.growth,
+        )
+        for endpoint, ((small, small_ms), (large, large_ms)) in results.items():
+            logger.info(
+                "  %s %s: %d -> %d queries, %.2f -> %.2f ms", endpoint.method.upper(),
+                endpoint.resolve(endpoint.path, 0), small, large, small_ms, large_ms,
+            )
+
+        for endpoint, ((small, _), (large, large_ms)) in results.items():
+            with self.subTest(endpoint=f"{endpoint.method.upper()} {endpoint.resolve(endpoint.path, 0)}"):
+                self.assertEqual(small, large, "The query count grows with the number of customers")
+                if (endpoint.max_queries is not None):
+                    self.assertLessEqual(large, endpoint.max_queries)
+                self.assertLess(large_ms, self.max_db_ms)
+
+
+class FakeRedis:
+    """
+    Stands in for the Redis client: the strings and sets, with expiry, of the
+    commands the apps use.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def _live(self, key):
+        if (key in self.expires and self.expires[key] <= time.monotonic()):
+            del self.values[key], self.expires[key]
+        return key in self.values
+
+    def get(self, key):
+        return self.values[key] if self._live(key) else None
+
+    def set(self, key, value, nx=False, ex=None):
+        if (nx and self._live(key)):
+            return None
+        self.values[key] = str(value).encode()
+        self.expires.pop(key, None)
+        if (ex is not None):
+            self.expires[key] = time.monotonic() + ex
+        return True
+
+    def getdel(self, key):
+        value = self.get(key)
+        self.delete(key)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+
+    def ttl(self, key):
+        if (not self._live(key)):
+            return -2
+        return int(self.expires[key] - time.monotonic()) if key in self.expires else -1
+
+    @staticmethod
+    def _members(values):
+        return {value if isinstance(value, bytes) else str(value).encode() for value in values}
+
+    def sadd(self, key, *values):
+        members = self.values.setdefault(key, set())
+        added = self._members(values) - members
+        members |= added
+        return len(added)
+
+    def srem(self, key, *values):
+        members = self.values.get(key, set())
+        removed = members & self._members(values)
+        members -= removed
+        return len(removed)
+
+    def scard(self, key):
+        return len(self.values[key]) if self._live(key) else 0
+
+    def srandmember(self, key, count):
+        return list(self.values[key])[:count] if self._live(key) else []
+
+    def smove(self, source, destination, value):
+        if (not self.srem(source, value)):
+            return False
+        self.sadd(destination, value)
+        return True
+
+    def sunionstore(self, destination, *keys):
+        members = set().union(*(self.values[key] for key in keys if self._live(key)))
+        self.delete(destination)
+        if (members):
+            self.values[destination] = members
+        return len(members)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server.stand_in
+        server.connections += 1
+        self.reply("220 stand-in ESMTP")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if (not line):
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if (verb in ("EHLO", "HELO")):
+                self.reply("250 stand-in")
+            elif (verb == "MAIL"):
+                sender, recipients = command.split(":", 1)[1].strip().strip("<>"), []
+                self.reply("250 OK")
+            elif (verb == "RCPT"):
+                recipient = command.split(":", 1)[1].strip().strip("<>")
+                if (recipient in server.refused):
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif (verb == "DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(lambda: self.rfile.readline(), b".\r\n"))
+                time.sleep(server.delay)
+                server.messages.append((sender, recipients, data.decode()))
+                self.reply("250 OK")
+                if (server.drop_after and len(server.messages) % server.drop_after == 0):
+                    return
+            elif (verb in ("RSET", "NOOP")):
+                self.reply("250 OK")
+            elif (verb == "QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPStandIn:
+    """
+    A local SMTP server for the tests of the email queue, used as a context
+    manager; the email settings point at it meanwhile. It records the
+    ``messages`` it received (sender, recipients, data) and the number of
+    ``connections``. It answers each message after ``delay`` seconds, refuses
+    the addresses in ``refused``, and drops the connection after every
+    ``drop_after`` messages.
+    """
+
+    def __init__(self, delay=0, refused=(), drop_after=None):
+        self.delay = delay
+        self.refused = set(refused)
+        self.drop_after = drop_after
+        self.messages = []
+        self.connections = 0
+
+    def __enter__(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.settings = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend", EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.server.server_address[1], EMAIL_USE_TLS=False, EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="", EMAIL_TIMEOUT=5,
+        )
+        self.settings.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
@@ -4,6 +4,7 @@ import os
 from rest_framework import serializers
 import secrets
 from django.core.mail import send_mail
+from users.outbox import enqueue
 
 def get_media_url(file):
     return settings.MEDIA_HOST + file.url
@@ -26,10 +27,21 @@ def generate_random_code():
     return secrets.token_urlsafe(8)
 
 def send_email(data: dict):
-    send_mail(
+    """
+    Queue the email for the send_queued_emails worker, or with
+    EMAIL_QUEUE_ENABLED off send it from the request as before. Return
+    False when sending from the request failed.
+    """
+    if (settings.EMAIL_QUEUE_ENABLED):
+        enqueue(
+            subject=data.get("subject"), body=data.get("message"), to=data.get("to"),
+            reference=data.get("reference", ""), expires_in=data.get("expires_in"),
+        )
+        return True
+    return bool(send_mail(
         subject=data.get("subject"),
         message=data.get("message"),
         from_email=settings.EMAIL_HOST_USER,
         recipient_list=[data.get("to")],
         fail_silently=True
-    )
+    ))
@@ -1,5 +1,7 @@
 import re
 import os
+from decimal import Decimal, InvalidOperation
+from django.utils.dateparse import parse_date
 
 name_regex = r'^[a-zA-Z0-9._-]+$'
 number_regex = r'^[0-9]+$'
@@ -22,6 +24,44 @@ def validate_string(string: str, validator: dict)-> str:
         return number
     return ""
 
+def validate_column(values: list, validator: dict) -> list:
+    """``validate_string`` over a whole column: one error ("" if valid) per value."""
+    required = validator.get("required")
+    length = validator.get("length")
+    min_length = length.get("value") if (length and length.get("message")) else None
+    patterns = []
+    if (validator.get("name")):
+        patterns.append((re.compile(name_regex).match, validator.get("name")))
+    if (validator.get("number")):
+        patterns.append((re.compile(number_regex).match, validator.get("number")))
+
+    errors = []
+    for string in values:
+        if (required and not string):
+            errors.append(required)
+        elif (min_length and len(string) < min_length):
+            errors.append(length.get("message"))
+        else:
+            errors.append(next((message for match, message in patterns if not match(string)), ""))
+    return errors
+
+def validate_amount(value):
+    """``value`` as a Decimal if it is a finite amount above zero, else None (NaN, Infinity and "abc" included)."""
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if (not amount.is_finite() or amount <= 0):
+        return None
+    return amount
+
+def validate_date(value):
+    """``value`` as a date if it is a valid YYYY-MM-DD date, else None ("2025-13-40" included)."""
+    try:
+        return parse_date(str(value))
+    except ValueError:
+        return None
+
 def validate_file(file, allowed_extensions: list):
     ext = os.path.splitext(file.name)[1]
     if ext not in allowed_extensions:
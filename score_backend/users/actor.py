@@ -0,0 +1,74 @@
+"""
+``request.actor``: the organizational context of the request's user (its
+huissier or financial profile, front office and country), resolved with a
+single query the first time a view reads it.
+
+Users built from token claims (``users.authentication.token_user``) carry
+the chain already and resolve without a query.
+"""
+from django.utils.functional import SimpleLazyObject
+
+from .models import ScoreUser
+
+# Role -> (profile accessor on the user, select_related path down to the country)
+CHAINS = {
+    "huissier": ("huissier", "huissier__front_office__country"),
+    "conseiller": ("financial_profile", "financial_profile__front_office__country"),
+    "front office": ("frontoffice", "frontoffice__country"),
+    "country": ("country", "country"),
+}
+
+
+class Actor:
+    def __init__(self, user, profile=None):
+        self.user = user
+        self.huissier = None
+        self.financial = None
+        self.front_office = None
+        self.country = None
+        role = getattr(user, "role", None)
+        if (profile is None):
+            pass
+        elif (role == "huissier"):
+            self.huissier = profile
+            self.front_office = profile.front_office
+            self.country = self.front_office.country
+        elif (role == "conseiller"):
+            self.financial = profile
+            self.front_office = profile.front_office
+            self.country = self.front_office.country
+        elif (role == "front office"):
+            self.front_office = profile
+            self.country = profile.country
+        elif (role == "country"):
+            self.country = profile
+
+    @property
+    def zone(self):
+        return self.huissier.zone if self.huissier else None
+
+
+def resolve_actor(user):
+    chain = CHAINS.get(getattr(user, "role", None))
+    if (not user.is_authenticated or chain is None):
+        return Actor(user)
+    accessor, path = chain
+    relation = ScoreUser._meta.get_field(accessor)
+    if (not relation.is_cached(user)):
+        loaded = ScoreUser.objects.select_related(path).get(pk=user.pk)
+        relation.set_cached_value(user, relation.get_cached_value(loaded))
+    return Actor(user, getattr(user, accessor, None))
+
+
+class ActorMiddleware:
+    """
+    Sets ``request.actor``. It is lazy: DRF authenticates inside the view,
+    and sets the user on the request only then.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.actor = SimpleLazyObject(lambda: resolve_actor(request.user))
+        return self.get_response(request)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import ScoreUser
+from .models import OutboundEmail, ScoreUser
 
 @admin.register(ScoreUser)
 class CustomUserAdmin(admin.ModelAdmin):
@@ -33,6 +33,12 @@ class CustomUserAdmin(admin.ModelAdmin):
     #     return hasattr(request.user, 'role') and request.user.role == 'admin'
 
 
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'next_attempt_at', 'expires_at', 'created_at')
+    list_filter = ('status',)
+
+
 # @admin.register(Client)
 # class ClientAdmin(admin.ModelAdmin):
 #     list_display = ('prenom', 'nom', 'email', 'telephone', 'conseiller', 'date_creation')
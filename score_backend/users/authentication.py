@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import router
+from django.db.models import DEFERRED
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from country.models import Country, FrontOffice, Huissier
+from .models import ScoreUser
+from .tokens import token_version
+
+
+def _stub(model, **values):
+    """An instance of ``model`` holding ``values``; its other fields load on first access."""
+    fields = model._meta.concrete_fields
+    return model.from_db(
+        router.db_for_read(model), list(values), [values.get(field.attname, DEFERRED) for field in fields],
+    )
+
+
+def _relate(instance, name, value):
+    instance._meta.get_field(name).set_cached_value(instance, value)
+
+
+def token_user(token):
+    """
+    The ScoreUser described by the claims of ``token``, built without a
+    query. Its huissier, front office and country hold their ids only; any
+    other field is loaded when first read.
+    """
+    user = _stub(
+        ScoreUser, id=token[api_settings.USER_ID_CLAIM], role=token["role"],
+        password_changed=token["password_changed"], token_version=token["token_version"],
+    )
+    country_id = token["country_id"]
+    front_office_id = token["front_office_id"]
+    if (user.role == "huissier" and token["huissier_id"]):
+        front_office = _stub(FrontOffice, id=front_office_id, country_id=country_id)
+        _relate(front_office, "country", _stub(Country, id=country_id))
+        huissier = _stub(Huissier, id=token["huissier_id"], user_id=user.id, front_office_id=front_office_id)
+        _relate(huissier, "front_office", front_office)
+        _relate(huissier, "user", user)
+        _relate(user, "huissier", huissier)
+    elif (user.role == "front office" and front_office_id):
+        front_office = _stub(FrontOffice, id=front_office_id, user_id=user.id, country_id=country_id)
+        _relate(front_office, "country", _stub(Country, id=country_id))
+        _relate(front_office, "user", user)
+        _relate(user, "frontoffice", front_office)
+    elif (user.role == "country" and country_id):
+        country = _stub(Country, id=country_id, user_id=user.id)
+        _relate(country, "user", user)
+        _relate(user, "country", country)
+    return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from the token claims (see
+    ``users.tokens``) when ``AUTH_STATELESS_TOKENS`` is on, checking only the
+    token version: deactivating a user, changing its role or moving its
+    profile bumps it (``users.signals``). Tokens issued without the claims
+    load the user as before.
+    """
+
+    def get_user(self, validated_token):
+        if ("token_version" not in validated_token):
+            return super().get_user(validated_token)
+        if (not settings.AUTH_STATELESS_TOKENS):
+            user = super().get_user(validated_token)
+            current = user.token_version
+        else:
+            user = None
+            current = token_version(validated_token[api_settings.USER_ID_CLAIM])
+        if (current is None):
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if (current != validated_token["token_version"]):
+            raise AuthenticationFailed("Token revoked", code="token_revoked")
+        return user or token_user(validated_token)
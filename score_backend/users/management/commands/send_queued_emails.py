@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.outbox import claim, deliver
+
+
+class Command(BaseCommand):
+    help = "Send the emails queued by the request handlers, over one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.EMAIL_QUEUE_BATCH_SIZE)
+        parser.add_argument("--poll-interval", type=float, default=settings.EMAIL_QUEUE_POLL_INTERVAL)
+        parser.add_argument("--once", action="store_true", help="Send what is due then exit")
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        try:
+            while True:
+                emails = claim(options["batch_size"])
+                if not emails:
+                    # Idle: let the server have its connection back, the next batch opens a new one
+                    connection.close()
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                start = time.perf_counter()
+                sent, failed = deliver(emails, connection)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{sent} emails sent, {failed} failed in {elapsed * 1000:.0f}ms")
+        finally:
+            connection.close()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_scoreuser_password_changed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoreuser',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
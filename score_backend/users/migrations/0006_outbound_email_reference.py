@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_outbound_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='reference',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
+from django.utils import timezone
 from .manager import CustomUserManager
 from django.conf import settings
 
@@ -18,6 +19,7 @@ class ScoreUser(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(max_length=100, unique=True)
     username = models.CharField(max_length=100, unique=True)
     password_changed = models.BooleanField(default=False)
+    token_version = models.PositiveIntegerField(default=0)  # Bumped to revoke the tokens issued so far
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -55,3 +57,32 @@ class Support(models.Model):
 
     def __str__(self):
         return f"Support de {self.user.username}"
+
+
+class OutboundEmail(models.Model):
+    """Emails waiting for the send_queued_emails worker (see users.outbox)."""
+    STATUS_CHOICES = (
+        ('pending', 'En attente'),
+        ('failed', 'Echec'),
+    )
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.CharField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    # Names what the email carries (e.g. "loan:<customer id>" for a loan code), for
+    # the sender to tell whether it went out yet
+    reference = models.CharField(max_length=100, blank=True, default="", db_index=True)
+    # Dropped unsent past this moment: a code email is useless once the code expired
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx')]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to}"
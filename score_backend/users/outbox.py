@@ -0,0 +1,120 @@
+"""
+Outbound email queue. ``score.utils.send_email`` only stores the message
+(one INSERT, committed with the request); the ``send_queued_emails`` worker
+sends what is due over one SMTP connection it keeps open while there is
+work, and retries failures with exponential backoff.
+
+A claimed email is hidden from other workers for ``EMAIL_QUEUE_LEASE``
+seconds, so a worker that dies mid-batch only delays it. On SQLite, whose
+transactions do not lock rows, run a single worker.
+
+An email enqueued with ``expires_in`` (the codes mailed to customers) is
+dropped, sent or not, once that many seconds passed.
+"""
+from datetime import timedelta
+from smtplib import SMTPDataError, SMTPRecipientsRefused, SMTPSenderRefused, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+# The server refused the message; the connection is still usable. Other
+# errors (SMTPException is an OSError) mean the connection is not.
+MESSAGE_ERRORS = (SMTPDataError, SMTPRecipientsRefused, SMTPSenderRefused)
+
+
+def enqueue(subject, body, to, from_email=None, reference="", expires_in=None):
+    return OutboundEmail.objects.create(
+        subject=subject, body=body, to=to, from_email=from_email or settings.EMAIL_HOST_USER, reference=reference,
+        expires_at=timezone.now() + timedelta(seconds=expires_in) if expires_in is not None else None,
+    )
+
+
+def retry(reference):
+    """
+    Make the emails queued under ``reference`` that were not sent yet
+    (pending or failed) due now, with their attempts reset. Return whether
+    there were any.
+    """
+    return OutboundEmail.objects.filter(reference=reference, expires_at__gt=timezone.now()).update(
+        status="pending", attempts=0, next_attempt_at=timezone.now(),
+    ) > 0
+
+
+def claim(batch_size):
+    """
+    Up to ``batch_size`` due emails, oldest first, leased to the caller.
+    Expired emails are dropped first.
+    """
+    now = timezone.now()
+    OutboundEmail.objects.filter(expires_at__lte=now).delete()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE),
+        )
+    return emails
+
+
+def retry_delay(attempts):
+    """Seconds before the next try of an email that failed ``attempts`` times."""
+    return min(settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1), settings.EMAIL_QUEUE_MAX_RETRY_DELAY)
+
+
+def _send(connection, message):
+    connection.open()
+    try:
+        connection.send_messages([message])
+    except SMTPServerDisconnected:
+        # The server dropped the connection since the last batch: once more on a new one
+        connection.close()
+        connection.open()
+        connection.send_messages([message])
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if (email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS):
+        email.status = "failed"
+    email.next_attempt_at = now + timedelta(seconds=retry_delay(email.attempts))
+    return email
+
+
+def deliver(emails, connection):
+    """
+    Send ``emails`` (from ``claim``) over ``connection``, an email backend
+    opened with ``fail_silently=False``. Sent emails leave the queue; the
+    others are rescheduled, or marked failed after
+    ``EMAIL_QUEUE_MAX_ATTEMPTS`` tries. Return (sent, failed).
+
+    Messages go one per ``send_messages`` call: a call with several reports
+    how many were sent, not which.
+    """
+    sent = []
+    failed = []
+    now = timezone.now()
+    for index, email in enumerate(emails):
+        message = EmailMessage(email.subject, email.body, email.from_email, [email.to], connection=connection)
+        try:
+            _send(connection, message)
+        except MESSAGE_ERRORS as error:
+            failed.append(_failed(email, error, now))
+        except OSError as error:
+            # No connection to the server: the rest of the batch waits for its retry too
+            connection.close()
+            failed += [_failed(rest, error, now) for rest in emails[index:]]
+            break
+        else:
+            sent.append(email.pk)
+
+    OutboundEmail.objects.filter(pk__in=sent).delete()
+    OutboundEmail.objects.bulk_update(failed, ["attempts", "last_error", "status", "next_attempt_at"])
+    return len(sent), len(failed)
@@ -79,7 +79,7 @@ class LoanSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loan
         fields = [
-            'id', 'date', 'amount', 'periodicity', 'rate',
+            'id', 'date', 'amount', 'periodicity',
             'deadline_amount', 'deadline', 'solvability', 'status', 'repayments'
         ]
 
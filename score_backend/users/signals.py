@@ -0,0 +1,81 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from country.models import Country, Financial, FrontOffice, Huissier
+from .models import ScoreUser
+from .tokens import revoke_tokens, revoke_user_tokens
+
+# Fields of the user carried by its tokens
+USER_CLAIMS = ("is_active", "role")
+
+# Profile model -> its fields whose value is carried by its user's tokens
+# (see tokens.PROFILES), the link to the user first
+PROFILE_CLAIMS = {
+    Huissier: ("user_id", "front_office_id"),
+    Financial: ("user_id", "front_office_id"),
+    FrontOffice: ("user_id", "country_id"),
+    Country: ("user_id",),
+}
+
+
+def _remember(instance, fields, update_fields=None):
+    # Deferred fields are left out (token_user builds users from their
+    # claims): reading them would query the row
+    for field in fields:
+        if (update_fields is None or field in update_fields or field.removesuffix("_id") in update_fields):
+            setattr(instance, f"_stored_{field}", instance.__dict__.get(field))
+
+
+def _changed(instance, fields, update_fields=None):
+    """The ``fields`` the save changed, as (field, stored value) pairs."""
+    changed = []
+    for field in fields:
+        if (update_fields is not None and field not in update_fields and field.removesuffix("_id") not in update_fields):
+            continue
+        stored = getattr(instance, f"_stored_{field}", None)
+        if (stored is not None and instance.__dict__.get(field) != stored):
+            changed.append((field, stored))
+    return changed
+
+
+@receiver(post_init, sender=ScoreUser)
+def user_loaded(sender, instance: ScoreUser, **kwargs):
+    _remember(instance, USER_CLAIMS)
+
+
+@receiver(post_save, sender=ScoreUser)
+def user_saved(sender, instance: ScoreUser, created, update_fields=None, **kwargs):
+    if (not created and _changed(instance, USER_CLAIMS, update_fields)):
+        # Stateless tokens carry the role and only a version: they must be rejected
+        revoke_tokens(instance)
+    _remember(instance, USER_CLAIMS, update_fields)
+
+
+def profile_loaded(sender, instance, **kwargs):
+    _remember(instance, PROFILE_CLAIMS[sender])
+
+
+def profile_saved(sender, instance, created, update_fields=None, **kwargs):
+    changed = [] if created else _changed(instance, PROFILE_CLAIMS[sender], update_fields)
+    if (changed):
+        users = {instance.user_id}
+        for field, stored in changed:
+            if (field == "user_id"):
+                # The former user's tokens still name this profile
+                users.add(stored)
+            elif (sender is FrontOffice):
+                # The country of its huissiers and conseillers moved with it
+                users.update(Huissier.objects.filter(front_office=instance).values_list("user_id", flat=True))
+                users.update(Financial.objects.filter(front_office=instance).values_list("user_id", flat=True))
+        revoke_user_tokens(users)
+    _remember(instance, PROFILE_CLAIMS[sender], update_fields)
+
+
+def profile_deleted(sender, instance, **kwargs):
+    revoke_user_tokens([instance.user_id])
+
+
+for model in PROFILE_CLAIMS:
+    post_init.connect(profile_loaded, sender=model)
+    post_save.connect(profile_saved, sender=model)
+    post_delete.connect(profile_deleted, sender=model)
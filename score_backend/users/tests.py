@@ -1,2 +1,400 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from country.models import FrontOffice, Huissier
+from customer.models import Customer
+from score import bloom
+from score.testing import (
+    Endpoint, QueryBudgetTestCase, QueryPlanTestCase, SMTPStandIn, make_customers, make_huissier,
+)
+from score.utils import send_email
+from .actor import resolve_actor
+from .authentication import token_user
+from .models import OutboundEmail, ScoreUser
+from .outbox import enqueue, retry_delay
+from .tokens import revoke_tokens, user_claims
+
+
+class QueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        cls.customers = make_customers(cls.huissier, 30)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.huissier.user)
+
+    def test_huissier_customers(self):
+        self.assertEndpointIndexed(self.client.get, "/score/huissier/customers/")
+        self.assertEndpointIndexed(self.client.get, "/score/huissier/customers/", {"limit": 10})
+
+    def test_customer_loans(self):
+        self.assertEndpointIndexed(self.client.get, f"/score/huissier/customers/{self.customers[3].uuid}/")
+
+    def test_alerts(self):
+        response = self.assertEndpointIndexed(self.client.get, "/score/huissier/alerts/")
+        self.assertEqual(response.data["total_alerts"], 30)
+
+    def test_zone_customers(self):
+        self.assertEndpointIndexed(self.client.get, "/score/huissier/zone/", {"limit": 10})
+
+    def test_score_history(self):
+        self.assertEndpointIndexed(self.client.get, f"/score/customers/{self.customers[3].uuid}/score-history/")
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class QueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = ScoreUser.objects.create(username="admin", email="admin@score.org", role="admin", password_changed=True)
+        cls.admin.set_password("secret")
+        cls.admin.save()
+        cls.customer = Customer.objects.order_by("id").first()
+
+    def setUp(self):
+        # The filter statistics are read from Redis, not from the database
+        redis = mock.Mock(**{"hgetall.return_value": {b"negatives": b"3"}, "bitcount.return_value": 12})
+        patcher = mock.patch.object(bloom._filter, "redis", return_value=redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def endpoints(self):
+        huissier = self.huissier.user
+        uuid = self.customer.uuid
+        return [
+            Endpoint("/score/login/", None, "post", {'email': "admin@score.org", 'password': "secret"}, max_queries=1),
+            Endpoint("/score/email-test/", None, "post", max_queries=0),
+            Endpoint("/score/add-country/", self.admin, "post", lambda run: {
+                'name': f"New country {run}", 'country_code': f"NC{run}", 'phone_code': "+1", 'email': f"nc{run}@score.org",
+            }, max_queries=5),
+            Endpoint("/score/subscribe/", self.admin, "post", {'plan': "monthly", 'name': "BEN"}, max_queries=4),
+            Endpoint("/score/country/BEN/", self.admin, max_queries=1),
+            Endpoint("/score/country/BEN/subscriptions/", self.admin, max_queries=2),
+            Endpoint("/score/countries/", self.admin, max_queries=1),
+            Endpoint("/score/bloom-filter/", self.admin, max_queries=0),
+            Endpoint("/score/huissier/customers/", huissier, max_queries=3),
+            Endpoint("/score/huissier/customers/?limit=5", huissier, max_queries=3),
+            Endpoint(f"/score/huissier/customers/{uuid}/", huissier, max_queries=5),
+            Endpoint("/score/huissier/alerts/", huissier, max_queries=2),
+            Endpoint("/score/huissier/zone/", huissier, max_queries=2),
+            Endpoint(f"/score/customers/{uuid}/score-history/", huissier, max_queries=5),
+            Endpoint(f"/score/customers/{uuid}/score-history/?points=12", huissier, max_queries=5),
+        ]
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': "django.core.cache.backends.locmem.LocMemCache"}},
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class StatelessTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+        make_customers(cls.huissier, 5)
+        cls.user = cls.huissier.user
+        cls.user.set_password("secret")
+        cls.user.save()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post("/score/login/", {'email': self.user.email, 'password': "secret"})
+        return response.data
+
+    def authenticate(self, access_token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+
+    def test_claims(self):
+        token = AccessToken(self.login()['access_token'])
+        front_office = self.huissier.front_office
+        self.assertEqual(
+            [token[claim] for claim in ("role", "password_changed", "huissier_id", "front_office_id", "country_id", "token_version")],
+            ["huissier", True, self.huissier.id, front_office.id, front_office.country_id, 0],
+        )
+
+    def test_no_user_query(self):
+        self.authenticate(self.login()['access_token'])
+        self.client.get("/score/huissier/alerts/")  # Caches the token version
+        # The query budget of the endpoint under force_authenticate
+        with self.assertNumQueries(1):
+            response = self.client.get("/score/huissier/alerts/")
+        self.assertEqual(response.data['total_alerts'], 5)
+
+    def test_token_user_relations(self):
+        self.authenticate(self.login()['access_token'])
+        response = self.client.post("/customer/new/", {
+            'first_name': "New", 'last_name': "Customer", 'npi': "NEW00001",
+            'phone_number': "01234567", 'email': "new@customer.org",
+        })
+        self.assertEqual(response.status_code, 201)
+        customer = Customer.objects.get(npi="NEW00001")
+        self.assertEqual(
+            (customer.huissier, customer.zone, customer.front_office, customer.country),
+            (self.huissier, "Z1", self.huissier.front_office, self.huissier.front_office.country),
+        )
+
+    def test_revocation(self):
+        self.authenticate(self.login()['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_tokens(self.user)
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 401)
+
+    def test_password_change(self):
+        tokens = self.login()
+        self.authenticate(tokens['access_token'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/change-password/", {'old_password': "secret", 'new_password': "secret2"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 401)
+        self.authenticate(response.data['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("secret2"))
+        self.assertEqual(self.user.email, "huissier@BEN.org")
+
+    def test_deactivation(self):
+        self.authenticate(self.login()['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        user = ScoreUser.objects.get(pk=self.user.pk)
+        user.email = "renamed@BEN.org"
+        user.save()
+        self.assertEqual(ScoreUser.objects.get(pk=self.user.pk).token_version, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_active = False
+            user.save(update_fields=["is_active"])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 401)
+        self.assertEqual(ScoreUser.objects.get(pk=self.user.pk).token_version, 1)
+
+    def test_refresh(self):
+        tokens = self.login()
+        # The client may still send its expired access token
+        self.authenticate("expired")
+        response = self.client.post("/score/refresh-token/", {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        self.authenticate(response.data['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        self.assertEqual(AccessToken(response.data['access_token'])["huissier_id"], self.huissier.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_tokens(self.user)
+        response = self.client.post("/score/refresh-token/", {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.post("/score/refresh-token/", {'refresh_token': "nope"}).status_code, 401)
+        self.assertEqual(self.client.post("/score/refresh-token/").status_code, 400)
+
+    def versions(self, *users):
+        users = ScoreUser.objects.filter(pk__in=[user.pk for user in users]).order_by("pk")
+        return list(users.values_list("token_version", flat=True))
+
+    def assertRevokes(self, change, revoked, kept):
+        before = self.versions(*revoked), self.versions(*kept)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertEqual(self.versions(*revoked), [version + 1 for version in before[0]])
+        self.assertEqual(self.versions(*kept), before[1])
+
+    def test_role_change(self):
+        self.authenticate(self.login()['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        user = ScoreUser.objects.get(pk=self.user.pk)
+        user.save()
+        self.assertEqual(self.versions(self.user), [0])
+        user.role = "front office"
+        self.assertRevokes(user.save, [self.user], [])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 401)
+
+    def test_profile_moves(self):
+        front_office = FrontOffice.objects.get(pk=self.huissier.front_office_id)
+        elsewhere = make_huissier("TOG")
+        other_user = elsewhere.user
+        kept = [elsewhere.front_office.user, front_office.country.user]
+
+        huissier = Huissier.objects.get(pk=self.huissier.pk)
+        huissier.zone = "Z2"
+        self.assertRevokes(huissier.save, [], [self.user, *kept])
+        huissier.front_office = elsewhere.front_office
+        self.assertRevokes(huissier.save, [self.user], kept)
+        huissier.front_office = front_office
+        huissier.save()
+
+        # The huissiers of a front office moving to another country move with it
+        front_office.country = elsewhere.front_office.country
+        self.assertRevokes(lambda: front_office.save(update_fields=["country"]), [front_office.user, self.user], kept)
+
+        other = Huissier.objects.get(pk=elsewhere.pk)
+        other.user = ScoreUser.objects.create(username="spare", email="spare@TOG.org", role="huissier")
+        self.assertRevokes(other.save, [other_user, other.user], [self.user])
+        self.assertRevokes(other.delete, [other.user], [self.user])
+
+    @override_settings(AUTH_STATELESS_TOKENS=False)
+    def test_database_mode(self):
+        self.authenticate(self.login()['access_token'])
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_tokens(self.user)
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 401)
+
+    def test_tokens_without_claims(self):
+        # Issued before the claims were added: the user is loaded
+        self.authenticate(str(RefreshToken.for_user(self.user).access_token))
+        self.assertEqual(self.client.get("/score/huissier/alerts/").status_code, 200)
+
+
+class ActorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.huissier = make_huissier()
+
+    def fresh(self, user):
+        return ScoreUser.objects.get(pk=user.pk)
+
+    def test_huissier_chain(self):
+        user = self.fresh(self.huissier.user)
+        # Before: one lazy query per hop
+        with self.assertNumQueries(3):
+            self.assertEqual(user.huissier.front_office.country.country_code, "BEN")
+        user = self.fresh(self.huissier.user)
+        with self.assertNumQueries(1):
+            actor = resolve_actor(user)
+            self.assertEqual(
+                (actor.huissier, actor.front_office, actor.country.country_code, actor.zone),
+                (self.huissier, self.huissier.front_office, "BEN", "Z1"),
+            )
+            self.assertEqual(user.huissier.front_office.country, actor.country)
+
+    def test_other_roles(self):
+        front_office = self.huissier.front_office
+        user = self.fresh(front_office.user)
+        with self.assertNumQueries(1):
+            actor = resolve_actor(user)
+            self.assertEqual((actor.front_office, actor.country, actor.huissier), (front_office, front_office.country, None))
+        user = self.fresh(front_office.country.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_actor(user).country, front_office.country)
+        admin = ScoreUser.objects.create(username="admin", email="admin@score.org", role="admin")
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_actor(admin).country)
+
+    def test_missing_profile(self):
+        user = ScoreUser.objects.create(username="h2", email="h2@score.org", role="huissier")
+        actor = resolve_actor(user)
+        self.assertIsNone(actor.huissier)
+        self.assertIsNone(actor.zone)
+
+    def test_token_user(self):
+        token = AccessToken.for_user(self.huissier.user)
+        for claim, value in user_claims(self.huissier.user).items():
+            token[claim] = value
+        with self.assertNumQueries(0):
+            actor = resolve_actor(token_user(token))
+            self.assertEqual(actor.country.pk, self.huissier.front_office.country_id)
+
+    def test_request_actor(self):
+        client = APIClient()
+        client.force_authenticate(self.fresh(self.huissier.user))
+        with self.assertNumQueries(2):  # actor, alerts
+            self.assertEqual(client.get("/score/huissier/alerts/").status_code, 200)
+
+
+class EmailQueueTests(TestCase):
+    def enqueue(self, *recipients):
+        for recipient in recipients:
+            send_email({'subject': "Code", 'message': f"Code for {recipient}", 'to': recipient})
+
+    def work(self, *args):
+        call_command("send_queued_emails", "--once", *args, stdout=StringIO())
+
+    def test_request_only_enqueues(self):
+        with self.assertNumQueries(1):
+            self.enqueue("a@ben.org")
+        self.assertEqual(mail.outbox, [])
+        self.work()
+        self.assertEqual([message.to for message in mail.outbox], [["a@ben.org"]])
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_one_connection_for_all_batches(self):
+        self.enqueue(*[f"c{i}@ben.org" for i in range(25)])
+        with SMTPStandIn() as smtp:
+            self.work("--batch-size", "10")
+        self.assertEqual(len(smtp.messages), 25)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(smtp.messages[0][1], ["c0@ben.org"])
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_refused_message_is_retried_later(self):
+        self.enqueue("a@ben.org", "refused@ben.org", "b@ben.org")
+        with SMTPStandIn(refused=["refused@ben.org"]) as smtp:
+            self.work()
+            self.work()
+        self.assertEqual([recipients for _, recipients, _ in smtp.messages], [["a@ben.org"], ["b@ben.org"]])
+        self.assertEqual(smtp.connections, 1)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.to, email.status, email.attempts), ("refused@ben.org", "pending", 1))
+        self.assertIn("SMTPRecipientsRefused", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=25))
+
+    @override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=3, EMAIL_QUEUE_RETRY_DELAY=0)
+    def test_gives_up_after_max_attempts(self):
+        self.enqueue("refused@ben.org")
+        with SMTPStandIn(refused=["refused@ben.org"]):
+            for _ in range(4):
+                self.work()
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ("failed", 3))
+
+    def test_backoff(self):
+        self.assertEqual([retry_delay(attempts) for attempts in range(1, 9)], [30, 60, 120, 240, 480, 960, 1920, 3600])
+
+    def test_reconnects_when_dropped(self):
+        self.enqueue(*[f"c{i}@ben.org" for i in range(7)])
+        with SMTPStandIn(drop_after=3) as smtp:
+            self.work()
+        self.assertEqual(len(smtp.messages), 7)
+        self.assertEqual(smtp.connections, 3)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_server_unreachable(self):
+        self.enqueue("a@ben.org", "b@ben.org")
+        with SMTPStandIn(), mock.patch("smtplib.SMTP.connect", side_effect=ConnectionRefusedError) as connect:
+            self.work()
+        # The batch stops at the first failed connection
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(list(OutboundEmail.objects.values_list("attempts", flat=True)), [1, 1])
+
+    def test_direct_send(self):
+        """With EMAIL_QUEUE_ENABLED off, the request sends the email itself."""
+        with SMTPStandIn() as smtp:
+            with override_settings(EMAIL_QUEUE_ENABLED=False):
+                self.enqueue("a@ben.org")
+            self.assertEqual([recipients for _, recipients, _ in smtp.messages], [["a@ben.org"]])
+            self.enqueue("b@ben.org")
+            self.assertEqual(len(smtp.messages), 1)
+        self.assertEqual(OutboundEmail.objects.get().to, "b@ben.org")
+
+    @override_settings(EMAIL_QUEUE_RETRY_DELAY=0)
+    def test_expired_emails_are_dropped(self):
+        enqueue("Code", "Code 1", "refused@ben.org", expires_in=60)
+        enqueue("Code", "Code 2", "a@ben.org", expires_in=60)
+        enqueue("News", "Not expiring", "b@ben.org")
+        with SMTPStandIn(refused=["refused@ben.org"]) as smtp:
+            self.work()
+            self.assertEqual(OutboundEmail.objects.get().to, "refused@ben.org")
+            # Its retries stop when the code it carries expires
+            OutboundEmail.objects.update(expires_at=timezone.now())
+            self.work()
+        self.assertEqual(len(smtp.messages), 2)
+        self.assertFalse(OutboundEmail.objects.exists())
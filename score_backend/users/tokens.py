@@ -0,0 +1,131 @@
+"""
+Tokens carrying what the permission classes and views need to know about
+their user: role, password_changed, the ids of its huissier profile, front
+office and country, and the token version.
+
+``StatelessJWTAuthentication`` builds the request user from these claims,
+so most requests authorize without loading the user. ``revoke_tokens``
+bumps the user's version, which rejects every token issued before; the
+current version is read through the cache. ``signals`` revokes the tokens
+whose claims a save made stale.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from country.models import Country, Financial, FrontOffice, Huissier
+from .models import ScoreUser
+
+CACHE_ERRORS = (ConnectionInterrupted, RedisError)
+
+# Role -> (profile model, {claim: field of the profile})
+PROFILES = {
+    "huissier": (Huissier, {
+        "huissier_id": "id", "front_office_id": "front_office_id", "country_id": "front_office__country_id",
+    }),
+    "front office": (FrontOffice, {"front_office_id": "id", "country_id": "country_id"}),
+    "conseiller": (Financial, {"front_office_id": "front_office_id", "country_id": "front_office__country_id"}),
+    "country": (Country, {"country_id": "id"}),
+}
+
+
+def user_claims(user):
+    claims = {
+        "role": user.role,
+        "password_changed": user.password_changed,
+        "token_version": user.token_version,
+        "huissier_id": None,
+        "front_office_id": None,
+        "country_id": None,
+    }
+    if (user.role in PROFILES):
+        model, fields = PROFILES[user.role]
+        row = model.objects.filter(user=user).values_list(*fields.values()).first()
+        if (row):
+            claims.update(zip(fields, row))
+    return claims
+
+
+class ScoreRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        # Claims of the refresh token are copied into its access tokens
+        token = super().for_user(user)
+        for claim, value in user_claims(user).items():
+            token[claim] = value
+        return token
+
+
+def issue_tokens(user):
+    """{access_token, refresh_token} for ``user``, as returned by the login."""
+    refresh_token = ScoreRefreshToken.for_user(user)
+    return {
+        "access_token": str(refresh_token.access_token),
+        "refresh_token": str(refresh_token),
+    }
+
+
+def refresh_access(raw_token):
+    """
+    A new access token from the refresh token ``raw_token``, or None when it
+    is invalid, expired or revoked since (its token version is stale).
+    """
+    try:
+        refresh_token = ScoreRefreshToken(raw_token)
+    except TokenError:
+        return None
+    if ("token_version" in refresh_token):
+        current = token_version(refresh_token[api_settings.USER_ID_CLAIM])
+        if (current is None or current != refresh_token["token_version"]):
+            return None
+    return str(refresh_token.access_token)
+
+
+def _key(user_id):
+    return f"{settings.TOKEN_VERSION_KEY_PREFIX}:{user_id}"
+
+
+def token_version(user_id):
+    """Current token version of the user, None if the user does not exist."""
+    try:
+        version = cache.get(_key(user_id))
+    except CACHE_ERRORS:
+        version = None
+    if version is None:
+        version = ScoreUser.objects.filter(pk=user_id).values_list("token_version", flat=True).first()
+        if version is None:
+            return None
+        try:
+            cache.set(_key(user_id), version, settings.TOKEN_VERSION_CACHE_TTL)
+        except CACHE_ERRORS:
+            pass
+    return version
+
+
+def revoke_tokens(user):
+    """Reject every token issued to ``user`` so far (password change, deactivation)."""
+    revoke_user_tokens([user.pk])
+    user.refresh_from_db(fields=["token_version"])
+
+
+def revoke_user_tokens(user_ids):
+    """``revoke_tokens`` for the users of ``user_ids``, with one UPDATE."""
+    user_ids = sorted({pk for pk in user_ids if pk is not None})
+    if (not user_ids):
+        return
+    ScoreUser.objects.filter(pk__in=user_ids).update(token_version=F("token_version") + 1)
+
+    def forget():
+        try:
+            cache.delete_many([_key(pk) for pk in user_ids])
+        except CACHE_ERRORS:
+            # The stale versions expire after TOKEN_VERSION_CACHE_TTL
+            pass
+
+    transaction.on_commit(forget)
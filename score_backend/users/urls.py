@@ -1,11 +1,12 @@
 from django.urls import path
-from .views import Login, NewCountry, CountrySubscribe, CountryData
+from .views import Login, RefreshAccessToken, NewCountry, CountrySubscribe, CountryData
 from .views import CountryListView, CountrySubscriptions
 from .views import HuissierCustomerListView, HuissierAlertsView, CustomerLoanDetailView
-from .views import ZoneCustomerListView, SendEm
+from .views import ZoneCustomerListView, SendEm, CustomerScoreHistoryView, BloomFilterStatsView
 
 urlpatterns = [
     path("login/", Login.as_view()),
+    path("refresh-token/", RefreshAccessToken.as_view()),
     path("email-test/", SendEm.as_view()),
     path("add-country/", NewCountry.as_view()),
     path("subscribe/", CountrySubscribe.as_view()),
@@ -15,5 +16,7 @@ urlpatterns = [
     path('huissier/customers/', HuissierCustomerListView.as_view()),
     path('huissier/customers/<str:customer_id>/', CustomerLoanDetailView.as_view()),
     path('huissier/alerts/', HuissierAlertsView.as_view()),
-    path('huissier/zone/', ZoneCustomerListView.as_view())
+    path('huissier/zone/', ZoneCustomerListView.as_view()),
+    path('customers/<str:customer_id>/score-history/', CustomerScoreHistoryView.as_view()),
+    path('bloom-filter/', BloomFilterStatsView.as_view()),
 ]
\ No newline at end of file
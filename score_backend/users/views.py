@@ -5,10 +5,10 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
 from dateutil.relativedelta import relativedelta
 from users.models import ScoreUser
 from users.serializers import ScoreUserSerializer
+from users.tokens import issue_tokens, refresh_access, revoke_tokens
 from country.models import Country, Subscription
 from .utils import generate_random_password
 from rest_framework.request import Request
@@ -16,6 +16,7 @@ from django.utils.timezone import now
 from country.serializers import CountrySerializer
 from .serializers import SubscriptionSerializer
 from score.permissions import IsScoreAdmin, IsHuissier
+from score.pagination import KeysetPagination, InvalidPage
 from customer.models import Customer, Loan
 
 from rest_framework.views import APIView
@@ -23,10 +24,17 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .serializers import CustomerSerializer
 from customer.serializers import CustomerListSerializer
+from customer.loaders import CreditorNames, with_loans
 
 from .serializers import LoanSerializer
 from django.core.mail import send_mail
-from datetime import date
+from datetime import date, datetime, time, timedelta
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+from customer.scoring import score_as_of, score_series
+from customer.percentiles import percentile
+from customer.alerts import overdue_alerts
+from score import bloom
 
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -48,15 +56,25 @@ class Login(APIView):
             return Response({"Error_message": "Bad password"}, status=400)
 
         # Création des tokens
-        refresh_token = RefreshToken.for_user(user)
-        access_token = str(refresh_token.access_token)
-
         return Response({
-            "access_token": access_token,
-            "refresh_token": str(refresh_token),
+            **issue_tokens(user),
             "type_user": user.role
         }, status=200)
 
+@method_decorator(csrf_exempt, name='dispatch')
+class RefreshAccessToken(APIView):
+    # The expired access token the client may still send must not get in the way
+    authentication_classes = []
+
+    def post(self, request):
+        refresh_token = request.data.get("refresh_token")
+        if not refresh_token:
+            return Response({"error": "refresh_token required"}, status=400)
+        access_token = refresh_access(refresh_token)
+        if not access_token:
+            return Response({"error": "Invalid or revoked refresh token"}, status=401)
+        return Response({"access_token": access_token}, status=200)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class NewCountry(APIView):
     permission_classes = [IsAuthenticated, IsScoreAdmin] # Permet de vérifier si l'utilisateur est connecté
@@ -112,7 +130,6 @@ class CountrySubscribe(APIView):
     permission_classes = [IsAuthenticated, IsScoreAdmin]
 
     def post(self, request: Request):
-        user = request.user
         plan = request.data.get("plan")
         name = request.data.get("name")
         # Check country
@@ -125,10 +142,10 @@ class CountrySubscribe(APIView):
         # Check plan
         if plan not in ["monthly", "annual"]:
             return Response({'error': "Invalid plan"}, status=400)
-        actives = country.subscriptions.filter(expires_in__gt=now())
+        latest = country.subscriptions.filter(expires_in__gt=now()).order_by("-expires_in").first()
         target = now()
-        if (actives.exists()):
-            target = actives.order_by("-expires_in").first().expires_in
+        if (latest):
+            target = latest.expires_in
         if (plan == "monthly"):
             end_date = target + relativedelta(months=1)
         elif (plan == "annual"):
@@ -147,7 +164,6 @@ class CountryData(APIView):
     permission_classes = [IsAuthenticated, IsScoreAdmin]
 
     def get(self, request: Request, country_name: str):
-        user = request.user
         try:
             country = Country.objects.get(name=country_name)
         except Country.DoesNotExist:
@@ -207,10 +223,12 @@ class ChangePassword(APIView):
 
         user.set_password(new_password)
         user.password_changed = True
-        user.save()
+        user.save(update_fields=["password", "password_changed"])
+        # Tokens issued before carry password_changed=False and the old password
+        revoke_tokens(user)
 
         return Response(
-            {"message": "Mot de passe modifié avec succès."},
+            {"message": "Mot de passe modifié avec succès.", **issue_tokens(user)},
             status=status.HTTP_200_OK
         )
     
@@ -225,23 +243,39 @@ class CountryListView(APIView):
         return Response(serializer.data)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class BloomFilterStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsScoreAdmin]
+
+    def get(self, request):
+        try:
+            stats = bloom.statistics()
+        except bloom.UNAVAILABLE:
+            return Response({'error': "Redis unavailable"}, status=503)
+        return Response(stats)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class HuissierCustomerListView(APIView):
     permission_classes = [IsAuthenticated, IsHuissier]
 
     def get(self, request):
-        user = request.user
-
         # Suppose que le modèle Huissier est lié à User via OneToOne
-        huissier = getattr(user, "huissier", None)
+        huissier = request.actor.huissier
         if not huissier:
             return Response({"detail": "Vous n'êtes pas un huissier."}, status=403)
 
-        customers = Customer.objects.filter(huissier=huissier)
-        serializer = CustomerListSerializer(customers, many=True)
-        return Response({
-            'customers': serializer.data
+        try:
+            paginator = KeysetPagination(request)
+        except InvalidPage as e:
+            return Response({'error': str(e)}, status=400)
+
+        customers = with_loans(Customer.objects.filter(huissier=huissier).select_related('features'))
+        page = paginator.paginate_queryset(customers)
+        serializer = CustomerListSerializer(page, many=True, context={
+            'creditor_names': CreditorNames.for_customers(page)
         })
+        return Response(paginator.get_response_data('customers', serializer.data))
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -249,8 +283,7 @@ class CustomerLoanDetailView(APIView):
     permission_classes = [IsAuthenticated, IsHuissier]
 
     def get(self, request, customer_id):
-        user = request.user
-        huissier = getattr(user, "huissier", None)
+        huissier = request.actor.huissier
 
         try:
             customer = Customer.objects.get(uuid=customer_id)
@@ -263,30 +296,69 @@ class CustomerLoanDetailView(APIView):
         if customer.huissier != huissier:
             return Response({"detail": "Non autorisé"}, status=403)
 
-        loans = Loan.objects.filter(customer=customer)
+        loans = Loan.objects.filter(customer=customer).prefetch_related('repayments')
         serializer = LoanSerializer(loans, many=True)
         return Response({
             'customer': CustomerSerializer(customer).data,
+            'percentile': percentile(customer.country_id, customer.credit_score),
             'loans': serializer.data
         })
 
+@method_decorator(csrf_exempt, name='dispatch')
+class CustomerScoreHistoryView(APIView):
+    permission_classes = [IsAuthenticated, IsHuissier]
+
+    def get(self, request, customer_id):
+        huissier = request.actor.huissier
+        try:
+            customer = Customer.objects.get(uuid=customer_id)
+        except Customer.DoesNotExist:
+            return Response({
+                'error': "Customer not found"
+            }, status=404)
+        if customer.huissier_id != getattr(huissier, "id", None):
+            return Response({"detail": "Non autorisé"}, status=403)
+
+        # ?date=YYYY-MM-DD gives the score at the end of that day
+        as_of = request.GET.get("date")
+        if as_of:
+            day = parse_date(as_of)
+            if not day:
+                return Response({
+                    'error': "Invalid date, expected YYYY-MM-DD"
+                }, status=400)
+            moment = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min)) - timedelta(microseconds=1)
+        else:
+            moment = timezone.now()
+        try:
+            points = min(max(int(request.GET.get("points", 50)), 2), 500)
+        except ValueError:
+            return Response({
+                'error': "Invalid points"
+            }, status=400)
+
+        return Response({
+            'customer': customer.uuid,
+            'as_of': moment,
+            'score': score_as_of(customer, moment),
+            'series': [
+                {'date': effective_date, 'score': score}
+                for effective_date, score in score_series(customer, moment, points)
+            ]
+        })
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class HuissierAlertsView(APIView):
     permission_classes = [IsAuthenticated, IsHuissier]
 
     def get(self, request):
-        user = request.user
-        huissier = getattr(user, "huissier", None)
-
-        loans = Loan.objects.filter(
-            customer__huissier=huissier,
-            deadline__lt=date.today(),
-        ).exclude(status="done")
+        huissier = request.actor.huissier
 
-        serializer = LoanSerializer(loans, many=True)
+        alerts = overdue_alerts(huissier, date.today())
         return Response({
-            "alerts": serializer.data,
-            "total_alerts": loans.count()
+            "alerts": alerts,
+            "total_alerts": len(alerts)
         })
 
 
@@ -295,15 +367,17 @@ class ZoneCustomerListView(APIView):
     permission_classes = [IsAuthenticated, IsHuissier]
 
     def get(self, request):
-        user = request.user
-        huissier = getattr(user, "huissier", None)
+        huissier = request.actor.huissier
         zone = huissier.zone
 
-        customers = Customer.objects.filter(zone=zone)
+        try:
+            paginator = KeysetPagination(request)
+        except InvalidPage as e:
+            return Response({'error': str(e)}, status=400)
+
+        customers = paginator.paginate_queryset(Customer.objects.filter(zone=zone))
         serializer = CustomerSerializer(customers, many=True)
-        return Response({
-            'customers': serializer.data
-        })
+        return Response(paginator.get_response_data('customers', serializer.data))
 @method_decorator(csrf_exempt, name='dispatch')
 class SendEm(APIView):
     permission_classes = [AllowAny]
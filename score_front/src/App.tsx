@@ -14,6 +14,7 @@ import HomePage from './pages/HomePage';
 import CountryRepresentativesPage from './pages/CountryRepresentativesPage';
 import FrontOfficePage from './pages/FrontOfficePage';
 import InfosClientPage from './pages/InfosClientPage';
+import CreditScorePage from './pages/creditscore';
 
 function App() {
   const { isAuthenticated } = useAuth();
@@ -34,6 +35,7 @@ function App() {
       <Route path="/notifications" element={<ProtectedRoute><NotificationsPage /></ProtectedRoute>} />
       <Route path="/settings" element={<ProtectedRoute><SettingsPage /></ProtectedRoute>} />
       <Route path="/infos-client" element={<InfosClientPage />} />
+      <Route path="/creditscore" element={<ProtectedRoute><CreditScorePage /></ProtectedRoute>} />
       
       <Route path="*" element={<Navigate to="/\" replace />} />
     </Routes>
@@ -166,6 +166,13 @@ export function AuthProvider({ children }: { children: ReactNode }) {
         console.error('Erreur changement mot de passe:', errorData);
         throw new Error(errorData.message || 'Échec du changement de mot de passe');
       }
+
+      // Les anciens tokens sont révoqués par le changement de mot de passe
+      const data: Pick<TokenResponse, 'access_token' | 'refresh_token'> = await response.json();
+      setAccessToken(data.access_token);
+      setRefreshToken(data.refresh_token);
+      localStorage.setItem('accessToken', data.access_token);
+      localStorage.setItem('refreshToken', data.refresh_token);
     } catch (error) {
       console.error('Erreur changement mot de passe:', error);
       throw error;
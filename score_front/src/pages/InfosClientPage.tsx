@@ -4,6 +4,7 @@ import DashboardLayout from '../components/layouts/DashboardLayout';
 import GaugeChart from 'react-gauge-chart';
 import { Plus, Check, User, Phone, Mail, CreditCard, Loader2, Search } from "lucide-react";
 import { useAuth } from '../context/AuthContext';
+import { customerAPI } from '../services/api';
 
 interface Debt {
   id: number;
@@ -65,6 +66,28 @@ interface NewDebtForm {
   creditor_npi: string;
 }
 
+// Interface pour le formulaire de simulation (même champs qu'une dette, sans code ni créancier)
+interface SimulationForm {
+  amount: string;
+  periodicity: string;
+  deadline_amount: string;
+  deadline: string;
+}
+
+// Réponse de /customer/simulate-loan/
+interface SimulationResult {
+  score: number;
+  projected_score: number;
+  delta: number;
+}
+
+const emptySimulation: SimulationForm = {
+  amount: "",
+  periodicity: "",
+  deadline_amount: "",
+  deadline: ""
+};
+
 const InfosClientPage = () => {
   const navigate = useNavigate();
   const location = useLocation();
@@ -86,6 +109,11 @@ const InfosClientPage = () => {
   const [loanCode, setLoanCode] = useState("");
   const [loadingCode, setLoadingCode] = useState(false);
   const [creatingDebt, setCreatingDebt] = useState(false);
+  const [showSimulation, setShowSimulation] = useState(false);
+  const [simulation, setSimulation] = useState<SimulationForm>(emptySimulation);
+  const [simulationResult, setSimulationResult] = useState<SimulationResult | null>(null);
+  const [simulationError, setSimulationError] = useState("");
+  const [simulating, setSimulating] = useState(false);
 
   if (!serverClient) {
     return (
@@ -285,6 +313,27 @@ const InfosClientPage = () => {
     }
   };
 
+  // Fonction pour simuler l'effet d'un prêt sur le score, sans l'enregistrer
+  const handleSimulate = async () => {
+    if (!simulation.amount.trim() || !simulation.periodicity.trim() || !simulation.deadline_amount.trim() ||
+        !simulation.deadline.trim()) {
+      setSimulationError("Veuillez remplir tous les champs");
+      return;
+    }
+
+    setSimulating(true);
+    setSimulationError("");
+    setSimulationResult(null);
+    try {
+      const response = await customerAPI.simulateLoan({ npi: clientState.npi, ...simulation });
+      setSimulationResult(response.data);
+    } catch (error: any) {
+      setSimulationError(error.response?.data?.error || "Erreur lors de la simulation");
+    } finally {
+      setSimulating(false);
+    }
+  };
+
   const markAsPaid = (id: number) => {
     const updatedDebts = clientState.loans.map(debt =>
       debt.id === id ? { ...debt, status: "Remboursé" } : debt
@@ -380,7 +429,101 @@ const InfosClientPage = () => {
                   <p className="text-lg font-semibold text-gray-700">
                     Score: <span className="text-2xl text-blue-600">{clientState.creditScore}</span>/100
                   </p>
+                  <button
+                    onClick={() => navigate(`/creditscore?uuid=${clientState.uuid}`)}
+                    className="text-blue-600 hover:underline text-sm mt-2"
+                  >
+                    Voir l'historique du score
+                  </button>
+                </div>
+              </div>
+
+              {/* Simulation de prêt */}
+              <div className="bg-white border border-gray-200 rounded-lg p-6 mb-8">
+                <div className="flex justify-between items-center mb-4">
+                  <h2 className="text-xl font-semibold text-gray-800">Simulation de prêt</h2>
+                  <button
+                    onClick={() => {
+                      setShowSimulation(!showSimulation);
+                      setSimulation(emptySimulation);
+                      setSimulationResult(null);
+                      setSimulationError("");
+                    }}
+                    className="bg-blue-600 text-white px-4 py-2 rounded-lg hover:bg-blue-700 transition-colors flex items-center gap-2"
+                  >
+                    <Search size={18} />
+                    {showSimulation ? "Fermer" : "Simuler"}
+                  </button>
                 </div>
+
+                {showSimulation && (
+                  <div className="bg-gray-50 p-4 rounded-lg border space-y-3">
+                    <div className="grid grid-cols-1 md:grid-cols-2 gap-3">
+                      <input
+                        type="number"
+                        placeholder="Montant (ex: 100000)"
+                        value={simulation.amount}
+                        onChange={(e) => setSimulation({ ...simulation, amount: e.target.value })}
+                        className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                      />
+                      <select
+                        value={simulation.periodicity}
+                        onChange={(e) => setSimulation({ ...simulation, periodicity: e.target.value })}
+                        className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                      >
+                        <option value="">Sélectionner la périodicité</option>
+                        <option value="monthly">Mensuel</option>
+                        <option value="quarterly">Trimestriel</option>
+                        <option value="yearly">Annuel</option>
+                      </select>
+                    </div>
+
+                    <div className="grid grid-cols-1 md:grid-cols-2 gap-3">
+                      <input
+                        type="number"
+                        placeholder="Montant final (ex: 120000)"
+                        value={simulation.deadline_amount}
+                        onChange={(e) => setSimulation({ ...simulation, deadline_amount: e.target.value })}
+                        className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                      />
+                      <input
+                        type="date"
+                        value={simulation.deadline}
+                        onChange={(e) => setSimulation({ ...simulation, deadline: e.target.value })}
+                        className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                      />
+                    </div>
+
+                    <button
+                      onClick={handleSimulate}
+                      disabled={simulating}
+                      className="w-full bg-green-600 text-white py-2 rounded-lg hover:bg-green-700 transition-colors disabled:opacity-50 disabled:cursor-not-allowed flex items-center justify-center gap-2"
+                    >
+                      {simulating ? (
+                        <>
+                          <Loader2 size={16} className="animate-spin" />
+                          Simulation...
+                        </>
+                      ) : (
+                        "Simuler le prêt"
+                      )}
+                    </button>
+
+                    {simulationError && <div className="text-sm text-red-600">{simulationError}</div>}
+
+                    {simulationResult && (
+                      <div className="bg-white p-4 rounded-lg border text-center">
+                        <p className="text-sm text-gray-500">Score projeté</p>
+                        <p className="text-2xl font-semibold text-blue-600">
+                          {simulationResult.projected_score.toFixed(2)}/100
+                        </p>
+                        <p className={`text-sm font-medium ${simulationResult.delta < 0 ? 'text-red-600' : 'text-green-600'}`}>
+                          {simulationResult.delta > 0 ? '+' : ''}{simulationResult.delta} par rapport au score actuel ({simulationResult.score})
+                        </p>
+                      </div>
+                    )}
+                  </div>
+                )}
               </div>
 
               {/* Dettes & Remboursements */}
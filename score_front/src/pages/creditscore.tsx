@@ -1,9 +1,19 @@
 // pages/creditscore.tsx
 import { useNavigate, useLocation } from "react-router-dom";
-import React, { useState } from "react";
+import React, { useEffect, useState } from "react";
 import DashboardLayout from '../components/layouts/DashboardLayout';
 import GaugeChart from 'react-gauge-chart';
-import { Plus, Check } from "lucide-react";
+import { CartesianGrid, Line, LineChart, ResponsiveContainer, Tooltip, XAxis, YAxis } from 'recharts';
+import { Plus, Check, Loader2 } from "lucide-react";
+import { customerAPI } from '../services/api';
+
+// Réponse de /score/customers/<uuid>/score-history/
+interface ScoreHistory {
+  customer: string;
+  as_of: string;
+  score: number | null;
+  series: { date: string; score: number }[];
+}
 
 const clientsData = [
   {
@@ -76,11 +86,85 @@ const CreditScorePage = () => {
   const location = useLocation();
   const queryParams = new URLSearchParams(location.search);
   const debtor = queryParams.get('debtor');
+  const uuid = queryParams.get('uuid');
 
   const initialClient = clientsData.find(c => c.name === debtor);
   const [client, setClient] = useState(initialClient);
   const [showForm, setShowForm] = useState(false);
   const [newDebt, setNewDebt] = useState({ amount: "", type: "" });
+  const [history, setHistory] = useState<ScoreHistory | null>(null);
+  const [loadingHistory, setLoadingHistory] = useState(false);
+  const [historyError, setHistoryError] = useState("");
+
+  useEffect(() => {
+    if (!uuid) return;
+    setLoadingHistory(true);
+    setHistoryError("");
+    customerAPI.scoreHistory(uuid, { points: 50 })
+      .then(response => setHistory(response.data))
+      .catch(() => setHistoryError("Impossible de charger l'historique du score."))
+      .finally(() => setLoadingHistory(false));
+  }, [uuid]);
+
+  if (uuid) {
+    const score = history?.score ?? null;
+    return (
+      <DashboardLayout>
+        <div className="card">
+          <button onClick={() => navigate(-1)} className="text-primary mb-4">&larr; Retour</button>
+          <h1 className="text-2xl font-bold mb-6">Historique du score</h1>
+
+          {loadingHistory && (
+            <div className="flex items-center gap-2 text-gray-600">
+              <Loader2 className="animate-spin" size={18} /> Chargement...
+            </div>
+          )}
+          {historyError && <div className="text-red-600">{historyError}</div>}
+
+          {history && (
+            <>
+              <div className="mb-8">
+                <h2 className="text-xl font-semibold mb-4">Score de crédit</h2>
+                {score === null ? (
+                  <div className="text-gray-500">Aucun score enregistré à cette date.</div>
+                ) : (
+                  <div className="w-full md:w-1/2 mx-auto">
+                    <GaugeChart
+                      id="credit-score-gauge"
+                      nrOfLevels={20}
+                      percent={score / 100}
+                      colors={['#EA4228', '#F5CD19', '#5BE12C']}
+                      arcWidth={0.3}
+                      textColor="#11f1f1"
+                      formatTextValue={() => `${score}`}
+                    />
+                  </div>
+                )}
+              </div>
+
+              <div>
+                <h2 className="text-xl font-semibold mb-4">Évolution du score</h2>
+                <div className="bg-gray-50 p-4 rounded-lg shadow h-72">
+                  <ResponsiveContainer width="100%" height="100%">
+                    <LineChart data={history.series}>
+                      <CartesianGrid strokeDasharray="3 3" />
+                      <XAxis
+                        dataKey="date"
+                        tickFormatter={(date) => new Date(date).toLocaleDateString('fr-FR')}
+                      />
+                      <YAxis domain={[0, 100]} />
+                      <Tooltip labelFormatter={(date) => new Date(date).toLocaleString('fr-FR')} />
+                      <Line type="stepAfter" dataKey="score" stroke="#2563eb" dot={false} />
+                    </LineChart>
+                  </ResponsiveContainer>
+                </div>
+              </div>
+            </>
+          )}
+        </div>
+      </DashboardLayout>
+    );
+  }
 
   if (!client) {
     return (
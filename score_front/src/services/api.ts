@@ -106,6 +106,17 @@ export const customerAPI = {
   }) => api.post('/customer/verify/', data),
   
   validateCode: (code: string) => api.post('/customer/validate-code/', { code }),
+
+  simulateLoan: (data: {
+    npi: string;
+    amount: string;
+    periodicity: string;
+    deadline_amount: string;
+    deadline: string;
+  }) => api.post('/customer/simulate-loan/', data),
+
+  scoreHistory: (uuid: string, params?: { date?: string; points?: number }) =>
+    api.get(`/score/customers/${uuid}/score-history/`, { params }),
 };
 
 export default api;
\ No newline at end of file